@@ -0,0 +1,332 @@
+## Sort and Map UAV Images in batch mode
+## (c) Andy Lyons, 2017
+
+## Runs the same steps as parse-uav-imgs.py on many folders at once, with the
+## settings in a config file and no prompts, and ends with a summary of every
+## folder.
+
+## Usage:
+## python batch-uav-imgs.py config.ini
+## python batch-uav-imgs.py config.ini "D:\Drone Projects\2017-08-*" "E:\Cards\**"
+
+## The config file has the options in an [options] section, with the same names
+## as at the top of parse-uav-imgs.py (press 'w' in the menu of parse-uav-imgs.py
+## to save the settings you've chosen there). Options that aren't in the file
+## keep their defaults. An optional [batch] section controls the batch run:
+##   folders = folders or glob patterns, one per line (** matches any number of
+##             subfolders). Used if no folders are given on the command line.
+##   recursive = yes to also process every subfolder that has images
+##   cpuWorkers = number of folders read and grouped at once (0 = one per core)
+##   ioWorkers = number of folders being moved or copied and exported at once
+##     (at most cpuWorkers)
+##   overwrite = yes to place images in flight subdirectories that already exist
+##     (otherwise those folders are skipped)
+##   summaryCsv = also save the summary in this csv file
+##   maxImagesInMemory = folders with more images than this are sorted out of
+##     core (0 = never, see uav_pipeline.sort_large_folder)
+##   sortTempDir = folder for the sorted runs (default the system's temp folder)
+
+## Reading the headers, grouping the images into flights, finding re-flown images
+## and the coverage analysis are CPU bound, so the folders are processed in a
+## pool of processes. Each process also moves or copies the images and exports
+## the layers of its folder, so the image records never have to be sent back to
+## the main process; only ioWorkers folders are placed at once (the others wait
+## for a turn), and one folder's images are being placed while the next folders
+## are read. An unfinished move or copy (see place_files.py) is resumed instead
+## of processing the folder again.
+
+## Folders with more than maxImagesInMemory images (e.g. a season's archive) are
+## sorted out of core: the records go into sorted runs on disk that are merged by
+## time, and each flight is placed and exported as soon as it ends, all in the
+## CPU stage. Only the flight subdirectories and their point shapefiles are made.
+
+import os, sys, glob, time, csv, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import exif_reader, flight_groups, place_files, uav_pipeline
+
+## The [batch] settings and their defaults
+BATCH_DEFAULTS = [
+    ("folders", ""),
+    ("recursive", False),
+    ("cpuWorkers", 0),
+    ("ioWorkers", 2),
+    ("overwrite", False),
+    ("summaryCsv", ""),
+    ("maxImagesInMemory", 0),
+    ("sortTempDir", ""),
+]
+BATCH_SECTION = "batch"
+
+SUMMARY_COLUMNS = ["Folder", "Images", "Excluded", "Flights", "Reflown", "Placed", "Errors", "Outputs", "Seconds", "Status"]
+
+## What happened to one folder
+class FolderResult(object):
+    def __init__(self, fnInputDir):
+        self.fnInputDir = fnInputDir
+        self.status = "ok"
+        self.resume = False
+        self.imgs = None
+        self.flights = []
+        self.dupOfFns = None
+        self.coverage = None
+        self.num_images = 0
+        self.num_excluded = 0
+        self.num_reflown = 0
+        self.num_placed = 0
+        self.errors = []
+        self.outputs = []
+        self.secs = 0.0
+
+    def summary_row(self):
+        return [self.fnInputDir, self.num_images, self.num_excluded, len(self.flights), self.num_reflown, self.num_placed,
+                len(self.errors), len(self.outputs), "%.1f" % self.secs, self.status]
+
+## Log function that prefixes each message with the folder name
+def folder_log(fnInputDir):
+    name = uav_pipeline.input_last_dir(fnInputDir)
+    def log(msg, color=None):
+        print("[" + name + "] " + msg)
+    return log
+
+## Read the batch settings from the config file
+def batch_settings(config):
+    settings = dict(BATCH_DEFAULTS)
+    if config.has_section(BATCH_SECTION):
+        for name, text in config.items(BATCH_SECTION):
+            if name not in settings:
+                raise ValueError("unknown setting in [" + BATCH_SECTION + "]: " + name)
+            settings[name] = text if name in ("folders", "summaryCsv", "sortTempDir") else uav_pipeline.parse_option(text, settings[name])
+    return settings
+
+## The folders to process: every directory matching the patterns (plain folder
+## names or glob patterns), and if recursive, every subfolder of them with images.
+## Flight subdirectories made by earlier runs (names that match the template, see
+## flight_groups.subdir_pattern) and their subfolders are left out. Each folder is
+## listed once, in the order found.
+def find_folders(patterns, recursive=False, template=None):
+    subdir = flight_groups.subdir_pattern(template) if template else None
+    def is_flight(name):
+        return subdir is not None and subdir.match(name) is not None
+    folders = []
+    seen = set()
+    def add(fn):
+        fnAbs = os.path.abspath(fn)
+        if fnAbs not in seen:
+            seen.add(fnAbs)
+            folders.append(fn)
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern.strip().strip('\'"'))
+        if pattern == "":
+            continue
+        if glob.has_magic(pattern):
+            ## Only the parts of the path matched by the pattern can be flight subdirectories
+            root = pattern
+            while glob.has_magic(root):
+                root = os.path.dirname(root)
+            matches = [fn for fn in sorted(glob.glob(pattern, recursive=True))
+                       if not any(is_flight(name) for name in os.path.relpath(fn, root or os.curdir).split(os.sep))]
+        else:
+            matches = [pattern]
+        for fn in matches:
+            if not os.path.isdir(fn):
+                continue
+            if recursive:
+                for dirpath, dirnames, filenames in os.walk(fn):
+                    dirnames[:] = sorted(name for name in dirnames if not is_flight(name))
+                    if len(exif_reader.list_images(dirpath)) > 0:
+                        add(dirpath)
+            else:
+                add(fn)
+    return folders
+
+## Number of images in a folder, without listing them all at once
+def count_images(fnInputDir):
+    return sum(1 for fn in exif_reader.iter_images(fnInputDir))
+
+## CPU stage (runs in a worker process): read the headers, make the flights, and
+## find re-flown images and coverage. Folders with more than maxImages images
+## (if it's not 0) are sorted out of core instead (see sort_large).
+def analyze_folder(fnInputDir, opt, maxImages=0, tmpdir="", overwrite=False):
+    t0 = time.time()
+    log = folder_log(fnInputDir)
+    result = FolderResult(fnInputDir)
+    if uav_pipeline.unfinished_placement(fnInputDir) is not None:
+        log("Found an unfinished move or copy, it will be resumed")
+        result.resume = True
+        result.secs = time.time() - t0
+        return result
+    if maxImages > 0:
+        numImages = count_images(fnInputDir)
+        if numImages > maxImages:
+            log(str(numImages) + " images, sorting them out of core")
+            sort_large(result, opt, maxImages, tmpdir, overwrite, log)
+            result.secs = time.time() - t0
+            return result
+
+    log("Reading image headers")
+    imgs, tagsMissing, fnsExcluded = uav_pipeline.read_images(fnInputDir, opt, log)
+    result.num_images = len(imgs)
+    result.num_excluded = len(fnsExcluded)
+    if len(imgs) == 0:
+        result.status = "no images"
+    elif len(tagsMissing) > 0:
+        result.status = "required tag(s) not found: " + ", ".join(tagsMissing)
+    if result.status != "ok":
+        result.secs = time.time() - t0
+        return result
+
+    si = uav_pipeline.StreamInfo(imgs, opt.m2s_StreamKey)
+    result.flights = uav_pipeline.group_flights(imgs, opt, si)
+    if opt.m2s_YN:
+        log(str(len(imgs)) + " images in " + str(len(result.flights)) + " flight subdirectories")
+        if opt.m2s_DupDetectYN:
+            result.dupOfFns, result.num_reflown = uav_pipeline.find_reflown(fnInputDir, imgs, result.flights, opt, si, log)
+    if opt.shpCreateYN:
+        uav_pipeline.project_images(imgs, opt, log)
+        if opt.coverageYN:
+            result.coverage = uav_pipeline.coverage_analysis(fnInputDir, imgs, result.flights, opt, log)
+    result.imgs = imgs
+    result.secs = time.time() - t0
+    return result
+
+## Sort a folder that's too big to hold in memory, placing and exporting each
+## flight as it ends (see uav_pipeline.sort_large_folder). Each sorted run has up
+## to maxImages images.
+def sort_large(result, opt, maxImages, tmpdir, overwrite, log):
+    summary = uav_pipeline.sort_large_folder(result.fnInputDir, opt, maxImages, tmpdir, overwrite, log)
+    result.num_images = summary.num_images
+    result.num_excluded = summary.num_excluded
+    result.flights = summary.flights
+    result.num_placed = summary.num_placed
+    result.errors = summary.errors
+    result.outputs = summary.outputs
+    if summary.num_images == 0:
+        result.status = "no images"
+    elif len(summary.tags_missing) > 0:
+        result.status = "required tag(s) not found: " + ", ".join(summary.tags_missing)
+    elif len(summary.skipped) > 0:
+        result.status = "skipped " + str(len(summary.skipped)) + " flight(s), subdirectories already exist (" + ", ".join(summary.skipped) + ")"
+    return result
+
+## I/O stage: move or copy the images into their flight subdirectories and
+## export the layers
+def finish_folder(result, opt, overwrite=False):
+    t0 = time.time()
+    log = folder_log(result.fnInputDir)
+    if result.resume:
+        mode, numJobs, numDone = uav_pipeline.unfinished_placement(result.fnInputDir)
+        result.errors = uav_pipeline.resume_placement(result.fnInputDir, opt, False)
+        result.num_placed = numJobs - numDone - len(result.errors)
+        result.status = "resumed " + mode
+    elif result.imgs is not None:
+        if opt.m2s_YN:
+            placements, existingSubDirs = uav_pipeline.plan_placements(result.fnInputDir, result.imgs, result.flights)
+            if len(existingSubDirs) > 0 and not overwrite:
+                result.status = "skipped, flight subdirectories already exist (" + ", ".join(existingSubDirs) + ")"
+                result.secs += time.time() - t0
+                return result
+            log(("Moving " if opt.m2s_MoveCopy == "move" else "Copying ") + str(len(placements)) + " files")
+            result.errors = uav_pipeline.place_images(result.fnInputDir, placements, opt, False)
+            result.num_placed = len(placements) - len(result.errors)
+        if opt.shpCreateYN:
+            result.outputs = uav_pipeline.export_layers(result.fnInputDir, result.imgs, result.flights, opt, result.dupOfFns, result.coverage)
+            if result.coverage is not None:
+                result.outputs.append(os.path.join(result.fnInputDir, uav_pipeline.input_last_dir(result.fnInputDir) + opt.coverage_file_suffix))
+        ## The images aren't needed any more (and aren't sent back to the main process)
+        result.imgs = None
+        result.dupOfFns = None
+        result.coverage = None
+    for fnSrc, fnDest, e in result.errors:
+        log("Error placing " + fnSrc + ": " + str(e))
+    if len(result.errors) > 0:
+        result.status = str(len(result.errors)) + " file(s) not placed"
+    result.secs += time.time() - t0
+    log("Done (" + result.status + ")")
+    return result
+
+## Semaphore shared by the worker processes, limiting the number of folders
+## being placed and exported at once
+io_slots = None
+
+def init_worker(slots):
+    global io_slots
+    io_slots = slots
+
+## Runs in a worker process: analyze a folder, then wait for a turn to place
+## and export it
+def process_folder(fnInputDir, opt, maxImages=0, tmpdir="", overwrite=False):
+    result = analyze_folder(fnInputDir, opt, maxImages, tmpdir, overwrite)
+    if io_slots is None:
+        return finish_folder(result, opt, overwrite)
+    with io_slots:
+        return finish_folder(result, opt, overwrite)
+
+## Print the summary table, with a line for each folder and the totals
+def print_summary(results, elapsed):
+    rows = [[str(x) for x in result.summary_row()] for result in results]
+    totals = [sum(int(row[k]) for row in rows) for k in range(1, 8)]
+    rows.append(["Total (" + str(len(results)) + " folders)"] + [str(x) for x in totals] + [place_files.fmt_secs(elapsed), ""])
+    widths = [max(len(SUMMARY_COLUMNS[k]), max(len(row[k]) for row in rows)) for k in range(len(SUMMARY_COLUMNS) - 1)]
+    print("\n" + "  ".join(SUMMARY_COLUMNS[k].ljust(widths[k]) for k in range(len(widths))) + "  " + SUMMARY_COLUMNS[-1])
+    for i, row in enumerate(rows):
+        if i == len(rows) - 1:
+            print("  ".join("-" * w for w in widths))
+        print("  ".join((row[k].ljust(widths[k]) if k == 0 else row[k].rjust(widths[k])) for k in range(len(widths))) + "  " + row[-1])
+
+def write_summary(fnCsv, results):
+    with open(fnCsv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_COLUMNS)
+        for result in results:
+            writer.writerow(result.summary_row())
+    return fnCsv
+
+def main(argv):
+    if len(argv) < 2:
+        print("Usage: python batch-uav-imgs.py config.ini [folder or glob pattern ...]")
+        return 1
+    opt = uav_pipeline.Options()
+    try:
+        config = uav_pipeline.read_config(argv[1], opt)
+        settings = batch_settings(config)
+    except ValueError as e:
+        print("Error reading the config file: " + str(e))
+        return 1
+
+    patterns = argv[2:] if len(argv) > 2 else settings["folders"].splitlines()
+    folders = find_folders(patterns, settings["recursive"], opt.m2s_SubdirTemplate)
+    if len(folders) == 0:
+        print("No folders found")
+        return 1
+
+    cpuWorkers = settings["cpuWorkers"] if settings["cpuWorkers"] > 0 else (os.cpu_count() or 1)
+    cpuWorkers = min(cpuWorkers, len(folders))
+    ioWorkers = min(max(1, settings["ioWorkers"]), cpuWorkers)
+    ## Share the cores between the folders being read at once
+    if opt.exiftool_workers < 1:
+        opt.exiftool_workers = max(1, (os.cpu_count() or 1) // cpuWorkers)
+    print("Processing " + str(len(folders)) + " folder(s), " + str(cpuWorkers) + " at a time (" + str(ioWorkers) + " placing files)")
+
+    t0 = time.time()
+    results = {}
+    slots = multiprocessing.Semaphore(ioWorkers)
+    with ProcessPoolExecutor(max_workers=cpuWorkers, initializer=init_worker, initargs=(slots,)) as pool:
+        futures = dict((pool.submit(process_folder, fn, opt, settings["maxImagesInMemory"], settings["sortTempDir"], settings["overwrite"]), fn) for fn in folders)
+        for future in as_completed(futures):
+            fn = futures[future]
+            try:
+                results[fn] = future.result()
+            except Exception as e:
+                result = FolderResult(fn)
+                result.status = "error: " + str(e)
+                results[fn] = result
+                folder_log(fn)("Error: " + str(e))
+
+    results = [results[fn] for fn in folders]
+    print_summary(results, time.time() - t0)
+    if settings["summaryCsv"] != "":
+        print("Saved the summary to " + write_summary(settings["summaryCsv"], results))
+    return 0 if all(result.status == "ok" or result.status.startswith("resumed") for result in results) else 2
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
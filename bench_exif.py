@@ -0,0 +1,64 @@
+## Benchmark the built-in EXIF reader against exiftool
+## (c) Andy Lyons, 2017
+
+## Reads the same tags that parse-uav-imgs.py uses from every image in a folder,
+## first with exif_reader and then with exiftool, and reports the time each took
+## and any values that don't agree.
+
+## Usage:
+## python bench_exif.py "C:\Pix4D\Test\Test_SeqMixed"
+
+import os, sys, csv, time, tempfile
+from subprocess import call
+from distutils import spawn
+import exif_reader
+
+tagsAll = ["DateTimeOriginal", "GPSLatitude", "GPSLongitude", "FlightYawDegree", "GimbalYawDegree"]
+
+if len(sys.argv) == 1:
+    print("Please pass a directory name")
+    quit()
+fnInputDir = sys.argv[1].strip('\'"')
+
+## Time the built-in reader
+t0 = time.time()
+rows, fallback = exif_reader.read_dir(fnInputDir, tagsAll)
+t_reader = time.time() - t0
+print("exif_reader: " + str(len(rows)) + " images in %.3f seconds (%.0f images/sec)" % (t_reader, len(rows) / max(t_reader, 1e-9)))
+if len(fallback) > 0:
+    print("  " + str(len(fallback)) + " image(s) could not be parsed, e.g. " + fallback[0])
+
+if spawn.find_executable("exiftool") is None:
+    print("exiftool not found, skipping the comparison")
+    quit()
+
+## Time exiftool, the same way parse-uav-imgs.py used to call it
+fnCSV = os.path.join(tempfile.gettempdir(), "bench_exif_info.csv")
+strCmd = "exiftool -if \"$filesize# > 0\" -filename -" + " -".join(tagsAll) + " -n -csv \"" + fnInputDir + "\" > \"" + fnCSV + "\""
+t0 = time.time()
+call(strCmd, shell=True)
+with open(fnCSV) as fCSV:
+    et_rows = list(csv.DictReader(fCSV))
+t_exiftool = time.time() - t0
+os.remove(fnCSV)
+print("exiftool:    " + str(len(et_rows)) + " images in %.3f seconds (%.0f images/sec)" % (t_exiftool, len(et_rows) / max(t_exiftool, 1e-9)))
+print("Speedup: %.1fx" % (t_exiftool / max(t_reader, 1e-9)))
+
+## Compare the values (numerically where possible)
+et_by_fn = dict((row["FileName"], row) for row in et_rows)
+num_diff = 0
+for row in rows:
+    et_row = et_by_fn.get(row["FileName"])
+    if et_row is None:
+        continue
+    for tag in tagsAll:
+        a, b = row[tag], et_row.get(tag, "")
+        try:
+            same = abs(float(a) - float(b)) < 1e-9
+        except ValueError:
+            same = a == b
+        if not same:
+            num_diff = num_diff + 1
+            if num_diff <= 10:
+                print("  " + row["FileName"] + " " + tag + ": " + a + " (exif_reader) vs " + b + " (exiftool)")
+print(str(num_diff) + " value(s) differ")
@@ -0,0 +1,234 @@
+## Benchmark each stage of sorting and mapping a folder of images
+## (c) Andy Lyons, 2017
+
+## Makes a folder of synthetic images (see make_synthetic_imgs.py), or uses an
+## existing folder, and times each stage of the pipeline separately:
+##   extraction  reading the image headers (built-in reader, no header cache)
+##   exiftool    the same with exiftool (only with --exiftool)
+##   csv_parse   parsing the header info from a csv file like exiftool's into
+##               the image records
+##   sort        sorting the records by time (from a shuffled order)
+##   segmentation  splitting the images into streams and flights
+##   placement   copying (or moving) the images into flight subdirectories
+##   export      writing the point shapefile of each flight
+## Each stage is run --repeat times and the best time is kept. The results are
+## saved in a JSON file, with the Python and numpy versions and the git commit of
+## the scripts, and --compare prints the ratio to the times in an earlier one, so
+## a slowdown in one of the stages shows up between versions.
+
+## The images are read right after they're made (or read once before the
+## extraction is timed), so they're in the OS file cache: the extraction time is
+## the cost of parsing the headers, not of the disk.
+
+## Usage:
+## python bench_pipeline.py --images 10000 --flights 20 --out bench.json
+## python bench_pipeline.py --images 100000 --repeat 3 --out new.json --compare old.json
+## python bench_pipeline.py --dir "D:\Drone Projects\2017-08-18" --out bench.json
+
+import os, sys, csv, json, time, shutil, argparse, platform, tempfile, subprocess
+import numpy as np
+import exif_reader, exiftool_pool, img_records, place_files, uav_pipeline, make_synthetic_imgs
+
+STAGES = ["extraction", "exiftool", "csv_parse", "sort", "segmentation", "placement", "export"]
+
+## Run a stage repeat times. setup (optional) is run before each one and isn't
+## timed; the stage's result from the last run is returned along with the times.
+def time_stage(name, func, repeat, setup=None):
+    secs = []
+    result = None
+    for k in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        result = func()
+        secs.append(time.perf_counter() - t0)
+    print("  %-13s %9.3f s" % (name, min(secs)))
+    sys.stdout.flush()
+    return result, secs
+
+## The git commit of the scripts, if they're in a git repository
+def git_commit():
+    try:
+        out = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                      stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+## Read the headers with the built-in reader (falling back to exiftool, as the
+## scripts do). Returns the rows.
+def extract(fns, tagsAll):
+    return [row for row, fn in uav_pipeline.iter_headers(fns, tagsAll, None, 0, lambda msg, color=None: None) if row is not None]
+
+def extract_exiftool(fns, tagsAll):
+    pool = exiftool_pool.ExiftoolPool(0)
+    try:
+        return list(pool.imap_rows(fns, tagsAll))
+    finally:
+        pool.close()
+
+## Parse the header info in a csv file into image records
+def parse_csv(fnCSV, add_yaw):
+    imgs = img_records.ImageRecords()
+    with open(fnCSV, newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                imgs.append(*uav_pipeline.parse_row(row, add_yaw))
+            except ValueError:
+                pass
+    return imgs.finish()
+
+## Print the ratio of each stage's time to the times in an earlier results file
+def compare(results, fnOld):
+    with open(fnOld) as f:
+        old = json.load(f)
+    print("\nCompared to " + fnOld + " (" + str(old.get("commit")) + ", " + str(old["dataset"]["images"]) + " images):")
+    for name in STAGES:
+        if name in results["stages"] and name in old.get("stages", {}):
+            new_us = results["stages"][name]["us_per_image"]
+            old_us = old["stages"][name]["us_per_image"]
+            print("  %-13s %9.2f -> %9.2f us/image  (%.2fx)" % (name, old_us, new_us, new_us / max(old_us, 1e-9)))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Time each stage of sorting and mapping a folder of images")
+    parser.add_argument("--dir", help="folder of images to use (default: make synthetic images)")
+    parser.add_argument("--images", type=int, default=10000, help="number of synthetic images (default 10000)")
+    parser.add_argument("--flights", type=int, default=20, help="number of flights (default 20)")
+    parser.add_argument("--gapMins", type=int, default=15, help="minutes between flights (default 15)")
+    parser.add_argument("--tifEvery", type=int, default=5, help="every n-th image is a TIFF, 0 for none (default 5)")
+    parser.add_argument("--headerKB", type=float, default=32, help="size of the image headers in KB (default 32)")
+    parser.add_argument("--workDir", help="where to make the images and the flight subdirectories (default: a temp folder)")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic images")
+    parser.add_argument("--placement", choices=["copy", "move"], default="copy",
+                        help="copy or move the images into flight subdirectories (moved images are moved back)")
+    parser.add_argument("--config", help="config file with the options (see batch-uav-imgs.py)")
+    parser.add_argument("--exiftool", action="store_true", help="also time exiftool")
+    parser.add_argument("--repeat", type=int, default=1, help="times to run each stage, the best is kept (default 1)")
+    parser.add_argument("--out", default="bench_pipeline.json", help="JSON file for the results (default bench_pipeline.json)")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    args = parser.parse_args(argv[1:])
+    repeat = max(1, args.repeat)
+
+    opt = uav_pipeline.Options()
+    if args.config:
+        try:
+            uav_pipeline.read_config(args.config, opt)
+        except ValueError as e:
+            print("Error reading the config file: " + str(e))
+            return 1
+    opt.m2s_YN = True
+    opt.shpCreateYN = True
+    opt.exportFormat = "shp"
+
+    ## MAKE THE IMAGES
+    fnWorkDir = tempfile.mkdtemp(prefix="bench_uav_", dir=args.workDir)
+    dataset = {}
+    if args.dir:
+        fnImgDir = args.dir.strip('\'"')
+        dataset["dir"] = os.path.abspath(fnImgDir)
+    else:
+        fnImgDir = os.path.join(fnWorkDir, "images")
+        print("Making " + str(args.images) + " synthetic images in " + fnImgDir)
+        t0 = time.time()
+        make_synthetic_imgs.make_images(fnImgDir, args.images, args.flights, 2, args.gapMins, args.tifEvery, args.headerKB)
+        dataset.update(flights=args.flights, gapMins=args.gapMins, tifEvery=args.tifEvery, headerKB=args.headerKB,
+                       make_secs=round(time.time() - t0, 3))
+    fns = exif_reader.list_images(fnImgDir)
+    if len(fns) == 0:
+        print("No images in " + fnImgDir)
+        return 1
+    dataset["images"] = len(fns)
+    dataset["bytes"] = sum(os.path.getsize(fn) for fn in fns)
+    fnOutDir = os.path.join(fnWorkDir, "flights")
+    tagsAll = uav_pipeline.tag_list(opt.add_yaw)
+    stageSecs = {}
+
+    try:
+        print("Timing " + str(len(fns)) + " images (best of " + str(repeat) + "):")
+        ## EXTRACTION (read everything once first, so every run finds them in the file cache)
+        if args.dir:
+            extract(fns, tagsAll)
+        rows, stageSecs["extraction"] = time_stage("extraction", lambda: extract(fns, tagsAll), repeat)
+        if args.exiftool:
+            if uav_pipeline.exiftool_available():
+                rows_et, stageSecs["exiftool"] = time_stage("exiftool", lambda: extract_exiftool(fns, tagsAll), repeat)
+            else:
+                print("  exiftool not found, skipping it")
+
+        ## CSV PARSE (from a csv file like exiftool -csv -n writes)
+        fnCSV = os.path.join(fnWorkDir, "exif_info.csv")
+        with open(fnCSV, "w", newline="") as f:
+            csvWriter = csv.DictWriter(f, fieldnames=["SourceFile", "FileName"] + tagsAll, extrasaction="ignore", restval="")
+            csvWriter.writeheader()
+            csvWriter.writerows(rows)
+        imgs, stageSecs["csv_parse"] = time_stage("csv_parse", lambda: parse_csv(fnCSV, opt.add_yaw), repeat)
+
+        ## SORT (the records are shuffled first, the way they'd come from a pool of readers)
+        shuffled = np.random.RandomState(0).permutation(len(imgs))
+        result, stageSecs["sort"] = time_stage("sort", imgs.sort_by_time, repeat, lambda: imgs.reorder(shuffled))
+
+        ## SEGMENTATION
+        def segment():
+            si = uav_pipeline.StreamInfo(imgs, opt.m2s_StreamKey)
+            return uav_pipeline.group_flights(imgs, opt, si)
+        flights, stageSecs["segmentation"] = time_stage("segmentation", segment, repeat)
+        dataset["flight_subdirs"] = len(flights)
+
+        ## PLACEMENT (into a separate folder, so the images can be used again)
+        placements = []
+        for flight_info in flights:
+            for j in flight_info[0]:
+                placements.append((os.path.join(fnImgDir, imgs.fn(j)), os.path.join(fnOutDir, flight_info[1], imgs.fn(j))))
+        def clear_placed():
+            if args.placement == "move":
+                for fnSrc, fnDest in placements:
+                    if os.path.exists(fnDest):
+                        os.rename(fnDest, fnSrc)
+            shutil.rmtree(fnOutDir, ignore_errors=True)
+        if args.dir and args.placement == "move":
+            print("  (copying, images in --dir aren't moved)")
+        mode = "move" if args.placement == "move" and not args.dir else "copy"
+        errors, stageSecs["placement"] = time_stage("placement", lambda: place_files.place_files(
+            placements, mode, opt.m2s_NumWorkers, opt.m2s_FsyncPolicy, progressYN=False), repeat, clear_placed)
+        for fnSrc, fnDest, e in errors[:10]:
+            print("  Error placing " + fnSrc + ": " + str(e))
+
+        ## EXPORT
+        outputs, stageSecs["export"] = time_stage("export", lambda: uav_pipeline.export_layers(fnOutDir, imgs, flights, opt), repeat)
+        if mode == "move":
+            clear_placed()
+    finally:
+        if args.keep and not args.dir:
+            shutil.rmtree(fnOutDir, ignore_errors=True)
+            print("Kept the synthetic images in " + fnImgDir)
+        else:
+            shutil.rmtree(fnWorkDir, ignore_errors=True)
+
+    ## SAVE THE RESULTS
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "repeat": repeat,
+        "options": {"m2s_StreamKey": opt.m2s_StreamKey, "m2s_DivideTifJpgYN": opt.m2s_DivideTifJpgYN, "placement": mode,
+                    "m2s_NumWorkers": opt.m2s_NumWorkers, "shpWriter": opt.shpWriter},
+        "dataset": dataset,
+        "stages": {},
+    }
+    for name in STAGES:
+        if name in stageSecs:
+            secs = stageSecs[name]
+            results["stages"][name] = {"secs": round(min(secs), 6), "runs": [round(s, 6) for s in secs],
+                                       "us_per_image": round(1e6 * min(secs) / len(fns), 3)}
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Saved the results to " + args.out)
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
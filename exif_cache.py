@@ -0,0 +1,176 @@
+## Persistent cache of image header info
+## (c) Andy Lyons, 2017
+
+## Header values are saved in a small SQLite database in the image folder, keyed
+## on the path of each image (relative to the folder the cache lives in), its
+## size and its modification time. On the next run only new or modified images
+## need to be read. When the script moves or copies images into flight
+## subdirectories the cache entries are moved or copied with them, and a run on
+## one of those subdirectories will find and use the cache in its parent folder.
+
+## Several processes can use the same cache at once (e.g. batch mode on a folder
+## and its subfolders): the database is in WAL mode, waits for another writer
+## instead of failing straight away, and commits every few hundred changes so no
+## process holds the write lock for long. If the cache still can't be used (or
+## written), it's turned off and the images are just read again.
+
+import os, json, sqlite3
+
+fnCache = "exif_cache.sqlite"
+
+## How many folders up to look for an existing cache (flight subdirectories
+## can be two levels deep, e.g. Flt01_1010_1025/rgb)
+MAX_LEVELS_UP = 2
+
+## Seconds to wait for another process to finish writing, and the number of
+## changes between commits
+LOCK_TIMEOUT = 30.0
+COMMIT_EVERY = 200
+
+## Number of files looked up in one query. Entries are only read for the files
+## being looked up, so memory doesn't grow with the size of the cache.
+LOOKUP_CHUNK = 500
+
+class ExifCache(object):
+    def __init__(self, dirname):
+        self.root = find_cache_root(dirname)
+        self.fn = os.path.join(self.root, fnCache)
+        self.pending = 0
+        self.db = None
+        try:
+            self.db = sqlite3.connect(self.fn, timeout=LOCK_TIMEOUT)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS exif (relpath TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, vals TEXT)")
+            self.db.commit()
+        except sqlite3.Error as e:
+            self.disable(e)
+
+    ## Stop using the cache after an error (e.g. it's locked for too long)
+    def disable(self, e):
+        print("Unable to use the header cache " + self.fn + " (" + str(e) + ")")
+        if self.db is not None:
+            try:
+                self.db.close()
+            except sqlite3.Error:
+                pass
+        self.db = None
+
+    ## Run a statement that changes the cache, committing every COMMIT_EVERY changes
+    def write(self, sql, args):
+        if self.db is None:
+            return
+        try:
+            self.db.execute(sql, args)
+            self.pending = self.pending + 1
+            if self.pending >= COMMIT_EVERY:
+                self.db.commit()
+                self.pending = 0
+        except sqlite3.Error as e:
+            self.disable(e)
+
+    def relpath(self, fn):
+        return os.path.relpath(os.path.abspath(fn), self.root).replace(os.sep, "/")
+
+    ## The entries (size, mtime_ns, vals) of a list of relative paths that are
+    ## in the cache, in a dictionary
+    def fetch(self, relpaths):
+        entries = {}
+        if self.db is None:
+            return entries
+        try:
+            for i in range(0, len(relpaths), LOOKUP_CHUNK):
+                chunk = relpaths[i:i + LOOKUP_CHUNK]
+                sql = "SELECT relpath, size, mtime_ns, vals FROM exif WHERE relpath IN (" + ", ".join("?" * len(chunk)) + ")"
+                for relpath, size, mtime_ns, vals in self.db.execute(sql, chunk):
+                    entries[relpath] = (size, mtime_ns, vals)
+        except sqlite3.Error as e:
+            self.disable(e)
+        return entries
+
+    ## Split a list of files into rows served from the cache, and files that
+    ## need to be read (new, modified, cached without all of the tags, or gone
+    ## since they were listed). The files are looked up LOOKUP_CHUNK at a time.
+    def lookup(self, fns, tags):
+        rows = []
+        misses = []
+        for i in range(0, len(fns), LOOKUP_CHUNK):
+            chunk = fns[i:i + LOOKUP_CHUNK]
+            relpaths = [self.relpath(fn) for fn in chunk]
+            entries = self.fetch(relpaths)
+            for fn, relpath in zip(chunk, relpaths):
+                entry = entries.get(relpath)
+                if entry is not None:
+                    try:
+                        st = os.stat(fn)
+                    except OSError:
+                        st = None
+                    if st is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                        vals = json.loads(entry[2])
+                        if all(tag in vals for tag in tags):
+                            row = {"SourceFile": fn, "FileName": os.path.basename(fn)}
+                            row.update((tag, vals[tag]) for tag in tags)
+                            rows.append(row)
+                            continue
+                misses.append(fn)
+        return rows, misses
+
+    def put(self, fn, vals, st=None):
+        if self.db is None:
+            return
+        if st is None:
+            st = os.stat(fn)
+        vals = json.dumps(vals)
+        relpath = self.relpath(fn)
+        self.write("INSERT OR REPLACE INTO exif VALUES (?, ?, ?, ?)", (relpath, st.st_size, st.st_mtime_ns, vals))
+
+    ## Save rows that were just read from the images
+    def store(self, rows):
+        for row in rows:
+            vals = dict((k, v) for k, v in row.items() if k not in ("SourceFile", "FileName"))
+            try:
+                self.put(row["SourceFile"], vals)
+            except OSError:
+                pass
+
+    ## Record that a file was moved (the size and modification time don't change)
+    def moved(self, fnSrc, fnDest):
+        entry = self.fetch([self.relpath(fnSrc)]).get(self.relpath(fnSrc))
+        if entry is None:
+            return
+        self.write("DELETE FROM exif WHERE relpath = ?", (self.relpath(fnSrc),))
+        self.write("INSERT OR REPLACE INTO exif VALUES (?, ?, ?, ?)", (self.relpath(fnDest),) + entry)
+
+    ## Record that a file was copied (the copy gets its own modification time)
+    def copied(self, fnSrc, fnDest):
+        entry = self.fetch([self.relpath(fnSrc)]).get(self.relpath(fnSrc))
+        if entry is None:
+            return
+        self.put(fnDest, json.loads(entry[2]))
+
+    def commit(self):
+        if self.db is not None:
+            try:
+                self.db.commit()
+                self.pending = 0
+            except sqlite3.Error as e:
+                self.disable(e)
+
+    def close(self):
+        self.commit()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+## Use an existing cache in this folder or one of its parents, otherwise create
+## a new one in this folder
+def find_cache_root(dirname):
+    dirname = os.path.abspath(dirname)
+    root = dirname
+    for i in range(MAX_LEVELS_UP + 1):
+        if os.path.isfile(os.path.join(root, fnCache)):
+            return root
+        parent = os.path.dirname(root)
+        if parent == root:
+            break
+        root = parent
+    return dirname
@@ -0,0 +1,290 @@
+## In-process EXIF / XMP header reader for JPEG and TIFF images
+## (c) Andy Lyons, 2017
+
+## Reads just the header of each image (the APP1 segments of a JPEG, or the IFDs
+## of a TIFF) and returns the same tag names and numeric (-n) values that
+## exiftool would put in its csv output. Files that can't be parsed are returned
+## separately so the caller can hand them to exiftool instead.
+
+import os, re, struct
+
+## Size of the first read from a TIFF file. The IFDs of the cameras tested so far
+## all fit inside this, anything beyond it is fetched with a seek.
+HEAD_SIZE = 65536
+
+## Image types that are worth trying (in-process or with exiftool)
+IMG_EXTS = (".jpg", ".jpeg", ".tif", ".tiff", ".dng")
+
+## exiftool tag name -> (IFD, tag ID)
+EXIF_TAGS = {
+    "Make": ("IFD0", 0x010F),
+    "Model": ("IFD0", 0x0110),
+    "DateTimeOriginal": ("ExifIFD", 0x9003),
+    "FocalLength": ("ExifIFD", 0x920A),
+    "FocalLengthIn35mmFormat": ("ExifIFD", 0xA405),
+    "ExifImageWidth": ("ExifIFD", 0xA002),
+    "ExifImageHeight": ("ExifIFD", 0xA003),
+    "SerialNumber": ("ExifIFD", 0xA431),
+}
+
+## Composite GPS tags: exiftool tag name -> (GPS tag ID, GPS reference tag ID, negative reference)
+GPS_TAGS = {
+    "GPSLatitude": (0x0002, 0x0001, b"S"),
+    "GPSLongitude": (0x0004, 0x0003, b"W"),
+    "GPSAltitude": (0x0006, 0x0005, b"\x01"),    # reference 1 = below sea level
+}
+
+## XMP properties (DJI drone-dji namespace)
+XMP_TAGS = ("FlightYawDegree", "GimbalYawDegree", "RelativeAltitude")
+
+## IFD pointers and other structural tags
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_XMP = 0x02BC
+
+## Byte size of each TIFF field type
+TYPE_SIZES = {1:1, 2:1, 3:2, 4:4, 5:8, 6:1, 7:1, 8:2, 9:4, 10:8, 11:4, 12:8, 13:4}
+
+XMP_SIG = b"http://ns.adobe.com/xap/1.0/\x00"
+EXIF_SIG = b"Exif\x00\x00"
+
+class ExifReadError(ValueError):
+    pass
+
+def supported_tags():
+    return list(EXIF_TAGS.keys()) + list(GPS_TAGS.keys()) + list(XMP_TAGS)
+
+## Format a number the way exiftool -n does
+def fmt_num(x):
+    return "%.15g" % x
+
+class TiffSrc(object):
+    ## Random access to a TIFF structure. buf holds the first bytes; if f is given
+    ## anything past the end of buf is read from the file (starting at base).
+    def __init__(self, buf, f=None, base=0):
+        self.buf = buf
+        self.f = f
+        self.base = base
+        if buf[0:2] == b"II":
+            self.endian = "<"
+        elif buf[0:2] == b"MM":
+            self.endian = ">"
+        else:
+            raise ExifReadError("not a TIFF header")
+        if self.unpack("H", 2)[0] != 42:
+            raise ExifReadError("bad TIFF magic number")
+
+    def get(self, off, n):
+        if off + n <= len(self.buf):
+            return self.buf[off:off + n]
+        if self.f is None:
+            raise ExifReadError("TIFF offset beyond end of segment")
+        self.f.seek(self.base + off)
+        data = self.f.read(n)
+        if len(data) < n:
+            raise ExifReadError("TIFF offset beyond end of file")
+        return data
+
+    def unpack(self, fmt, off):
+        fmt = self.endian + fmt
+        return struct.unpack(fmt, self.get(off, struct.calcsize(fmt)))
+
+    ## Return a dictionary of tag ID -> (type, count, raw value bytes)
+    def read_ifd(self, off):
+        nentries = self.unpack("H", off)[0]
+        data = self.get(off + 2, nentries * 12)
+        entries = {}
+        for i in range(nentries):
+            tag, typ, count = struct.unpack(self.endian + "HHI", data[i*12:i*12+8])
+            size = TYPE_SIZES.get(typ, 1) * count
+            if size <= 4:
+                val = data[i*12+8:i*12+8+size]
+            else:
+                val = (typ, count, struct.unpack(self.endian + "I", data[i*12+8:i*12+12])[0])
+            entries[tag] = (typ, count, val)
+        return entries
+
+    ## Fetch the value bytes of an entry (if they didn't fit in the entry itself)
+    def value_bytes(self, entry):
+        typ, count, val = entry
+        if isinstance(val, tuple):
+            return self.get(val[2], TYPE_SIZES.get(typ, 1) * count)
+        return val
+
+    ## Decode an entry into a list of numbers, or a string for ASCII
+    def value(self, entry):
+        typ, count, val = entry
+        raw = self.value_bytes(entry)
+        if typ == 2:
+            return raw.split(b"\x00")[0].decode("latin-1").strip()
+        if typ in (5, 10):
+            nums = struct.unpack(self.endian + ("I" if typ == 5 else "i") * (2 * count), raw)
+            return [(nums[i] / float(nums[i+1])) if nums[i+1] != 0 else 0.0 for i in range(0, 2 * count, 2)]
+        fmt = {1:"B", 3:"H", 4:"I", 6:"b", 8:"h", 9:"i", 11:"f", 12:"d", 13:"I"}.get(typ)
+        if fmt is None:
+            return raw
+        return list(struct.unpack(self.endian + fmt * count, raw))
+
+## Turn a decoded value into the string exiftool -n would print
+def value_str(val):
+    if isinstance(val, str):
+        return val
+    if isinstance(val, bytes):
+        return val.split(b"\x00")[0].decode("latin-1").strip()
+    return " ".join(fmt_num(v) if isinstance(v, float) else str(v) for v in val)
+
+## Find a DJI style XMP property (attribute or element form)
+def xmp_value(xmp, prop):
+    m = re.search(b"[\\w-]+:" + prop.encode() + b"\\s*=\\s*[\"']([^\"']*)[\"']", xmp)
+    if m is None:
+        m = re.search(b"<[\\w-]+:" + prop.encode() + b">([^<]*)<", xmp)
+    if m is None:
+        return ""
+    val = m.group(1).decode("utf-8", "replace").strip()
+    try:
+        return fmt_num(float(val))
+    except ValueError:
+        return val
+
+## Pull the requested tags out of a TIFF structure (and XMP packet, if any)
+def tags_from_tiff(src, tags, xmp=None):
+    ifd0 = src.read_ifd(src.unpack("I", 4)[0])
+    ifds = {"IFD0": ifd0}
+    if TAG_EXIF_IFD in ifd0:
+        ifds["ExifIFD"] = src.read_ifd(src.value(ifd0[TAG_EXIF_IFD])[0])
+    if TAG_GPS_IFD in ifd0:
+        ifds["GPS"] = src.read_ifd(src.value(ifd0[TAG_GPS_IFD])[0])
+    if xmp is None and TAG_XMP in ifd0 and any(tag in XMP_TAGS for tag in tags):
+        xmp = src.value_bytes(ifd0[TAG_XMP])
+
+    vals = {}
+    for tag in tags:
+        vals[tag] = ""
+        if tag in EXIF_TAGS:
+            ifd_name, tag_id = EXIF_TAGS[tag]
+            ifd = ifds.get(ifd_name, {})
+            if tag_id in ifd:
+                vals[tag] = value_str(src.value(ifd[tag_id]))
+        elif tag in GPS_TAGS:
+            tag_id, ref_id, neg_ref = GPS_TAGS[tag]
+            gps = ifds.get("GPS", {})
+            if tag_id in gps:
+                dms = src.value(gps[tag_id])    # degrees, minutes, seconds (altitude is a single value)
+                deg = sum(v / div for v, div in zip(dms, (1.0, 60.0, 3600.0)))
+                if ref_id in gps and src.value_bytes(gps[ref_id])[0:1].upper() == neg_ref:
+                    deg = -deg
+                vals[tag] = fmt_num(deg)
+        elif tag in XMP_TAGS and xmp is not None:
+            vals[tag] = xmp_value(xmp, tag)
+    return vals
+
+def read_jpeg(f, tags):
+    want_xmp = any(tag in XMP_TAGS for tag in tags)
+    exif = None
+    xmp = None
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise ExifReadError("corrupt JPEG marker")
+        while marker[1] == 0xFF:    # fill bytes
+            marker = marker[1:] + f.read(1)
+        m = marker[1]
+        if m == 0xD8 or m == 0x01 or 0xD0 <= m <= 0xD7:
+            continue
+        if m == 0xDA or m == 0xD9:    # start of scan or end of image, no more headers
+            break
+        seglen = struct.unpack(">H", f.read(2))[0] - 2
+        if seglen < 0:    # the length includes its own two bytes
+            raise ExifReadError("corrupt JPEG segment length")
+        if m == 0xE1 and (exif is None or (want_xmp and xmp is None)):
+            data = f.read(seglen)
+            if data.startswith(EXIF_SIG) and exif is None:
+                exif = data[len(EXIF_SIG):]
+            elif data.startswith(XMP_SIG) and xmp is None:
+                xmp = data[len(XMP_SIG):]
+        else:
+            f.seek(seglen, 1)
+        if exif is not None and (xmp is not None or not want_xmp):
+            break
+    if exif is None:
+        raise ExifReadError("no EXIF segment")
+    return tags_from_tiff(TiffSrc(exif), tags, xmp)
+
+def read_tiff(f, tags):
+    f.seek(0)
+    return tags_from_tiff(TiffSrc(f.read(HEAD_SIZE), f), tags)
+
+## Read the requested tags from one image. Raises ExifReadError if the file isn't
+## a JPEG or TIFF or the header can't be parsed.
+def read_tags(fn, tags):
+    with open(fn, "rb") as f:
+        magic = f.read(4)
+        try:
+            if magic[0:2] == b"\xff\xd8":
+                return read_jpeg(f, tags)
+            elif magic in (b"II*\x00", b"MM\x00*"):
+                return read_tiff(f, tags)
+        except (struct.error, IndexError) as e:
+            raise ExifReadError("corrupt header: " + str(e))
+    raise ExifReadError("not a JPEG or TIFF file")
+
+## List the (non-empty) image files in a directory
+def list_images(dirname):
+    fns = []
+    for entry in sorted(os.listdir(dirname)):
+        fn = os.path.join(dirname, entry)
+        if entry.lower().endswith(IMG_EXTS) and os.path.isfile(fn) and os.path.getsize(fn) > 0:
+            fns.append(fn)
+    return fns
+
+## The images in a folder one at a time, in directory order (for folders too big
+## to list at once, see uav_pipeline.sort_large_folder)
+def iter_images(dirname):
+    with os.scandir(dirname) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMG_EXTS) and entry.is_file() and entry.stat().st_size > 0:
+                yield entry.path
+
+## Read one file into a row like the ones in exiftool's csv output
+def read_row(fn, tags):
+    row = {"SourceFile": fn, "FileName": os.path.basename(fn)}
+    row.update(read_tags(fn, tags))
+    return row
+
+## Read a list of images one at a time. This is a generator that yields a tuple
+## for each file: (row, None) if the header was read, where row is a dictionary
+## with SourceFile, FileName and each tag, or (None, fn) if the file needs
+## exiftool, either because the header couldn't be parsed or a required tag
+## wasn't found.
+def iter_files(fns, tags, required=()):
+    use_exiftool = len([tag for tag in tags if tag not in supported_tags()]) > 0
+    for fn in fns:
+        if use_exiftool:
+            yield None, fn
+            continue
+        try:
+            row = read_row(fn, tags)
+        except (ExifReadError, OSError):
+            yield None, fn
+            continue
+        if [tag for tag in required if row[tag] == ""]:
+            yield None, fn
+        else:
+            yield row, None
+
+## Read a list of images. Returns a list of rows and a list of the files that
+## need exiftool (see iter_files).
+def read_files(fns, tags, required=()):
+    rows = []
+    fallback = []
+    for row, fn in iter_files(fns, tags, required):
+        if row is None:
+            fallback.append(fn)
+        else:
+            rows.append(row)
+    return rows, fallback
+
+## Read all the images in a directory (see read_files)
+def read_dir(dirname, tags, required=()):
+    return read_files(list_images(dirname), tags, required)
@@ -0,0 +1,114 @@
+## Pool of long-running exiftool processes
+## (c) Andy Lyons, 2017
+
+## Starts one 'exiftool -stay_open True -@ -' process per worker and feeds them
+## batches of files over stdin. Each batch comes back as JSON, which is turned
+## into rows like the ones in exiftool's csv output (all values as strings, the
+## same as exif_reader returns).
+
+import os, json, threading, subprocess
+from queue import Queue, Empty
+
+## Arguments sent with every batch
+BATCH_ARGS = ["-if", "$filesize# > 0", "-filename", "-n", "-json", "-q", "-q", "-charset", "filename=utf8"]
+
+class ExiftoolProcess(object):
+    def __init__(self, exiftool="exiftool"):
+        self.proc = subprocess.Popen([exiftool, "-stay_open", "True", "-@", "-"],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.num_batches = 0
+
+    ## Run one batch and return the raw JSON records
+    def execute(self, args):
+        self.num_batches = self.num_batches + 1
+        ready = "{ready" + str(self.num_batches) + "}"
+        cmd = "\n".join(args) + "\n-execute" + str(self.num_batches) + "\n"
+        self.proc.stdin.write(cmd.encode("utf-8"))
+        self.proc.stdin.flush()
+        lines = []
+        while True:
+            line = self.proc.stdout.readline()
+            if not line:
+                raise IOError("exiftool exited unexpectedly")
+            line = line.decode("utf-8", "replace").rstrip("\r\n")
+            if line.strip() == ready:
+                break
+            lines.append(line)
+        out = "\n".join(lines).strip()
+        return json.loads(out) if out else []
+
+    def close(self):
+        try:
+            self.proc.stdin.write(b"-stay_open\nFalse\n")
+            self.proc.stdin.flush()
+            self.proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.proc.wait()
+
+## Convert a JSON record into a csv style row
+def record_to_row(rec, tags):
+    row = {"SourceFile": rec.get("SourceFile", ""), "FileName": rec.get("FileName", "")}
+    for tag in tags:
+        val = rec.get(tag, "")
+        if isinstance(val, float):
+            val = "%.15g" % val
+        row[tag] = str(val)
+    return row
+
+class ExiftoolPool(object):
+    def __init__(self, num_workers=0, exiftool="exiftool"):
+        if num_workers < 1:
+            num_workers = os.cpu_count() or 1
+        self.procs = [ExiftoolProcess(exiftool) for i in range(num_workers)]
+
+    ## Read the tags from a list of files, spread across the workers. This is a
+    ## generator that yields rows as soon as each batch comes back, so the caller
+    ## can process them while exiftool is still working on the rest. Rows come
+    ## back in the order the batches finish (files that fail the -if are skipped).
+    def imap_rows(self, fns, tags, batch_size=0):
+        if batch_size < 1:
+            batch_size = max(1, min(100, len(fns) // (4 * len(self.procs)) + 1))
+        todo = Queue()
+        for i in range(0, len(fns), batch_size):
+            todo.put(fns[i:i + batch_size])
+        done = Queue()
+
+        def worker(proc):
+            try:
+                while True:
+                    try:
+                        batch = todo.get_nowait()
+                    except Empty:
+                        break
+                    args = BATCH_ARGS + ["-" + tag for tag in tags] + batch
+                    done.put(("rows", [record_to_row(rec, tags) for rec in proc.execute(args)]))
+            except (IOError, OSError, ValueError) as e:
+                done.put(("error", e))
+            done.put(("done", None))
+
+        threads = [threading.Thread(target=worker, args=(proc,)) for proc in self.procs]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        num_running = len(threads)
+        error = None
+        while num_running > 0:
+            what, val = done.get()
+            if what == "rows":
+                for row in val:
+                    yield row
+            elif what == "error":
+                error = val
+            else:
+                num_running = num_running - 1
+        if error is not None:
+            raise IOError("Error running exiftool: " + str(error))
+
+    ## Read the tags from a list of files and return all the rows at once
+    def read_rows(self, fns, tags, batch_size=0):
+        return list(self.imap_rows(fns, tags, batch_size))
+
+    def close(self):
+        for proc in self.procs:
+            proc.close()
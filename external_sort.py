@@ -0,0 +1,116 @@
+## Sort image records that don't fit in memory
+## (c) Andy Lyons, 2017
+
+## For very large folders (e.g. a season's archive of over a million images) the
+## records are never all held in memory. As the headers are read, each image is
+## packed into a compact binary record (struct, about 110 bytes plus the file
+## name), and once run_size records have been collected they're sorted by time
+## and written to a temporary file (a sorted run). The runs are then k-way merged
+## (heapq.merge), reading each run sequentially, so the images come out in time
+## order while only one record per run is in memory. Gap detection and flight
+## assignment are done on the merged stream (see uav_pipeline.sort_large_folder).
+
+## Images taken in the same second are ordered by file name, the same order as
+## ImageRecords.sort_by_time gives for a folder read with exif_reader.list_images.
+
+import os, struct, heapq, shutil, tempfile
+from collections import Counter
+from operator import itemgetter
+import img_records, flight_groups
+
+## Timestamp, the float columns, the codes of the string columns and the length
+## of the file name (which follows the record)
+RECORD = struct.Struct("<q" + "d" * len(img_records.FLOAT_COLS) + "i" * len(img_records.CODE_COLS) + "H")
+
+## Size of the read buffer of each run while merging
+MERGE_BUFFER = 256 * 1024
+
+class RecordRuns(object):
+    def __init__(self, run_size=100000, tmpdir=None):
+        self.run_size = max(1, run_size)
+        self.tmpdir = tempfile.mkdtemp(prefix="uav_sort_", dir=tmpdir or None)
+        self.buf = []
+        self.runs = []
+        self.count = 0
+        ## Codes of the string columns (there are only a few distinct values)
+        self.codes = dict((col, {}) for col in img_records.CODE_COLS)
+        self.values = dict((col, []) for col in img_records.CODE_COLS)
+
+    ## Add a record, with the same arguments as ImageRecords.append
+    def add(self, fn, ts, lon, lat, yaw_flight=img_records.NAN, yaw_gimbal=img_records.NAN, gps_alt=img_records.NAN,
+            rel_alt=img_records.NAN, focal=img_records.NAN, focal35=img_records.NAN, img_width=img_records.NAN,
+            img_height=img_records.NAN, make="", model="", serial=""):
+        name = fn.encode("utf-8")
+        codes = [self.code(col, value) for col, value in zip(img_records.CODE_COLS, (make, model, serial))]
+        rec = RECORD.pack(ts, lon, lat, yaw_flight, yaw_gimbal, gps_alt, rel_alt, focal, focal35, img_width, img_height,
+                          *(codes + [len(name)])) + name
+        self.buf.append((ts, fn, rec))
+        self.count = self.count + 1
+        if len(self.buf) >= self.run_size:
+            self.flush()
+
+    def code(self, col, value):
+        code = self.codes[col].get(value)
+        if code is None:
+            code = len(self.values[col])
+            self.codes[col][value] = code
+            self.values[col].append(value)
+        return code
+
+    ## Sort the records collected so far and write them to a new run
+    def flush(self):
+        if len(self.buf) == 0:
+            return
+        self.buf.sort(key=itemgetter(0, 1))
+        fnRun = os.path.join(self.tmpdir, "run%05d.bin" % len(self.runs))
+        with open(fnRun, "wb") as f:
+            for ts, fn, rec in self.buf:
+                f.write(rec)
+        self.runs.append(fnRun)
+        self.buf = []
+
+    ## Read a run, yielding tuples of values in the order ImageRecords.append takes them
+    def iter_run(self, fnRun):
+        numFloats = len(img_records.FLOAT_COLS)
+        with open(fnRun, "rb", buffering=MERGE_BUFFER) as f:
+            while True:
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    return
+                vals = RECORD.unpack(header)
+                fn = f.read(vals[-1]).decode("utf-8")
+                strs = tuple(self.values[col][code] for col, code in zip(img_records.CODE_COLS, vals[1 + numFloats:-1]))
+                yield (fn, vals[0]) + vals[1:1 + numFloats] + strs
+
+    ## All the records in time order (then by file name). Can be called more than
+    ## once, each call merges the runs again.
+    def merged(self):
+        self.flush()
+        return heapq.merge(*[self.iter_run(fnRun) for fnRun in self.runs], key=itemgetter(1, 0))
+
+    def __len__(self):
+        return self.count
+
+    ## Delete the runs
+    def close(self):
+        self.buf = []
+        self.runs = []
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+## Exact median of the sampling intervals of a stream of timestamps (in time
+## order), omitting zeros like flight_groups.median_interval. Intervals are whole
+## seconds, so they're counted rather than kept: memory depends on the number of
+## distinct intervals, not the number of images.
+class IntervalCounts(object):
+    def __init__(self):
+        self.counts = Counter()
+        self.last = None
+
+    def add(self, ts):
+        if self.last is not None and ts != self.last:
+            self.counts[ts - self.last] += 1
+        self.last = ts
+
+    ## The median interval, or None if there aren't any
+    def median(self):
+        return flight_groups.counts_median(self.counts)
@@ -0,0 +1,154 @@
+## Geometry of the flights: flight lines (and their simplification) and hulls
+## (c) Andy Lyons, 2017
+
+## Coordinates are held as numpy arrays of x and y: either projected
+## coordinates in meters (metric=True), or longitude and latitude, in which
+## case distances are measured in meters on a local equirectangular
+## approximation, which is plenty accurate over the extent of a flight.
+
+import numpy as np
+
+## WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_E2 = 0.00669437999014
+
+## Convert longitude and latitude to x and y in meters, relative to the first
+## point, using the radii of curvature of the ellipsoid at the mean latitude
+## (projected coordinates are returned as they are)
+def local_meters(lon, lat, metric=False):
+    if metric:
+        return lon, lat
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    if len(lon) == 0:
+        return lon, lat
+    phi = np.radians(np.nanmean(lat))
+    w = 1 - WGS84_E2 * np.sin(phi) ** 2
+    m_per_deg_lat = np.radians(1) * WGS84_A * (1 - WGS84_E2) / w ** 1.5
+    m_per_deg_lon = np.radians(1) * WGS84_A / np.sqrt(w) * np.cos(phi)
+    return (lon - lon[0]) * m_per_deg_lon, (lat - lat[0]) * m_per_deg_lat
+
+## Distance of each point (px, py) from the segment (ax, ay)-(bx, by) (all arrays)
+def segment_distances(px, py, ax, ay, bx, by):
+    dx = bx - ax
+    dy = by - ay
+    len2 = dx * dx + dy * dy
+    t = np.where(len2 > 0, ((px - ax) * dx + (py - ay) * dy) / np.where(len2 > 0, len2, 1), 0)
+    t = np.clip(t, 0, 1)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+## Douglas-Peucker simplification. Returns the indices of the vertices to keep
+## (always including the first and last). Rather than recursing one segment at a
+## time, every segment of the current line is split at once: each pass finds,
+## for all segments together, the vertex farthest from its segment, and keeps
+## it if it's more than tolerance away. A 3,000 vertex line takes a few passes.
+def simplify_dp(x, y, tolerance):
+    n = len(x)
+    if n < 3 or tolerance <= 0:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+    vertex = np.arange(n)
+    while True:
+        kept = np.flatnonzero(keep)
+        ## Segment that each vertex falls in
+        seg = np.minimum(np.searchsorted(kept, vertex, side="right") - 1, len(kept) - 2)
+        a = kept[seg]
+        b = kept[seg + 1]
+        d = segment_distances(x, y, x[a], y[a], x[b], y[b])
+        d[keep] = 0
+        seg_max = np.maximum.reduceat(d, kept[:-1])
+        farthest = (d > tolerance) & (d == seg_max[seg])
+        if not farthest.any():
+            break
+        ## One vertex per segment (the first, if there's a tie)
+        segs, first = np.unique(seg[farthest], return_index=True)
+        keep[np.flatnonzero(farthest)[first]] = True
+    return np.flatnonzero(keep)
+
+## Length of a line in meters
+def line_length(x, y):
+    if len(x) < 2:
+        return 0.0
+    return float(np.hypot(np.diff(x), np.diff(y)).sum())
+
+## The flight line of the images in idx (in timestamp order), simplified with
+## tolerance meters (0 = keep every image). Images without coordinates are left
+## out. Returns the (k, 2) array of coordinates of the vertices and the length
+## in meters of the full line, or None if there are fewer than two vertices.
+def flight_line(xs, ys, idx, tolerance=0, metric=False):
+    idx = np.asarray(idx, dtype=np.int64)
+    idx = idx[~(np.isnan(xs[idx]) | np.isnan(ys[idx]))]
+    if len(idx) < 2:
+        return None
+    x, y = local_meters(xs[idx], ys[idx], metric)
+    keep = simplify_dp(x, y, tolerance)
+    return np.column_stack((xs[idx[keep]], ys[idx[keep]])), line_length(x, y)
+
+## Signed area of a polygon (positive if counter-clockwise)
+def polygon_area(x, y):
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+## Drop the points that are strictly inside the quadrilateral of the leftmost,
+## lowest, rightmost and highest points (they can't be on the hull). This
+## usually leaves only a small fraction of the points for the monotone chain.
+def hull_candidates(x, y):
+    quad = np.array([np.argmin(x), np.argmin(y), np.argmax(x), np.argmax(y)])
+    qx = x[quad]
+    qy = y[quad]
+    ## Leave out repeated corners (e.g., the leftmost point is also the lowest)
+    distinct = np.concatenate(([True], (np.diff(qx) != 0) | (np.diff(qy) != 0)))
+    distinct[0] = (qx[0] != qx[-1]) or (qy[0] != qy[-1])
+    qx = qx[distinct]
+    qy = qy[distinct]
+    if len(qx) < 3:
+        return np.arange(len(x))
+    inside = np.ones(len(x), dtype=bool)
+    for i in range(len(qx)):
+        ax, ay = qx[i - 1], qy[i - 1]
+        bx, by = qx[i], qy[i]
+        inside &= (bx - ax) * (y - ay) - (by - ay) * (x - ax) > 0
+    return np.flatnonzero(~inside)
+
+## Convex hull of a set of points (Andrew's monotone chain, O(n log n)).
+## Returns the indices of the hull vertices in counter-clockwise order, without
+## repeating the first one. Collinear points on the edges are left out.
+def convex_hull(x, y):
+    cand = hull_candidates(x, y)
+    cand = cand[np.lexsort((y[cand], x[cand]))]
+    px = x[cand].tolist()
+    py = y[cand].tolist()
+    if len(cand) < 3:
+        return cand
+
+    def chain(order):
+        hull = []
+        for i in order:
+            while len(hull) >= 2:
+                j = hull[-2]
+                k = hull[-1]
+                if (px[k] - px[j]) * (py[i] - py[j]) - (py[k] - py[j]) * (px[i] - px[j]) > 0:
+                    break
+                hull.pop()
+            hull.append(i)
+        return hull
+
+    lower = chain(range(len(cand)))
+    upper = chain(range(len(cand) - 1, -1, -1))
+    return cand[lower[:-1] + upper[:-1]]
+
+## The minimum convex polygon of the images in idx. Images without coordinates
+## are left out. Returns the (k, 2) array of coordinates of the vertices
+## (counter-clockwise) and the area in square meters, or None if the images
+## don't span an area (fewer than three points, or all in a line).
+def flight_hull(xs, ys, idx, metric=False):
+    idx = np.asarray(idx, dtype=np.int64)
+    idx = idx[~(np.isnan(xs[idx]) | np.isnan(ys[idx]))]
+    if len(idx) < 3:
+        return None
+    x, y = local_meters(xs[idx], ys[idx], metric)
+    hull = convex_hull(x, y)
+    if len(hull) < 3:
+        return None
+    return np.column_stack((xs[idx[hull]], ys[idx[hull]])), polygon_area(x[hull], y[hull])
@@ -0,0 +1,342 @@
+## Split a set of images into flights based on the gaps between their timestamps
+## (c) Andy Lyons, 2017
+
+## Timestamps are held as an int64 array of seconds since 1970-01-01 (the
+## DateTimeOriginal clock time, no time zone), and everything is done with
+## array operations so even very large sets of images are split instantly.
+
+## Images can also be split into streams (e.g., the bands of a multispectral
+## camera, or two drones flying at once) by a key such as the file extension or
+## the camera model. The gaps are then found within each stream, so interleaved
+## images from another camera don't shorten the intervals, and the pieces of
+## the streams that overlap in time are merged into one flight.
+
+import os, re, bisect
+from collections import Counter
+import numpy as np
+
+## Time interval (seconds) between each image and the one before it. The first
+## element is 0 (same as the old timediffs list). ts must be sorted.
+def time_diffs(ts):
+    diffs = np.zeros(len(ts), dtype=np.int64)
+    if len(ts) > 1:
+        diffs[1:] = np.diff(ts)
+    return diffs
+
+## Median of the sampling intervals, omitting zeros (e.g., the first element,
+## or images taken in the same second). Returns None if there aren't any.
+def median_interval(diffs):
+    nonzero = diffs[diffs != 0]
+    if len(nonzero) == 0:
+        return None
+    return float(np.median(nonzero))
+
+## The same median, from counts of each interval (a dictionary of interval:
+## number of times), so the intervals don't have to be kept
+def counts_median(counts):
+    n = sum(counts.values())
+    if n == 0:
+        return None
+    ## The middle value (or the two middle values if n is even)
+    mid = [(n - 1) // 2, n // 2]
+    found = []
+    seen = 0
+    for diff in sorted(counts):
+        seen = seen + counts[diff]
+        while len(found) < 2 and mid[len(found)] < seen:
+            found.append(diff)
+        if len(found) == 2:
+            break
+    return (found[0] + found[1]) / 2.0
+
+## The intervals between consecutive images, sorted. This is computed once, and
+## then the number of flights for any threshold is a binary search.
+def sorted_gaps(diffs):
+    return np.sort(diffs[1:])
+
+## Number of flights for each threshold (seconds): one, plus one for every gap
+## at least that long
+def num_flights(gaps_sorted, thresholds):
+    return 1 + len(gaps_sorted) - np.searchsorted(gaps_sorted, thresholds, side="left")
+
+## Thresholds shown in the menu, as multiples of the median sampling interval
+SWEEP_MULTIPLES = [2, 3, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+## Smallest jump (ratio between consecutive gap lengths) considered a knee
+KNEE_MIN_RATIO = 3.0
+
+## Suggest a threshold at the knee of the gap distribution: the biggest jump
+## (on a log scale) between consecutive distinct gaps at least as long as the
+## median interval, which separates the gaps within flights from the gaps
+## between them. Returns the threshold (seconds, in the middle of the jump on a
+## log scale) and the gaps on either side of it, or None if there's no jump of
+## at least KNEE_MIN_RATIO (i.e., it all looks like one flight).
+def knee_threshold(gaps_sorted, median):
+    if median is None:
+        return None
+    gaps = np.unique(gaps_sorted[gaps_sorted >= median]).astype(np.float64)
+    if len(gaps) < 2:
+        return None
+    ratios = gaps[1:] / gaps[:-1]
+    k = int(np.argmax(ratios))
+    if ratios[k] < KNEE_MIN_RATIO:
+        return None
+    return float(np.sqrt(gaps[k] * gaps[k + 1])), float(gaps[k]), float(gaps[k + 1])
+
+## Keys the images can be split into streams by: fields joined with '+'
+## ('model' is the make and model)
+STREAM_KEYS = ["none", "ext", "model", "serial", "model+serial"]
+
+## Image fields (see ImageRecords.field_codes) in a stream key
+def stream_fields(key):
+    fields = []
+    for part in key.split("+"):
+        if part == "model":
+            fields.extend(["make", "model"])
+        elif part != "none":
+            fields.append(part)
+    return fields
+
+## Bucket the images into streams in one pass. fields is a list with the codes
+## (an array with one per image) and the values of each field in the key.
+## Returns the stream number of each image and the name of each stream (the
+## field values joined with '_', made safe for a directory name).
+def make_streams(fields, n):
+    combined = np.zeros(n, dtype=np.int64)
+    for codes, values in fields:
+        combined = combined * max(len(values), 1) + codes
+    keys, streams = np.unique(combined, return_inverse=True)
+    names = []
+    for key in keys.tolist():
+        parts = []
+        for codes, values in reversed(fields):
+            parts.append(values[key % max(len(values), 1)] if len(values) else "")
+            key = key // max(len(values), 1)
+        name = "_".join(part for part in reversed(parts) if part != "")
+        names.append(re.sub(r"[^\w.-]+", "_", name) or "unknown")
+    return streams.reshape(n), names
+
+## The stream with the most images
+def primary_stream(streams):
+    if len(streams) == 0:
+        return 0
+    return int(np.argmax(np.bincount(streams)))
+
+## Median sampling interval of each stream (see median_interval)
+def stream_medians(ts, streams, num_streams):
+    return [median_interval(time_diffs(ts[streams == s])) for s in range(num_streams)]
+
+## The flight number of each image. thresh_abs is the gap (seconds) that starts a
+## new flight, either one for all the streams or an array with one per stream.
+## The images are sorted by stream (stable, so they stay in time order within
+## each stream), split where the stream changes or there's a gap, and the pieces
+## that overlap in time are merged. Flights are numbered in time order.
+def flight_numbers(ts, streams, thresh_abs):
+    n = len(ts)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    order = np.argsort(streams, kind="stable")
+    ts_s = ts[order]
+    streams_s = streams[order]
+    new_stream = np.concatenate(([True], streams_s[1:] != streams_s[:-1]))
+    gaps = time_diffs(ts_s)
+    thresh_abs = np.asarray(thresh_abs, dtype=np.float64)
+    seg_start = new_stream | (gaps >= (thresh_abs[streams_s] if thresh_abs.ndim else thresh_abs))
+    seg = np.cumsum(seg_start) - 1
+    seg_first = ts_s[seg_start]
+    seg_last = ts_s[np.concatenate((np.flatnonzero(seg_start)[1:] - 1, [n - 1]))]
+
+    ## Merge the pieces that overlap in time (a new flight starts at a piece that
+    ## begins after all the earlier ones have ended)
+    by_start = np.argsort(seg_first, kind="stable")
+    ended = np.maximum.accumulate(seg_last[by_start])
+    new_flight = np.concatenate(([True], seg_first[by_start][1:] > ended[:-1]))
+    seg_flight = np.empty(len(seg_first), dtype=np.int64)
+    seg_flight[by_start] = np.cumsum(new_flight) - 1
+    flight = np.empty(n, dtype=np.int64)
+    flight[order] = seg_flight[seg]
+    return flight
+
+## Return the first and last index of each flight. A new flight starts at every
+## image whose interval from the previous one is at least thresh_abs seconds.
+def flight_bounds(diffs, thresh_abs):
+    n = len(diffs)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(diffs[1:] >= thresh_abs) + 1))
+    ends = np.concatenate((starts[1:] - 1, [n - 1]))
+    return starts, ends
+
+## Format timestamps (e.g. the start of each flight) as 'YYYYMMDD' and 'HHMM' strings
+def date_strings(ts):
+    s = np.datetime_as_string(np.asarray(ts).astype("datetime64[s]"), unit="m")
+    return [x[0:4] + x[5:7] + x[8:10] for x in s], [x[11:13] + x[14:16] for x in s]
+
+## Construct the subdirectory name of each flight from the template
+def flight_names(ts, starts, ends, template, first_num):
+    start_dates, start_hhmm = date_strings(ts[starts])
+    end_dates, end_hhmm = date_strings(ts[ends])
+    names = []
+    for i in range(len(starts)):
+        subdir = template
+        subdir = subdir.replace("{FltNum}", "%02d" % (i + first_num))
+        subdir = subdir.replace("{StartTime}", start_hhmm[i])
+        subdir = subdir.replace("{EndTime}", end_hhmm[i])
+        subdir = subdir.replace("{Date}", end_dates[i])
+        names.append(subdir)
+    return names
+
+## Regular expression that matches the subdirectory names made from the template
+def subdir_pattern(template):
+    pattern = re.escape(template)
+    for field, value in [("{FltNum}", r"\d+"), ("{StartTime}", r"\d{4}"), ("{EndTime}", r"\d{4}"), ("{Date}", r"\d{8}")]:
+        pattern = pattern.replace(re.escape(field), value)
+    return re.compile(pattern + "$")
+
+## Split an array of (sorted) image indices into the flight each falls in
+def split_by_flight(idx, starts):
+    return np.split(idx, np.searchsorted(idx, starts[1:]))
+
+## Make the flights. Returns a list containing lists with two elements: i) an
+## array of indices from the sorted list of images, and ii) constructed subdir name.
+## streams (optional) is the stream number of each image, and thresh_abs can be
+## an array with the threshold of each stream (see flight_numbers).
+## If divide_streams, each flight is split into a subdirectory for each stream
+## (named from stream_names); otherwise if divide_tif_jpg, into a TIF and a JPG
+## subdirectory (other file types are left out). Either way every image is
+## bucketed in a single sort.
+def make_flights(ts, fns, thresh_abs, template, first_num, divide_tif_jpg=False, subdir_tif="mss", subdir_jpg="rgb",
+                 streams=None, stream_names=None, divide_streams=False):
+    if streams is None:
+        streams = np.zeros(len(ts), dtype=np.int64)
+    flight = flight_numbers(ts, streams, thresh_abs)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(flight)) + 1)) if len(ts) else np.zeros(0, dtype=np.int64)
+    ends = np.concatenate((starts[1:] - 1, [len(ts) - 1])) if len(ts) else np.zeros(0, dtype=np.int64)
+    names = flight_names(ts, starts, ends, template, first_num)
+    if divide_streams:
+        sub = streams
+        sub_names = stream_names
+    elif divide_tif_jpg:
+        fns_lower = np.char.lower(np.array(fns, dtype=str))
+        sub = np.where(np.char.endswith(fns_lower, ".tif"), 0, np.where(np.char.endswith(fns_lower, ".jpg"), 1, -1))
+        sub_names = [subdir_tif, subdir_jpg]
+    else:
+        all_idx = split_by_flight(np.arange(len(ts)), starts)
+        return [[all_idx[i], names[i]] for i in range(len(starts))]
+
+    ## Sort by flight and then subdirectory (stable, so each stays in time order)
+    idx = np.flatnonzero(sub >= 0)
+    key = flight[idx] * len(sub_names) + sub[idx]
+    order = np.argsort(key, kind="stable")
+    idx = idx[order]
+    key = key[order]
+    flights = []
+    for group in np.split(idx, np.flatnonzero(np.diff(key)) + 1):
+        if len(group) > 0:
+            flights.append([group, os.path.join(names[flight[group[0]]], sub_names[sub[group[0]]])])
+    return flights
+
+## Split images into flights as they arrive (e.g. in a watched folder). The
+## images waiting for their flight to close are kept in time order by inserting
+## each one where it belongs (bisect) rather than sorting them again, and a
+## flight is closed once there's a gap of at least the threshold after it, i.e.
+## once an image from the next flight has arrived. thresh_val is in seconds, or
+## a multiple of the median sampling interval of all the images so far. Each
+## image is a tuple with the timestamp as its second element (see
+## ImageRecords.append).
+class FlightCollector(object):
+    def __init__(self, thresh_val, thresh_units="seconds"):
+        self.thresh_val = thresh_val
+        self.multiple = thresh_units != "seconds"
+        self.ts = []
+        self.imgs = []
+        ## Every distinct timestamp seen, and counts of the intervals between them
+        self.times = []
+        self.intervals = Counter()
+        self.closed = []    # first and last timestamp of each closed flight
+
+    ## The threshold in seconds, or None if there aren't enough images yet to
+    ## know the median interval
+    def thresh_abs(self):
+        if not self.multiple:
+            return self.thresh_val
+        median = counts_median(self.intervals)
+        return None if median is None else self.thresh_val * median
+
+    ## Add a timestamp to the interval counts. One that falls between two
+    ## others splits the interval between them. Images mostly arrive in time
+    ## order, so this is usually an append.
+    def add_time(self, ts):
+        i = bisect.bisect_left(self.times, ts)
+        if i < len(self.times) and self.times[i] == ts:
+            return
+        if i > 0:
+            self.intervals[ts - self.times[i - 1]] += 1
+        if i < len(self.times):
+            self.intervals[self.times[i] - ts] += 1
+            if i > 0:
+                split = self.times[i] - self.times[i - 1]
+                self.intervals[split] -= 1
+                if self.intervals[split] == 0:
+                    del self.intervals[split]
+        self.times.insert(i, ts)
+
+    ## Add a list of images. Images that fall within the threshold of a flight
+    ## that was already closed (e.g. from a card copied out of order) join that
+    ## flight. Returns a list of (image, index of the closed flight) for those.
+    def add(self, imgs):
+        for img in imgs:
+            self.add_time(img[1])
+        thresh = self.thresh_abs() if len(self.closed) > 0 else None
+        late = []
+        for img in imgs:
+            ts = img[1]
+            k = None
+            if thresh is not None:
+                k = next((k for k, (first, last) in enumerate(self.closed) if first - thresh < ts < last + thresh), None)
+            if k is None:
+                i = bisect.bisect_right(self.ts, ts)
+                self.ts.insert(i, ts)
+                self.imgs.insert(i, img)
+            else:
+                self.closed[k] = [min(self.closed[k][0], ts), max(self.closed[k][1], ts)]
+                late.append((img, k))
+        return late
+
+    ## Add the timestamps of a flight that was closed earlier (e.g. before a
+    ## restart), so its images count towards the median interval and late
+    ## images can still join it. A flight with no images (none of them could be
+    ## placed) keeps its number, but no images join it.
+    def add_closed(self, ts):
+        for t in ts:
+            self.add_time(t)
+        if len(ts) > 0:
+            self.closed.append([min(ts), max(ts)])
+        else:
+            self.closed.append([float("inf"), float("-inf")])
+
+    ## Number of images waiting for their flight to close
+    def pending(self):
+        return len(self.ts)
+
+    ## Close the flights that are complete (all but the last one, which may
+    ## still be growing), or all of them if final (e.g. the folder has been idle).
+    ## Returns a list with the images of each flight closed, in time order.
+    def close_flights(self, final=False):
+        if len(self.ts) == 0:
+            return []
+        thresh = self.thresh_abs()
+        if thresh is None:
+            starts = np.zeros(1, dtype=np.int64)
+        else:
+            starts = flight_bounds(time_diffs(np.array(self.ts, dtype=np.int64)), thresh)[0]
+        ends = np.concatenate((starts[1:], [len(self.ts)]))
+        num = len(starts) if final else len(starts) - 1
+        flights = []
+        for k in range(num):
+            flights.append(self.imgs[starts[k]:ends[k]])
+            self.closed.append([self.ts[starts[k]], self.ts[ends[k] - 1]])
+        if num > 0:
+            del self.ts[:ends[num - 1]]
+            del self.imgs[:ends[num - 1]]
+        return flights
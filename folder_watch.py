@@ -0,0 +1,162 @@
+## Watch a folder for new images
+## (c) Andy Lyons, 2017
+
+## On Linux the folder is watched with inotify (called through ctypes, so no
+## extra modules are needed): the kernel reports each file that's created,
+## finishes being written or is moved into the folder, and nothing is done while
+## the folder is quiet. Anywhere else (or on network drives, where inotify doesn't
+## see changes made by other machines) the folder is polled, comparing the size
+## and modification time of every file with the last scan.
+
+## Either way a new file isn't read until it's finished: a Debouncer holds each
+## one until its size and modification time haven't changed for a few seconds.
+
+import os, sys, time, select, struct, errno
+import ctypes, ctypes.util
+import exif_reader
+
+## inotify events (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+## Size of the fixed part of an inotify event (wd, mask, cookie, len)
+EVENT_HEADER = struct.Struct("iIII")
+
+## True if the file name has one of the image extensions
+def is_image(fn):
+    return fn.lower().endswith(exif_reader.IMG_EXTS)
+
+## Images in a folder (including any that are still being written)
+def folder_images(dirname):
+    fns = []
+    for entry in os.scandir(dirname):
+        if is_image(entry.name) and entry.is_file():
+            fns.append(entry.path)
+    return fns
+
+class InotifyWatcher(object):
+    def __init__(self, dirname):
+        self.dirname = dirname
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        if libc.inotify_add_watch(self.fd, os.fsencode(dirname), WATCH_MASK) < 0:
+            e = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(e, os.strerror(e))
+
+    ## Wait up to timeout seconds for images to be added or changed. Returns a
+    ## list of their paths (all the images in the folder if events were lost).
+    def wait(self, timeout):
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        fns = []
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            name = data[pos + EVENT_HEADER.size:pos + EVENT_HEADER.size + length].rstrip(b"\0")
+            pos = pos + EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                return folder_images(self.dirname)
+            if name and not mask & IN_ISDIR and is_image(os.fsdecode(name)):
+                fns.append(os.path.join(self.dirname, os.fsdecode(name)))
+        return fns
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class PollWatcher(object):
+    def __init__(self, dirname, interval=5.0):
+        self.dirname = dirname
+        self.interval = interval
+        self.last_scan = 0
+        self.seen = {}
+
+    ## Scan the folder (at most every interval seconds) and return the images
+    ## that are new or have changed since the last scan
+    def wait(self, timeout):
+        time.sleep(max(0, min(timeout, self.last_scan + self.interval - time.time())))
+        if time.time() - self.last_scan < self.interval:
+            return []
+        self.last_scan = time.time()
+        seen = {}
+        fns = []
+        for entry in os.scandir(self.dirname):
+            if not is_image(entry.name) or not entry.is_file():
+                continue
+            st = entry.stat()
+            seen[entry.path] = (st.st_size, st.st_mtime_ns)
+            if self.seen.get(entry.path) != seen[entry.path]:
+                fns.append(entry.path)
+        self.seen = seen
+        return fns
+
+    def close(self):
+        pass
+
+## Watch a folder with inotify if possible, otherwise by polling it every interval
+## seconds. Returns the watcher and the method used.
+def make_watcher(dirname, polling=False, interval=5.0):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(dirname), "inotify"
+        except (OSError, AttributeError):
+            pass
+    return PollWatcher(dirname, interval), "polling"
+
+## Holds new files until they've stopped changing (e.g. while they're being
+## copied off a card). A file is ready once its size and modification time have
+## been the same for settle seconds.
+class Debouncer(object):
+    def __init__(self, settle=3.0):
+        self.settle = settle
+        self.files = {}    # fn -> (size, mtime_ns, time it last changed)
+
+    def add(self, fns):
+        now = time.time()
+        for fn in fns:
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            last = self.files.get(fn)
+            if last is None or last[:2] != (st.st_size, st.st_mtime_ns):
+                self.files[fn] = (st.st_size, st.st_mtime_ns, now)
+
+    ## Files that are ready to read (and stop tracking them). Files that have
+    ## disappeared are dropped.
+    def ready(self):
+        now = time.time()
+        fns = []
+        for fn, (size, mtime_ns, since) in list(self.files.items()):
+            try:
+                st = os.stat(fn)
+            except OSError:
+                del self.files[fn]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                self.files[fn] = (st.st_size, st.st_mtime_ns, now)
+            elif now - since >= self.settle and st.st_size > 0:
+                fns.append(fn)
+                del self.files[fn]
+        return sorted(fns)
+
+    def __len__(self):
+        return len(self.files)
@@ -0,0 +1,330 @@
+## Image footprints, coverage grid and under-covered areas
+## (c) Andy Lyons, 2017
+
+## The footprint of each image is estimated from its height above the ground and
+## the camera's field of view (assuming the camera points straight down), and
+## all the footprints are counted on a grid: each grid cell holds the number of
+## images that cover its center. Cells inside the hull of a flight that are
+## covered by too few images are turned into polygons (the gaps).
+## Everything is in projected coordinates (meters).
+
+import numpy as np
+
+## Diagonal of a 35mm film frame (mm)
+FRAME_DIAG_35MM = 43.27
+
+## Image aspect (width:height) assumed if the image size isn't in the header
+DEFAULT_ASPECT = (4.0, 3.0)
+
+## Cell size of the grid, if it isn't given: this fraction of the median
+## footprint height, but no more cells than MAX_CELLS
+AUTO_CELLS_PER_FOOTPRINT = 20
+MAX_CELLS = 20000000
+
+## Height above ground of each image: the RelativeAltitude (DJI, relative to the
+## takeoff point), or GPSAltitude minus ground_elev if that's given
+def height_above_ground(imgs, ground_elev=None):
+    agl = imgs.rel_alt.copy()
+    if ground_elev is not None:
+        missing = np.isnan(agl)
+        agl[missing] = imgs.gps_alt[missing] - ground_elev
+    agl[agl <= 0] = np.nan
+    return agl
+
+## Ground width and height (meters) of each image, NaN if it can't be estimated.
+## Uses the 35mm equivalent focal length, or the focal length and sensor width
+## (mm) if that's given.
+def footprint_size(imgs, ground_elev=None, sensor_width=0):
+    agl = height_above_ground(imgs, ground_elev)
+    w_px = imgs.img_width.copy()
+    h_px = imgs.img_height.copy()
+    no_size = np.isnan(w_px) | np.isnan(h_px) | (w_px <= 0) | (h_px <= 0)
+    w_px[no_size] = DEFAULT_ASPECT[0]
+    h_px[no_size] = DEFAULT_ASPECT[1]
+    diag_px = np.hypot(w_px, h_px)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ground_diag = agl * FRAME_DIAG_35MM / np.where(imgs.focal35 > 0, imgs.focal35, np.nan)
+        if sensor_width > 0:
+            from_focal = agl * sensor_width / np.where(imgs.focal > 0, imgs.focal, np.nan) * diag_px / w_px
+            ground_diag = np.where(np.isnan(ground_diag), from_focal, ground_diag)
+    return ground_diag * w_px / diag_px, ground_diag * h_px / diag_px
+
+## Corners of each footprint, an (n, 4, 2) array. The top of the image faces the
+## yaw direction (degrees clockwise from north): the gimbal yaw, or the flight
+## yaw if that's missing, or north.
+def footprint_corners(imgs, width, height):
+    yaw = imgs.yaw()
+    yaw = np.radians(np.where(np.isnan(yaw), 0.0, yaw))
+    up = np.column_stack((np.sin(yaw), np.cos(yaw)))
+    right = np.column_stack((np.cos(yaw), -np.sin(yaw)))
+    center = np.column_stack((imgs.x, imgs.y))
+    corners = np.empty((len(center), 4, 2))
+    for k, (sx, sy) in enumerate(((-1, -1), (1, -1), (1, 1), (-1, 1))):
+        corners[:, k, :] = center + right * (sx * width / 2)[:, None] + up * (sy * height / 2)[:, None]
+    return corners
+
+class Grid(object):
+    ## A grid of nrows x ncols square cells, with its lower left corner at (x0, y0).
+    ## Row 0 is the bottom row.
+    def __init__(self, x0, y0, cell, nrows, ncols):
+        self.x0 = x0
+        self.y0 = y0
+        self.cell = cell
+        self.nrows = nrows
+        self.ncols = ncols
+
+## Grid covering a set of points, with a margin of one cell
+def grid_around(xs, ys, cell):
+    x0 = np.floor(np.nanmin(xs) / cell) * cell - cell
+    y0 = np.floor(np.nanmin(ys) / cell) * cell - cell
+    ncols = int(np.ceil((np.nanmax(xs) - x0) / cell)) + 1
+    nrows = int(np.ceil((np.nanmax(ys) - y0) / cell)) + 1
+    return Grid(x0, y0, cell, nrows, ncols)
+
+## Edges of a set of polygons: arrays of x0, y0, x1, y1 and polygon number.
+## polygons is an (n, k, 2) array or a list of (k, 2) arrays.
+def polygon_edges(polygons):
+    if isinstance(polygons, np.ndarray):
+        n, k = polygons.shape[:2]
+        start = polygons.reshape(-1, 2)
+        end = np.roll(polygons, -1, axis=1).reshape(-1, 2)
+        poly = np.repeat(np.arange(n), k)
+    else:
+        start = np.vstack(polygons)
+        end = np.vstack([np.roll(xy, -1, axis=0) for xy in polygons])
+        poly = np.repeat(np.arange(len(polygons)), [len(xy) for xy in polygons])
+    return start[:, 0], start[:, 1], end[:, 0], end[:, 1], poly
+
+## Number of convex polygons covering the center of each grid cell. Each polygon
+## edge is intersected with the center line of every grid row it crosses (all at
+## once), which gives the span of columns the polygon covers in each row. The
+## spans are added into a difference array, and a cumulative sum along the rows
+## turns that into the counts.
+def rasterize_convex(polygons, grid):
+    counts = np.zeros((grid.nrows, grid.ncols), dtype=np.int32)
+    if len(polygons) == 0:
+        return counts
+    ex0, ey0, ex1, ey1, poly = polygon_edges(polygons)
+    ## Rows whose center line is crossed by each edge (y0 <= yc < y1, so a
+    ## vertex isn't counted twice; horizontal edges cross no rows)
+    ylo = np.minimum(ey0, ey1)
+    yhi = np.maximum(ey0, ey1)
+    r0 = np.maximum(np.ceil((ylo - grid.y0) / grid.cell - 0.5), 0).astype(np.int64)
+    r1 = np.minimum(np.ceil((yhi - grid.y0) / grid.cell - 0.5) - 1, grid.nrows - 1).astype(np.int64)
+    nrows = np.maximum(r1 - r0 + 1, 0)
+    edge = np.repeat(np.arange(len(ex0)), nrows)
+    if len(edge) == 0:
+        return counts
+    rows = r0[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(nrows) - nrows, nrows)
+    yc = grid.y0 + (rows + 0.5) * grid.cell
+    xc = ex0[edge] + (yc - ey0[edge]) * (ex1[edge] - ex0[edge]) / (ey1[edge] - ey0[edge])
+
+    ## Span of each polygon in each row
+    key = poly[edge] * grid.nrows + rows
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    xc = xc[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(key)) + 1))
+    rows = key[starts] % grid.nrows
+    xmin = np.minimum.reduceat(xc, starts)
+    xmax = np.maximum.reduceat(xc, starts)
+    c0 = np.maximum(np.ceil((xmin - grid.x0) / grid.cell - 0.5), 0).astype(np.int64)
+    c1 = np.minimum(np.floor((xmax - grid.x0) / grid.cell - 0.5), grid.ncols - 1).astype(np.int64)
+    ok = c1 >= c0
+    rows = rows[ok]
+    width = grid.ncols + 1
+    size = grid.nrows * width
+    diff = np.bincount(rows * width + c0[ok], minlength=size) - np.bincount(rows * width + c1[ok] + 1, minlength=size)
+    counts[:] = np.cumsum(diff.reshape(grid.nrows, width)[:, :-1], axis=1)
+    return counts
+
+## Turn directions: (dx, dy) of each direction, and the direction after a left
+## turn, going straight, and a right turn (the order they're tried in)
+DIRS = [(1, 0), (0, 1), (-1, 0), (0, -1)]    # east, north, west, south
+TURN_ORDER = [[1, 0, 3], [2, 1, 0], [3, 2, 1], [0, 3, 2]]
+
+## Offset (columns, rows) from the start corner of a run to the cell on its
+## left, for each direction
+LEFT_CELL = [(0, 0), (-1, 0), (-1, -1), (0, -1)]
+
+## Signed area of a ring (positive if counter-clockwise)
+def ring_area(xy):
+    return 0.5 * float(np.dot(xy[:, 0], np.roll(xy[:, 1], -1)) - np.dot(xy[:, 1], np.roll(xy[:, 0], -1)))
+
+## Label the areas of a grid where mask is True (cells connected through their
+## sides). Returns a function that gives the label of cells (rows, cols) in the
+## areas. Works on the runs of True cells in each row: runs in neighboring
+## rows that overlap are joined (union-find).
+def label_areas(mask):
+    nrows, ncols = mask.shape
+    width = ncols + 1
+    edges = np.diff(np.pad(mask.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    run_row, run_start = np.nonzero(edges == 1)
+    run_end = np.nonzero(edges == -1)[1]    # one past the last cell
+    key_start = run_row * width + run_start
+    key_end = run_row * width + run_end
+
+    ## Runs in the next row that overlap each run (a contiguous range of them)
+    lo = np.searchsorted(key_end, (run_row + 1) * width + run_start, side="right")
+    hi = np.searchsorted(key_start, (run_row + 1) * width + run_end, side="left")
+    num = np.maximum(hi - lo, 0)
+    pair_a = np.repeat(np.arange(len(run_row)), num)
+    pair_b = np.repeat(lo, num) + np.arange(len(pair_a)) - np.repeat(np.cumsum(num) - num, num)
+
+    parent = list(range(len(run_row)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for a, b in zip(pair_a.tolist(), pair_b.tolist()):
+        ra = find(a)
+        rb = find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+
+    def label(rows, cols):
+        runs = np.searchsorted(key_start, rows * width + cols, side="right") - 1
+        return np.array([find(i) for i in runs.tolist()], dtype=np.int64)
+    return label
+
+## Outline the areas of a grid where mask is True. Returns a list of polygons,
+## each a list of rings (the outer ring first, then any holes), in map
+## coordinates. Cells are connected through their sides (not their corners).
+def polygonize(mask, grid):
+    nrows, ncols = mask.shape
+    padded = np.zeros((nrows + 2, ncols + 2), dtype=bool)
+    padded[1:-1, 1:-1] = mask
+    inner = padded[1:-1, 1:-1]
+
+    ## Boundary edges of the cells, directed so the area is on their left (outer
+    ## rings come out counter-clockwise and holes clockwise), joined into
+    ## straight runs. Vertices are in grid corner units (column, row).
+    starts = []
+    ends = []
+    dirs = []
+    for d, (dr, dc) in ((0, (-1, 0)), (1, (0, 1)), (2, (1, 0)), (3, (0, -1))):
+        r, c = np.nonzero(inner & ~padded[1 + dr:nrows + 1 + dr, 1 + dc:ncols + 1 + dc])
+        if len(r) == 0:
+            continue
+        ## start corner of the edge on each side of the cell
+        sc, sr = {0: (c, r), 1: (c + 1, r), 2: (c + 1, r + 1), 3: (c, r + 1)}[d]
+        ## Position along the run and across it; a run breaks where the
+        ## positions along it aren't consecutive
+        along, across = (sc, sr) if d in (0, 2) else (sr, sc)
+        order = np.lexsort((along, across))
+        along = along[order]
+        across = across[order]
+        brk = np.flatnonzero((np.diff(across) != 0) | (np.diff(along) != 1)) + 1
+        first = np.concatenate(([0], brk))
+        last = np.concatenate((brk - 1, [len(along) - 1]))
+        ## Runs going east or north start at their lowest position, the others at their highest
+        lo, hi = (first, last) if d in (0, 1) else (last, first)
+        step = DIRS[d]
+        if d in (0, 2):
+            starts.append(np.column_stack((along[lo], across[lo])))
+            ends.append(np.column_stack((along[hi] + step[0], across[hi])))
+        else:
+            starts.append(np.column_stack((across[lo], along[lo])))
+            ends.append(np.column_stack((across[hi], along[hi] + step[1])))
+        dirs.append(np.full(len(first), d))
+    if len(dirs) == 0:
+        return []
+    starts = np.vstack(starts).tolist()
+    ends = np.vstack(ends).tolist()
+    dirs = np.concatenate(dirs).tolist()
+
+    ## Outgoing runs at each vertex (two at a pinch point, where only corners meet)
+    out = {}
+    for i, (vc, vr) in enumerate(starts):
+        out.setdefault((vc, vr), []).append(i)
+    used = [False] * len(dirs)
+
+    rings = []
+    ring_firsts = []
+    for first in range(len(dirs)):
+        if used[first]:
+            continue
+        used[first] = True
+        ring_firsts.append(first)
+        ring = [starts[first]]
+        i = first
+        while True:
+            ## Take the left-most turn, so rings don't cross at a pinch point.
+            ## Back at the start, the ring closes.
+            choices = [j for j in out[tuple(ends[i])] if not used[j] or j == first]
+            if len(choices) > 1:
+                choices.sort(key=lambda j: TURN_ORDER[dirs[i]].index(dirs[j]))
+            i = choices[0]
+            if i == first:
+                break
+            used[i] = True
+            ring.append(starts[i])
+        rings.append(np.array(ring, dtype=np.float64) * grid.cell + (grid.x0, grid.y0))
+
+    ## Each hole goes with the outer ring of the same area: the cell on the left
+    ## of each ring's first run is looked up in the labelled areas
+    label = label_areas(mask)
+    cell_cols = np.array([starts[i][0] + LEFT_CELL[dirs[i]][0] for i in ring_firsts])
+    cell_rows = np.array([starts[i][1] + LEFT_CELL[dirs[i]][1] for i in ring_firsts])
+    ring_label = label(cell_rows, cell_cols).tolist()
+    areas = [ring_area(xy) for xy in rings]
+    polygons = dict((ring_label[k], [rings[k]]) for k in range(len(rings)) if areas[k] > 0)
+    for k in range(len(rings)):
+        if areas[k] < 0:
+            polygons[ring_label[k]].append(rings[k])
+    return [polygons[k] for k in sorted(polygons)]
+
+## Area of a polygon (list of rings, outer first)
+def polygon_area(rings):
+    return abs(ring_area(rings[0])) - sum(abs(ring_area(xy)) for xy in rings[1:])
+
+## Pick a cell size from the footprints
+def auto_cell_size(fp_height, xs, ys):
+    cell = float(np.nanmedian(fp_height)) / AUTO_CELLS_PER_FOOTPRINT
+    cell = float("%.2g" % cell)
+    area = (np.nanmax(xs) - np.nanmin(xs)) * (np.nanmax(ys) - np.nanmin(ys))
+    if area / cell ** 2 > MAX_CELLS:
+        cell = float("%.2g" % np.sqrt(area / MAX_CELLS))
+    return cell
+
+class Coverage(object):
+    ## Results of the coverage analysis: the grid and counts, the gap polygons,
+    ## and the number of images with footprints
+    def __init__(self, grid, counts, gaps, num_footprints, hull_cells, gap_cells):
+        self.grid = grid
+        self.counts = counts
+        self.gaps = gaps
+        self.num_footprints = num_footprints
+        self.hull_cells = hull_cells
+        self.gap_cells = gap_cells
+
+## Count the footprints of all the images on a grid, and find the areas inside
+## the flight hulls (hulls, a list of (k, 2) arrays) covered by fewer than
+## min_images. Returns None if no footprints can be estimated.
+def coverage_analysis(imgs, hulls, min_images, cell_size=0, ground_elev=None, sensor_width=0):
+    width, height = footprint_size(imgs, ground_elev, sensor_width)
+    ok = ~(np.isnan(width) | np.isnan(imgs.x) | np.isnan(imgs.y))
+    if not ok.any():
+        return None
+    corners = footprint_corners(imgs, width, height)[ok]
+    if cell_size <= 0:
+        cell_size = auto_cell_size(height[ok], corners[:, :, 0], corners[:, :, 1])
+    grid = grid_around(corners[:, :, 0], corners[:, :, 1], cell_size)
+    counts = rasterize_convex(corners, grid)
+    in_hull = rasterize_convex(hulls, grid) > 0
+    under = in_hull & (counts < min_images)
+    return Coverage(grid, counts, polygonize(under, grid), int(ok.sum()), int(in_hull.sum()), int(under.sum()))
+
+## Write the counts as an ESRI ASCII grid (with a .prj file if wkt is given)
+def write_asc(fnAsc, counts, grid, wkt=None):
+    with open(fnAsc, "w") as f:
+        f.write("ncols %d\nnrows %d\nxllcorner %.6f\nyllcorner %.6f\ncellsize %.6f\nNODATA_value -9999\n" %
+                (grid.ncols, grid.nrows, grid.x0, grid.y0, grid.cell))
+        ## Top row first
+        np.savetxt(f, counts[::-1], fmt="%d")
+    if wkt is not None:
+        with open(fnAsc[:-4] + ".prj", "w") as f:
+            f.write(wkt)
+    return fnAsc
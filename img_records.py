@@ -0,0 +1,207 @@
+## Compact column-oriented store for the image records
+## (c) Andy Lyons, 2017
+
+## Each image has a filename, a timestamp (int64 seconds since 1970-01-01, clock
+## time with no time zone), longitude, latitude, flight and gimbal yaw (float64,
+## NaN if missing), the camera info used for footprints: altitude (GPS, and
+## relative to the takeoff point), focal length (actual and 35mm equivalent) and
+## image size (float32, which is plenty for these), and the camera make, model
+## and serial number (kept as codes into a list of the distinct values, since
+## there are only a few). Values are parsed once when the record is added and
+## kept in typed arrays, and the filenames are kept in a single byte string with
+## a start offset and length, so each image takes 86 bytes plus its filename
+## (RECORD_BYTES). Once the records are finished, projected coordinates (x, y)
+## can be added with set_xy (another 16 bytes per image); until then x and y
+## are the longitude and latitude.
+
+import os
+from array import array
+from datetime import datetime, timedelta
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+
+## Float columns, and the ones only used for the footprints (kept as float32)
+FLOAT_COLS = ("lon", "lat", "yaw_flight", "yaw_gimbal", "gps_alt", "rel_alt", "focal", "focal35", "img_width", "img_height")
+FLOAT32_COLS = ("gps_alt", "rel_alt", "focal", "focal35", "img_width", "img_height")
+NAN = float("nan")
+
+## String columns (kept as int32 codes, see ImageRecords.add_code)
+CODE_COLS = ("make", "model", "serial")
+
+## Bytes per image, not counting the filename: the filename's offset and length,
+## timestamp, float columns and codes
+RECORD_BYTES = 8 + 2 + 8 + 8 * (len(FLOAT_COLS) - len(FLOAT32_COLS)) + 4 * len(FLOAT32_COLS) + 4 * len(CODE_COLS)
+
+## Parse an EXIF date-time string ('YYYY:MM:DD HH:MM:SS') into epoch seconds.
+## Raises ValueError if it isn't valid.
+def parse_datetime(s):
+    return int((datetime.strptime(s, '%Y:%m:%d %H:%M:%S') - EPOCH).total_seconds())
+
+def to_datetime(ts):
+    return EPOCH + timedelta(seconds=int(ts))
+
+## Format an array of timestamps as lists of 'YYYY:MM:DD' and 'HH:MM:SS' strings
+## (the format used in the shapefile attribute table)
+def date_time_strings(ts):
+    s = np.datetime_as_string(np.asarray(ts, dtype=np.int64).astype("datetime64[s]"), unit="s")
+    return [x[0:10].replace("-", ":") for x in s], [x[11:19] for x in s]
+
+## Parse an optional number, NaN if it's missing
+def parse_float(s):
+    try:
+        return float(s)
+    except (ValueError, TypeError):
+        return float("nan")
+
+class ImageRecords(object):
+    def __init__(self):
+        ## While records are being added they go into compact array.arrays;
+        ## finish() turns them into numpy arrays
+        self.names = bytearray()
+        self.name_start = array("q")
+        self.name_len = array("H")
+        self.ts = array("q")
+        for col in FLOAT_COLS:
+            setattr(self, col, array("f" if col in FLOAT32_COLS else "d"))
+        for col in CODE_COLS:
+            setattr(self, col, array("i"))
+        self.codes = dict((col, {}) for col in CODE_COLS)
+        self.values = dict((col, []) for col in CODE_COLS)
+        self.x = None
+        self.y = None
+        self.epsg = 4326
+        self.finished = False
+
+    def append(self, fn, ts, lon, lat, yaw_flight=NAN, yaw_gimbal=NAN, gps_alt=NAN, rel_alt=NAN, focal=NAN, focal35=NAN,
+               img_width=NAN, img_height=NAN, make="", model="", serial=""):
+        name = fn.encode("utf-8")
+        self.name_start.append(len(self.names))
+        self.name_len.append(len(name))
+        self.names.extend(name)
+        self.ts.append(ts)
+        self.lon.append(lon)
+        self.lat.append(lat)
+        self.yaw_flight.append(yaw_flight)
+        self.yaw_gimbal.append(yaw_gimbal)
+        self.gps_alt.append(gps_alt)
+        self.rel_alt.append(rel_alt)
+        self.focal.append(focal)
+        self.focal35.append(focal35)
+        self.img_width.append(img_width)
+        self.img_height.append(img_height)
+        self.add_code("make", make)
+        self.add_code("model", model)
+        self.add_code("serial", serial)
+
+    ## Add the code of a value to one of the string columns
+    def add_code(self, col, value):
+        code = self.codes[col].get(value)
+        if code is None:
+            code = len(self.values[col])
+            self.codes[col][value] = code
+            self.values[col].append(value)
+        getattr(self, col).append(code)
+
+    def finish(self):
+        if not self.finished:
+            self.names = bytes(self.names)
+            self.name_start = np.frombuffer(self.name_start, dtype=np.int64).copy()
+            self.name_len = np.frombuffer(self.name_len, dtype=np.uint16).copy()
+            self.ts = np.frombuffer(self.ts, dtype=np.int64).copy()
+            for col in FLOAT_COLS:
+                setattr(self, col, np.frombuffer(getattr(self, col), dtype=np.float32 if col in FLOAT32_COLS else np.float64).copy())
+            for col in CODE_COLS:
+                setattr(self, col, np.frombuffer(getattr(self, col), dtype=np.int32).copy())
+            self.x = self.lon
+            self.y = self.lat
+            self.finished = True
+        return self
+
+    ## Add the projected coordinates of all the records (in the current order)
+    def set_xy(self, x, y, epsg):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.epsg = epsg
+
+    ## True if the records have projected coordinates
+    def projected(self):
+        return self.epsg != 4326
+
+    ## Direction each image faces (degrees clockwise from north): the gimbal
+    ## yaw, or the flight yaw if that's missing (NaN if neither is known)
+    def yaw(self):
+        return np.where(np.isnan(self.yaw_gimbal), self.yaw_flight, self.yaw_gimbal)
+
+    ## Names of the columns that are reordered and subset
+    def columns(self):
+        cols = ["name_start", "name_len", "ts"] + list(FLOAT_COLS) + list(CODE_COLS)
+        return cols + (["x", "y"] if self.projected() else [])
+
+    def __len__(self):
+        return len(self.ts)
+
+    ## Reorder all the columns
+    def reorder(self, idx):
+        for col in self.columns():
+            setattr(self, col, getattr(self, col)[idx])
+        if not self.projected():
+            self.x = self.lon
+            self.y = self.lat
+
+    ## Sort the records by timestamp (stable, so images taken in the same second
+    ## keep the order they were added in)
+    def sort_by_time(self):
+        self.finish()
+        self.reorder(np.argsort(self.ts, kind="stable"))
+
+    ## Return a new ImageRecords with just the records in idx (e.g., one flight).
+    ## The filename table is shared.
+    def take(self, idx):
+        sub = ImageRecords()
+        sub.names = self.names
+        sub.codes = self.codes
+        sub.values = self.values
+        sub.finished = True
+        sub.epsg = self.epsg
+        for col in self.columns():
+            setattr(sub, col, getattr(self, col)[idx])
+        if not sub.projected():
+            sub.x = sub.lon
+            sub.y = sub.lat
+        return sub
+
+    ## Codes and distinct values of a field the images can be grouped by (see
+    ## flight_groups.make_streams): 'ext' (the file extension) or a string column
+    def field_codes(self, field):
+        if field == "ext":
+            exts = [os.path.splitext(fn)[1][1:].lower() for fn in self.fns()]
+            values, codes = np.unique(np.array(exts, dtype=str), return_inverse=True)
+            return codes, values.tolist()
+        return getattr(self, field), self.values[field]
+
+    def fn(self, i):
+        start = int(self.name_start[i])
+        return self.names[start:start + int(self.name_len[i])].decode("utf-8")
+
+    def fns(self, idx=None):
+        if idx is None:
+            idx = range(len(self))
+        return [self.fn(i) for i in idx]
+
+    def datetime(self, i):
+        return to_datetime(self.ts[i])
+
+    ## Iterate over the records in idx (default all), yielding tuples of python
+    ## values (fn, date, time, lon, lat, yaw_flight, yaw_gimbal) ready for export
+    def iter_rows(self, idx=None):
+        if idx is None:
+            idx = np.arange(len(self))
+        idx = np.asarray(idx, dtype=np.int64)
+        dates, times = date_time_strings(self.ts[idx])
+        lon = self.lon[idx].tolist()
+        lat = self.lat[idx].tolist()
+        yaw_flight = self.yaw_flight[idx].tolist()
+        yaw_gimbal = self.yaw_gimbal[idx].tolist()
+        for k, i in enumerate(idx):
+            yield (self.fn(i), dates[k], times[k], lon[k], lat[k], yaw_flight[k], yaw_gimbal[k])
@@ -0,0 +1,212 @@
+## Make synthetic UAV images for benchmarking
+## (c) Andy Lyons, 2017
+
+## Writes a folder of small but valid JPEG and TIFF files that look like a day
+## (or a season) of drone flights to the scripts: each has an EXIF header with
+## DateTimeOriginal, GPS latitude, longitude and altitude, the camera make,
+## model, serial number, focal length and image size, and a DJI XMP packet with
+## the flight and gimbal yaw and the relative altitude. The pixels are a tiny
+## 8x8 gray image, but the header is padded with a maker note to the size of a
+## real camera's (DJI headers with their thumbnail are around 30-60 KB), so
+## reading the headers takes about as much I/O as it would with real images.
+
+## The images are taken every interval seconds along a lawnmower pattern, and
+## each flight starts gapMins minutes after the last one ended. With tifEvery = k,
+## every k-th image is a TIFF from a multispectral camera (0 for JPEGs only).
+
+## Usage:
+## python make_synthetic_imgs.py /tmp/synthetic --images 10000 --flights 20
+## python make_synthetic_imgs.py /tmp/synthetic --images 1000000 --flights 500 --tifEvery 0
+
+import os, sys, struct, random, argparse, time
+from datetime import datetime, timedelta
+
+## TIFF field types
+BYTE, ASCII, SHORT, LONG, RATIONAL, UNDEFINED = 1, 2, 3, 4, 5, 7
+
+## Cameras of the JPEGs and the TIFFs: make, model, focal length (mm), 35mm
+## equivalent focal length, image width and height
+CAMERA_JPG = ("DJI", "FC6310", 8.8, 24, 5472, 3648)
+CAMERA_TIF = ("MicaSense", "RedEdge-M", 5.4, 40, 1280, 960)
+
+## Images per line of the lawnmower pattern, and the spacing of the images and
+## the lines (degrees)
+LINE_LEN = 50
+SPACING = 0.0001
+
+## Start of the first flight, and where it is
+START = datetime(2017, 8, 18, 9, 0, 0)
+START_LAT = 38.5
+START_LON = -122.3
+GROUND_ELEV = 100.0
+FLIGHT_ALT = 60.0
+
+## Largest JPEG APP1 segment
+MAX_APP1 = 65533
+
+## A TIFF IFD starting at off, with the values that don't fit in an entry after it.
+## entries is a list of (tag, type, count, value bytes).
+def ifd_bytes(entries, off, e="<"):
+    entries = sorted(entries)
+    data_off = off + 2 + 12 * len(entries) + 4
+    head = struct.pack(e + "H", len(entries))
+    extra = b""
+    for tag, typ, count, val in entries:
+        if len(val) <= 4:
+            head += struct.pack(e + "HHI", tag, typ, count) + val.ljust(4, b"\0")
+        else:
+            head += struct.pack(e + "HHII", tag, typ, count, data_off + len(extra))
+            extra += val
+            if len(extra) % 2:
+                extra += b"\0"
+    return head + struct.pack(e + "I", 0) + extra
+
+def ascii_entry(tag, s):
+    val = s.encode("ascii") + b"\0"
+    return (tag, ASCII, len(val), val)
+
+def rationals(vals, e="<"):
+    return b"".join(struct.pack(e + "II", int(round(v * 10000)), 10000) for v in vals)
+
+## Degrees, minutes and seconds of an angle
+def dms(x):
+    x = abs(x)
+    d = int(x)
+    m = int((x - d) * 60)
+    return [d, m, (x - d - m / 60.0) * 3600]
+
+## The TIFF structure of a header: IFD0 (with the pixels of a tiny image if
+## pixels isn't empty), the Exif IFD and the GPS IFD. The pointers are LONGs so
+## the sizes don't depend on their values: the IFDs are laid out once to find
+## the offsets, then again with them.
+def tiff_header(ifd0, exif, gps, e="<", pixels=b""):
+    def layout(exifOff, gpsOff, pixOff):
+        entries = ifd0 + [(0x8769, LONG, 1, struct.pack(e + "I", exifOff)), (0x8825, LONG, 1, struct.pack(e + "I", gpsOff))]
+        if pixels:
+            entries = entries + [(0x0111, LONG, 1, struct.pack(e + "I", pixOff)), (0x0117, LONG, 1, struct.pack(e + "I", len(pixels)))]
+        b0 = ifd_bytes(entries, 8, e)
+        b1 = ifd_bytes(exif, 8 + len(b0), e)
+        b2 = ifd_bytes(gps, 8 + len(b0) + len(b1), e)
+        return b0, b1, b2
+    b0, b1, b2 = layout(0, 0, 0)
+    exifOff = 8 + len(b0)
+    gpsOff = exifOff + len(b1)
+    b0, b1, b2 = layout(exifOff, gpsOff, gpsOff + len(b2))
+    return (b"II*\0" if e == "<" else b"MM\0*") + struct.pack(e + "I", 8) + b0 + b1 + b2 + pixels
+
+## DJI style XMP packet
+def xmp_packet(yawFlight, yawGimbal, relAlt, absAlt):
+    return ('<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?><x:xmpmeta xmlns:x="adobe:ns:meta/">'
+            '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"><rdf:Description rdf:about="DJI Meta Data" '
+            'xmlns:drone-dji="http://www.dji.com/drone-dji/1.0/" drone-dji:AbsoluteAltitude="%+.2f" '
+            'drone-dji:RelativeAltitude="%+.2f" drone-dji:FlightYawDegree="%+.2f" drone-dji:GimbalYawDegree="%+.2f"/>'
+            '</rdf:RDF></x:xmpmeta><?xpacket end="w"?>' % (absAlt, relAlt, yawFlight, yawGimbal)).encode("ascii")
+
+## The EXIF and GPS entries of an image. pad is the size of the maker note.
+def exif_entries(dt, lat, lon, alt, camera, serial, pad, e="<"):
+    make, model, focal, focal35, width, height = camera
+    ifd0 = [ascii_entry(0x010F, make), ascii_entry(0x0110, model)]
+    exif = [ascii_entry(0x9003, dt.strftime("%Y:%m:%d %H:%M:%S")),
+            (0x920A, RATIONAL, 1, rationals([focal], e)),
+            (0xA405, SHORT, 1, struct.pack(e + "H", focal35)),
+            (0xA002, LONG, 1, struct.pack(e + "I", width)),
+            (0xA003, LONG, 1, struct.pack(e + "I", height)),
+            ascii_entry(0xA431, serial)]
+    if pad > 0:
+        exif.append((0x927C, UNDEFINED, pad, b"\0" * pad))
+    gps = [(0x0000, BYTE, 4, b"\x02\x03\x00\x00"),
+           ascii_entry(0x0001, "N" if lat >= 0 else "S"), (0x0002, RATIONAL, 3, rationals(dms(lat), e)),
+           ascii_entry(0x0003, "E" if lon >= 0 else "W"), (0x0004, RATIONAL, 3, rationals(dms(lon), e)),
+           (0x0005, BYTE, 1, b"\x00"), (0x0006, RATIONAL, 1, rationals([alt], e))]
+    return ifd0, exif, gps
+
+## Entropy coded data of an 8x8 gray JPEG (one block, DC and AC tables with a
+## single code each)
+def jpeg_body():
+    dqt = b"\xff\xdb" + struct.pack(">H", 67) + b"\x00" + b"\x01" * 64
+    sof = b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, 8, 8, 1) + b"\x01\x11\x00"
+    dht_dc = b"\xff\xc4" + struct.pack(">H", 20) + b"\x00" + b"\x01" + b"\x00" * 15 + b"\x00"
+    dht_ac = b"\xff\xc4" + struct.pack(">H", 20) + b"\x10" + b"\x01" + b"\x00" * 15 + b"\x00"
+    sos = b"\xff\xda" + struct.pack(">HB", 8, 1) + b"\x01\x00" + b"\x00\x3f\x00"
+    return dqt + sof + dht_dc + dht_ac + sos + b"\x3f" + b"\xff\xd9"
+
+JPEG_BODY = jpeg_body()
+
+def make_jpeg(dt, lat, lon, alt, yawFlight, yawGimbal, relAlt, serial, headerBytes):
+    ifd0, exif, gps = exif_entries(dt, lat, lon, alt, CAMERA_JPG, serial, 0)
+    app1 = b"Exif\0\0" + tiff_header(ifd0, exif, gps)
+    ## Pad the Exif segment with a maker note, up to the most a segment can hold
+    pad = min(headerBytes, MAX_APP1 - 2) - len(app1) - 12
+    if pad > 0:
+        ifd0, exif, gps = exif_entries(dt, lat, lon, alt, CAMERA_JPG, serial, pad)
+        app1 = b"Exif\0\0" + tiff_header(ifd0, exif, gps)
+    xmp = b"http://ns.adobe.com/xap/1.0/\0" + xmp_packet(yawFlight, yawGimbal, relAlt, alt)
+    return (b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 +
+            b"\xff\xe1" + struct.pack(">H", len(xmp) + 2) + xmp + JPEG_BODY)
+
+## Uncompressed 8x8 gray TIFF (big-endian if e is '>')
+def make_tiff(dt, lat, lon, alt, yawFlight, yawGimbal, relAlt, serial, headerBytes, e="<"):
+    ifd0, exif, gps = exif_entries(dt, lat, lon, alt, CAMERA_TIF, serial, max(0, headerBytes - 1024), e)
+    xmp = xmp_packet(yawFlight, yawGimbal, relAlt, alt)
+    ifd0 = ifd0 + [(0x0100, SHORT, 1, struct.pack(e + "H", 8)), (0x0101, SHORT, 1, struct.pack(e + "H", 8)),
+                   (0x0102, SHORT, 1, struct.pack(e + "H", 8)), (0x0103, SHORT, 1, struct.pack(e + "H", 1)),
+                   (0x0106, SHORT, 1, struct.pack(e + "H", 1)), (0x0115, SHORT, 1, struct.pack(e + "H", 1)),
+                   (0x0116, SHORT, 1, struct.pack(e + "H", 8)), (0x02BC, BYTE, len(xmp), xmp)]
+    return tiff_header(ifd0, exif, gps, e, b"\x80" * 64)
+
+## Write the images. Returns the number of files and their total size.
+def make_images(fnOutDir, numImages=1000, numFlights=5, interval=2, gapMins=15, tifEvery=5, headerKB=32, seed=0):
+    if not os.path.isdir(fnOutDir):
+        os.makedirs(fnOutDir)
+    rnd = random.Random(seed)
+    numFlights = max(1, min(numFlights, numImages))
+    digits = max(5, len(str(numImages - 1)))
+    headerBytes = int(headerKB * 1024)
+    t = START
+    k = 0
+    totalBytes = 0
+    for flt in range(numFlights):
+        perFlight = numImages // numFlights + (1 if flt < numImages % numFlights else 0)
+        for i in range(perFlight):
+            ## Lawnmower pattern, turning around at the end of each line
+            line = i // LINE_LEN
+            pos = i % LINE_LEN if line % 2 == 0 else LINE_LEN - 1 - i % LINE_LEN
+            lat = START_LAT + SPACING * pos + 0.001 * (flt % 20) + rnd.uniform(-2e-6, 2e-6)
+            lon = START_LON + SPACING * line + rnd.uniform(-2e-6, 2e-6)
+            relAlt = FLIGHT_ALT + rnd.uniform(-0.5, 0.5)
+            yawFlight = 0.0 if line % 2 == 0 else 180.0
+            if tifEvery > 0 and k % tifEvery == tifEvery - 1:
+                data = make_tiff(t, lat, lon, GROUND_ELEV + relAlt, yawFlight, yawFlight, relAlt, "RM01-1829172-SC",
+                                 headerBytes, ">" if k % 2 else "<")
+                fn = "IMG_%0*d.TIF" % (digits, k)
+            else:
+                data = make_jpeg(t, lat, lon, GROUND_ELEV + relAlt, yawFlight + rnd.uniform(-3, 3), yawFlight,
+                                 relAlt, "0K8TD8A0010127", headerBytes)
+                fn = "DJI_%0*d.JPG" % (digits, k)
+            with open(os.path.join(fnOutDir, fn), "wb") as f:
+                f.write(data)
+            totalBytes = totalBytes + len(data)
+            t = t + timedelta(seconds=interval)
+            k = k + 1
+        t = t + timedelta(minutes=gapMins)
+    return k, totalBytes
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Make a folder of synthetic UAV images")
+    parser.add_argument("dir", help="folder to write the images to")
+    parser.add_argument("--images", type=int, default=1000, help="number of images (default 1000)")
+    parser.add_argument("--flights", type=int, default=5, help="number of flights (default 5)")
+    parser.add_argument("--interval", type=int, default=2, help="seconds between images (default 2)")
+    parser.add_argument("--gapMins", type=int, default=15, help="minutes between flights (default 15)")
+    parser.add_argument("--tifEvery", type=int, default=5, help="every n-th image is a TIFF, 0 for none (default 5)")
+    parser.add_argument("--headerKB", type=float, default=32, help="size of the image headers in KB (default 32)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args(argv[1:])
+    t0 = time.time()
+    numFiles, totalBytes = make_images(args.dir, args.images, args.flights, args.interval, args.gapMins, args.tifEvery,
+                                       args.headerKB, args.seed)
+    print("Wrote " + str(numFiles) + " images (%.1f MB) to " % (totalBytes / 1e6) + args.dir + " in %.1f seconds" % (time.time() - t0))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
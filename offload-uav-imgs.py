@@ -0,0 +1,280 @@
+## Offload UAV Images from several cards at once, sorting them into flights
+## (c) Andy Lyons, 2017
+
+## Reads the image headers straight from one or more cards (or any other
+## folders), with a thread for each card so slow cards are read at the same time
+## (images that can't be read in-process are then read with exiftool, in one
+## pool for all the cards), splits the images of all the cards together into flights, and copies each
+## image once, directly into its flight subdirectory in the destination folder.
+## There's no need to copy the cards to disk first and then move or copy
+## everything again.
+
+## Usage:
+## python offload-uav-imgs.py "D:\Drone Projects\2017-08-18" E:\ F:\
+## python offload-uav-imgs.py --config settings.ini "D:\Drone Projects\2017-08-18" E:\ F:\
+
+## The settings are read from a config file like the one used by
+## batch-uav-imgs.py (press 'w' in the menu of parse-uav-imgs.py to save one).
+## Images are always copied into flight subdirectories (m2s_YN and m2s_MoveCopy
+## are ignored). Images are found in every subfolder of each card (e.g.
+## DCIM/100MEDIA). If two images would end up with the same name in a flight
+## subdirectory (e.g. DJI_0001.JPG from two drones), or the name is already
+## taken there, the second one gets a suffix (DJI_0001_2.JPG). Images that are
+## already in the destination (e.g. when a card is offloaded a second time) are
+## skipped.
+
+## The copies are interleaved across the cards, with offloadWorkersPerCard copies
+## from each card at a time (default 1, which suits SD cards); each card has its
+## own threads, so a slow card doesn't hold up the others. They're journaled like
+## any other copy, so an interrupted offload is resumed by running the same
+## command again (the rest of the offload, including the export, then goes on
+## as usual, skipping the images that are already there).
+
+import os, sys, time, argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import exif_reader, exif_cache, img_records, place_files, uav_pipeline
+
+## Number of copies from each card at a time (can be set in an [offload] section)
+OFFLOAD_DEFAULTS = [
+    ("offloadWorkersPerCard", 1),
+]
+OFFLOAD_SECTION = "offload"
+
+def log(msg, color=None):
+    print(msg)
+    sys.stdout.flush()
+
+## Read the offload settings from the config file
+def offload_settings(config):
+    settings = dict(OFFLOAD_DEFAULTS)
+    if config is not None and config.has_section(OFFLOAD_SECTION):
+        for name, text in config.items(OFFLOAD_SECTION):
+            if name not in settings:
+                raise ValueError("unknown setting in [" + OFFLOAD_SECTION + "]: " + name)
+            settings[name] = uav_pipeline.parse_option(text, settings[name])
+    return settings
+
+## The images on a card, in all its subfolders (hidden folders are skipped)
+def list_source_images(fnSource):
+    fns = []
+    for dirpath, dirnames, filenames in os.walk(fnSource):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for fn in sorted(filenames):
+            if fn.lower().endswith(exif_reader.IMG_EXTS) and not fn.startswith("."):
+                fns.append(os.path.join(dirpath, fn))
+    return fns
+
+## Read the headers of the images on a card in-process (this runs in the card's
+## own thread). Returns the rows, and the images that need exiftool.
+def read_source(fnSource, tagsAll):
+    fns = list_source_images(fnSource)
+    log("Reading " + str(len(fns)) + " image(s) on " + fnSource)
+    rows = []
+    fnsExiftool = []
+    for row, fn in exif_reader.iter_files(fns, tagsAll, uav_pipeline.required_flds):
+        if row is None:
+            fnsExiftool.append(fn)
+        else:
+            rows.append(row)
+    return rows, fnsExiftool
+
+## Read the headers of the images on all the cards: in-process with a thread for
+## each card, then with exiftool (one pool shared by all the cards) for any that
+## couldn't be read. Returns a list with, for each card, a list of (values, row)
+## for each image (see uav_pipeline.parse_row) and the number of images left out.
+def read_sources(fnSources, tagsAll, opt):
+    with ThreadPoolExecutor(max_workers=len(fnSources)) as executor:
+        sourceRows = list(executor.map(lambda fnSource: read_source(fnSource, tagsAll), fnSources))
+    ## The card of each image that needs exiftool (by full path, as exiftool may
+    ## give the path in another form)
+    cardOf = {}
+    for k, (rows, fnsExiftool) in enumerate(sourceRows):
+        cardOf.update((os.path.normcase(os.path.abspath(fn)), k) for fn in fnsExiftool)
+    results = [([], 0) for fnSource in fnSources]
+    def add(k, row):
+        imgs, numExcluded = results[k]
+        try:
+            imgs.append((uav_pipeline.parse_row(row, opt.add_yaw), row))
+        except ValueError as e:
+            results[k] = (imgs, numExcluded + 1)
+            log(row['SourceFile'] + " will be excluded. Invalid EXIF tag(s): " + str(e))
+    for k, (rows, fnsExiftool) in enumerate(sourceRows):
+        for row in rows:
+            add(k, row)
+    if len(cardOf) > 0:
+        for row, fn in uav_pipeline.iter_headers(sorted(cardOf), tagsAll, None, opt.exiftool_workers, log):
+            if row is None:
+                k = cardOf[os.path.normcase(os.path.abspath(fn))]
+                results[k] = (results[k][0], results[k][1] + 1)
+            else:
+                add(cardOf[os.path.normcase(os.path.abspath(row["SourceFile"]))], row)
+    return results
+
+## True if a file in the destination is a copy of the image in row: the same
+## size, and the same time and location (from the header cache of the
+## destination, or read from the file if it isn't there, e.g. after a resumed copy)
+def same_image(fnDst, row, destCache):
+    if os.path.getsize(fnDst) != os.path.getsize(row["SourceFile"]):
+        return False
+    tags = uav_pipeline.required_flds
+    dstRows = [dstRow for dstRow, fn in uav_pipeline.iter_headers([fnDst], tags, destCache, 1, lambda msg, color=None: None) if dstRow is not None]
+    return len(dstRows) == 1 and all(dstRows[0][tag] == row[tag] for tag in tags)
+
+## A name for an image in a folder that isn't already taken (by a file that's
+## there, or one of the names in used), adding _2, _3, ... to the name if needed.
+## Returns the name, and True if the image was already copied there (e.g. the
+## card was offloaded before).
+def unique_name(dirname, fn, row, used, destCache):
+    stem, ext = os.path.splitext(fn)
+    name = fn
+    k = 1
+    while True:
+        key = os.path.normcase(os.path.join(dirname, name)).lower()
+        if key not in used:
+            if not os.path.exists(os.path.join(dirname, name)):
+                used.add(key)
+                return name, False
+            if same_image(os.path.join(dirname, name), row, destCache):
+                used.add(key)
+                return name, True
+        k = k + 1
+        name = stem + "_" + str(k) + ext
+
+## Interleave lists (one per card), taking one item from each in turn
+def round_robin(lists):
+    out = []
+    for k in range(max([len(x) for x in lists] + [0])):
+        out.extend(x[k] for x in lists if k < len(x))
+    return out
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Copy the images on one or more cards into flight subdirectories")
+    parser.add_argument("dest", help="destination folder")
+    parser.add_argument("sources", nargs="+", help="cards or folders to copy the images from")
+    parser.add_argument("--config", help="config file with the settings (see batch-uav-imgs.py)")
+    args = parser.parse_args(argv[1:])
+    fnDest = args.dest.strip('\'"')
+    fnSources = []
+    for fnSource in args.sources:
+        fnSource = fnSource.strip('\'"')
+        if not os.path.isdir(fnSource):
+            print(fnSource + " is not a directory.")
+            return 1
+        if os.path.abspath(fnSource) not in [os.path.abspath(fn) for fn in fnSources]:
+            fnSources.append(fnSource)
+
+    opt = uav_pipeline.Options()
+    try:
+        config = uav_pipeline.read_config(args.config, opt) if args.config else None
+        settings = offload_settings(config)
+    except ValueError as e:
+        print("Error reading the config file: " + str(e))
+        return 1
+    opt.m2s_YN = True
+    opt.m2s_MoveCopy = "copy"
+    if not os.path.isdir(fnDest):
+        os.makedirs(fnDest)
+
+    ## Finish an offload that was interrupted the last time. The rest of the
+    ## offload then goes on as usual: the images that were copied are found in
+    ## the destination and skipped, and the layers are exported.
+    if uav_pipeline.unfinished_placement(fnDest) is not None:
+        log("Resuming an unfinished offload into " + fnDest)
+        for fnSrc, fnDst, e in uav_pipeline.resume_placement(fnDest, opt):
+            log("Error copying " + fnSrc + ": " + str(e))
+
+    ## READ THE HEADERS, a thread for each card
+    t0 = time.time()
+    tagsAll = uav_pipeline.tag_list(opt.add_yaw)
+    sourceResults = read_sources(fnSources, tagsAll, opt)
+    for fnSource, (srcImgs, numExcluded) in zip(fnSources, sourceResults):
+        log(fnSource + ": " + str(len(srcImgs)) + " image(s)" + (", " + str(numExcluded) + " left out" if numExcluded > 0 else ""))
+
+    ## Put the images of all the cards in time order (stable, so images taken in
+    ## the same second stay in card order)
+    allImgs = []
+    for k, (srcImgs, numExcluded) in enumerate(sourceResults):
+        allImgs.extend((values, row, k) for values, row in srcImgs)
+    if len(allImgs) == 0:
+        log("No images found")
+        return 1
+    allImgs.sort(key=lambda item: item[0][1])
+    imgs = img_records.ImageRecords()
+    for values, row, k in allImgs:
+        imgs.append(*values)
+    imgs.finish()
+
+    ## MAKE THE FLIGHTS (all the cards together)
+    si = uav_pipeline.StreamInfo(imgs, opt.m2s_StreamKey)
+    flights = uav_pipeline.group_flights(imgs, opt, si)
+    log(str(len(imgs)) + " images in " + str(len(flights)) + " flight subdirectories:")
+    for flight_info in flights:
+        log("   - " + flight_info[1] + " (" + str(len(flight_info[0])) + ")")
+
+    ## The name of each image in its flight subdirectory, with a suffix if it's taken
+    destCache = exif_cache.ExifCache(fnDest) if opt.exif_cache_YN else None
+    destNames = imgs.fns()
+    copiedBefore = np.zeros(len(imgs), dtype=bool)
+    used = set()
+    for flight_info in flights:
+        fnSubDirFullPath = os.path.join(fnDest, flight_info[1])
+        for j in flight_info[0]:
+            destNames[j], copiedBefore[j] = unique_name(fnSubDirFullPath, destNames[j], allImgs[j][1], used, destCache)
+    if copiedBefore.any():
+        log(str(int(copiedBefore.sum())) + " image(s) were already copied to " + fnDest + " and will be skipped")
+    numRenamed = sum(1 for j in range(len(imgs)) if destNames[j] != imgs.fn(j) and not copiedBefore[j])
+    if numRenamed > 0:
+        log(str(numRenamed) + " image(s) have the same name as another image in their flight subdirectory and will get a suffix")
+    if any(destNames[j] != imgs.fn(j) for j in range(len(imgs))):
+        imgs = img_records.ImageRecords()
+        for j, (values, row, k) in enumerate(allImgs):
+            imgs.append(destNames[j], *values[1:])
+        imgs.finish()
+
+    ## FIND RE-FLOWN IMAGES (see uav_pipeline.find_reflown)
+    dupOfFns = None
+    if opt.m2s_DupDetectYN:
+        dupOfFns, numDups = uav_pipeline.find_reflown(fnDest, imgs, flights, opt, si, log)
+
+    ## COPY THE IMAGES, straight from the cards into their flight subdirectories
+    ## (interleaved across the cards, so they're all read at once)
+    placements = [[] for fnSource in fnSources]
+    for flight_info in flights:
+        for j in flight_info[0][~copiedBefore[flight_info[0]]]:
+            placements[allImgs[j][2]].append((allImgs[j][1]["SourceFile"], os.path.join(fnDest, flight_info[1], destNames[j])))
+    cards = round_robin([[k] * len(cardPlacements) for k, cardPlacements in enumerate(placements)])
+    placements = round_robin(placements)
+    rows = dict((row["SourceFile"], row) for values, row, k in allImgs)
+
+    ## Save the header info of each copy in the header cache of the destination
+    ## folder, so running parse-uav-imgs.py on it later doesn't read them again
+    if opt.exif_cache_YN:
+        def placed(fnSrc, fnDst):
+            destCache.put(fnDst, dict((tag, v) for tag, v in rows[fnSrc].items() if tag not in ("SourceFile", "FileName")))
+    else:
+        placed = None
+    manifests = place_files.Manifests(opt.m2s_HashType) if opt.m2s_VerifyCopyYN else None
+    journal = place_files.Journal(os.path.join(fnDest, place_files.fnJournal))
+    log("Copying " + str(len(placements)) + " files...")
+    try:
+        errors = place_files.place_files(placements, "copy", max(1, settings["offloadWorkersPerCard"]), opt.m2s_FsyncPolicy,
+                                         placed, journal=journal, manifests=manifests, groups=cards)
+    finally:
+        if opt.exif_cache_YN:
+            destCache.close()
+    for fnSrc, fnDst, e in errors:
+        log("Error copying " + fnSrc + ": " + str(e))
+
+    ## EXPORT (see uav_pipeline.py)
+    if opt.shpCreateYN:
+        uav_pipeline.project_images(imgs, opt, log)
+        coverageResult = uav_pipeline.coverage_analysis(fnDest, imgs, flights, opt, log) if opt.coverageYN else None
+        for fnShp in uav_pipeline.export_layers(fnDest, imgs, flights, opt, dupOfFns, coverageResult):
+            log("Created " + fnShp)
+
+    log("Offloaded " + str(len(placements) - len(errors)) + " image(s) from " + str(len(fnSources)) + " card(s) in " + place_files.fmt_secs(time.time() - t0))
+    return 0 if len(errors) == 0 else 2
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -23,18 +23,46 @@ add_yaw = True
 
 ## Set default options
 fnCSV = "exif_info.csv"
+csvCreateYN = False    # save the header info of all images to fnCSV in the input directory
+exiftool_workers = 0    # number of exiftool processes, 0 = one per core
+exif_cache_YN = True    # save header info in exif_cache.sqlite so unchanged images aren't read again
 m2s_YN = False
 m2s_ThreshUnits = "multiple of median sampling interval"    # or 'seconds'
 m2s_ThreshVal = 10
 m2s_Preview = True
 m2s_MoveCopy = "move"
-m2s_DivideTifJpgYN = False
+m2s_NumWorkers = 8    # number of threads used to move or copy files
+m2s_FsyncPolicy = "none"    # 'none' (leave it to the OS), 'file' (fsync each file), or 'end' (fsync everything at the end)
+m2s_VerifyCopyYN = False    # checksum copies as they're made, verify them, and save a manifest in each flight subdirectory
+m2s_HashType = "blake2b"    # or 'xxh128' if the xxhash module is installed
+m2s_DivideTifJpgYN = False    # separate JPGs and TIFs into subdirectories (or each stream, if m2s_StreamKey isn't 'none')
+m2s_StreamKey = "none"    # split the images into streams (e.g. cameras) before looking for gaps: 'none', 'ext', 'model' (make and model), 'serial', or 'model+serial'
+m2s_DupDetectYN = False    # find images of the same spot taken in different flights (e.g. lines flown again after a battery swap)
+m2s_DupDistance = 2.0    # images within this many meters...
+m2s_DupYawTol = 20    # ...and this many degrees of heading of an image from an earlier flight are marked as duplicates
+dup_file_suffix = "_reflown.csv"
 m2s_SubDirJPG = "rgb"
 m2s_SubDirTIF = "mss"
 shpCreateYN = False
 m2s_FirstFlightNum = 1
 m2s_SubdirTemplate = "Flt{FltNum}_{StartTime}_{EndTime}"
 shape_file_suffix = "_pts.shp"
+shpWriter = "python"    # 'python' (built-in shapefile writer, no dependencies) or 'ogr' (use GDAL/OGR)
+exportFormat = "shp"    # 'shp' (a shapefile for each flight) or 'gpkg' (all flights in one GeoPackage, with a spatial index)
+gpkg_file_suffix = "_imgs.gpkg"
+flightLinesYN = False    # also export the flight line of each flight (image centers in timestamp order)
+flightLineTolerance = 1.0    # simplify the flight lines, dropping vertices within this many meters of the line (0 = keep every image)
+lines_file_suffix = "_flight_lines.shp"
+flightHullsYN = False    # also export the minimum convex polygon of each flight, with its area
+hulls_file_suffix = "_flight_hulls.shp"
+projEPSG = 0    # project the exports: 0 = no (WGS84 long/lat), 'utm' = the UTM zone of the images, or an EPSG code
+coverageYN = False    # estimate the image footprints, and export a grid of how many images cover each spot and polygons of the gaps
+coverageMinImages = 5    # parts of a flight's hull covered by fewer images than this are exported as gaps
+coverageCellSize = 0    # cell size of the coverage grid in meters, 0 = automatic
+groundElevation = None    # ground elevation (m above sea level), for images with GPSAltitude but no RelativeAltitude
+cameraSensorWidth = 0    # sensor width (mm), for images with FocalLength but no FocalLengthIn35mmFormat
+coverage_file_suffix = "_coverage.asc"
+gaps_file_suffix = "_coverage_gaps.shp"
 
 #Camera type no longer needed. The GoPro, X5, and Seq all share a set of tags
 #camera_type = "GoPro"
@@ -44,12 +72,9 @@ shape_file_suffix = "_pts.shp"
 
 ## Import modules
 import os, sys
-from subprocess import call
-from datetime import datetime
-from operator import itemgetter
-from shutil import copyfile
 import imp
 from distutils import spawn
+import place_files
 
 ## Make sure a directory was passed
 if len(sys.argv)==1:
@@ -57,15 +82,15 @@ if len(sys.argv)==1:
     os.system("pause")
     quit()
 
-## Make sure exiftool is available
-if spawn.find_executable("exiftool") is None:
-    print("This script requires exiftool.exe to be somewhere on the system path")
+## Check if exiftool is available (it's only needed for images the built-in reader can't parse)
+exiftoolYN = spawn.find_executable("exiftool") is not None
+if not exiftoolYN:
+    print("exiftool was not found. Images whose headers can't be read directly will be skipped.")
+    print("To install exiftool:")
     print("  a. Download it from http://www.sno.phy.queensu.ca/~phil/exiftool/")
     print("  b. Install")
     print("  c. Rename 'exiftool(-k).exe' to 'exiftool.exe'")
-    print("  d. Move 'exiftool.exe' to a directory on the system PATH (like c:\windows)")
-    os.system("pause")
-    quit()
+    print("  d. Move 'exiftool.exe' to a directory on the system PATH (like c:\windows)\n")
 
 try:
     imp.find_module('colorama')
@@ -79,6 +104,17 @@ except ImportError:
     os.system("pause")
     quit()
 
+try:
+    imp.find_module('numpy')
+except ImportError:
+    print("A required Python module numpy was not found.")
+    print("To install try:")
+    print("cd C:\\Program Files (x86)\\Python36-32\\Scripts")
+    print("pip.exe install numpy")
+    os.system("pause")
+    quit()
+
+import flight_groups, projection, uav_pipeline
 from colorama import init, Fore, Back, Style
 init()
 #Fore: BLACK, RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN, WHITE, RESET
@@ -94,27 +130,6 @@ def coltxt(strTxt, strCol="cyan", brightYN=True):
         print("color not found: " + strCol + Style.RESET_ALL)
         return ""
 
-try:
-    imp.find_module('osgeo')
-    gdalYN = True
-    import osgeo.ogr as ogr
-    import osgeo.osr as osr
-except ImportError:
-    gdalYN = False
-    print("python gdal module not found. Shapefile export will be disabled\n")
-
-## Create a custom function we'll need later
-def median(lst, omit_zeros=True):
-    if omit_zeros:
-        lst = [elem for elem in lst if elem != 0]
-    n = len(lst)
-    if n < 1:
-        return None
-    if n % 2 == 1:
-        return sorted(lst)[n//2]
-    else:
-        return sum(sorted(lst)[n//2-1:n//2+1])/2.0
-
 ## The first (and only) argument should be a path
 fnInputDir = sys.argv[1]
 fnInputDir = fnInputDir.strip('\'"')    # get rid of single and double quotes
@@ -127,208 +142,133 @@ if not os.path.isdir(fnInputDir):
     os.system("pause")
     quit()
 
-## Define tags in the image header (these work with all cameras tested so far)
-tagDateTimeOrig = "DateTimeOriginal"
-tagLat = "GPSLatitude"
-tagLong = "GPSLongitude"
-if add_yaw:
-    tagYawFlight = "FlightYawDegree"
-    tagYawGimbal = "GimbalYawDegree"
-    tagYawSep = " -"
-else:
-    tagYawFlight = ""
-    tagYawGimbal = ""
-    tagYawSep = ""
-tagsAllForCmd = "-" + tagDateTimeOrig + " -" + tagLat + " -" + tagLong + tagYawSep + tagYawFlight + tagYawSep + tagYawGimbal
-
-#tagsAllForCmd = tagsAllForCmd + " -filesize"
-
-## Not used (not needed for the cameras that have been tested)
-#if camera_type == "GoPro" or camera_type == "X5":
-#    tagDateTimeOrig = "DateTimeOriginal"
-#    tagLat = "GPSLatitude"
-#    tagLong = "GPSLongitude"
-#    tagsAllForCmd = "-" + tagDateTimeOrig + " -" + tagLat + " -" + tagLong
-#else:
-#    print("Unknown camera type")
-#    os.system("pause")
-#    quit()
-
-## Notes
-## -filename is kind of redundant, the -n switch adds the filename and path
-## GoPro Hero4 also has -GPSDateStamp -GPSTimeStamp (UTC time)
-
-print("Running exiftool on images in " + fnInputDir + "...")
-fnCSV = os.path.join(fnInputDir, fnCSV)
-#strCmd = "exiftool -filename -gpsdatestamp -gpstimestamp -gpslatitude -gpslongitude -n -csv " + fnInputDir + " > " + fnCSV
-#If useful could add -filesize# and other tags (like image size), Z value
-strCmd = "exiftool -if \"$filesize# > 0\" -filename " + tagsAllForCmd + " -n -csv \"" + fnInputDir + "\" > \"" + fnCSV + "\""
-
-created_csv = call(strCmd, shell=True)
-if created_csv != 0:
-    print("Error extracting EXIF info (" + str(created_csv) + ")")
+## Print a message from uav_pipeline, in color if it's an error
+def log(msg, color=None):
+    print(coltxt(msg, color) if color else msg)
+
+## If a previous move or copy was interrupted, offer to finish it
+jrnUnfinished = uav_pipeline.unfinished_placement(fnInputDir)
+if jrnUnfinished is not None:
+    jrnMode, jrnNumJobs, jrnNumDone = jrnUnfinished
+    print(coltxt("An unfinished " + str(jrnMode) + " of " + str(jrnNumJobs) + " files was found (" + str(jrnNumDone) + " already done)", "y"))
+    resumeYN = input("Resume it [y/n]? ")
+    if resumeYN.lower() == "y":
+        for fnSrc, fnDest, e in uav_pipeline.resume_placement(fnInputDir, uav_pipeline.Options(globals())):
+            print(coltxt("Error placing " + fnSrc + ": " + str(e), "r"))
+        print(Style.BRIGHT + Fore.YELLOW + "Done" + Style.RESET_ALL)
+        os.system("pause")
+        quit()
+    else:
+        os.remove(os.path.join(fnInputDir, place_files.fnJournal))
+
+## Read the header info of every image, validating each row as it comes in (the
+## tags are defined in uav_pipeline.py)
+print("Reading image headers in " + fnInputDir + "...")
+try:
+    imgs, tagsMissing, fnsExcluded = uav_pipeline.read_images(fnInputDir, uav_pipeline.Options(globals()), log)
+except IOError as e:
+    print("Error extracting EXIF info (" + str(e) + ")")
     os.system("pause")
     quit()
 
-### Use a dictionary reader on the csv file so we can access columns by field name
-import csv
-#csvReader = csv.DictReader(open(fnCSV, "rb"), delimiter=',')
-csvReader = csv.DictReader(open(fnCSV), delimiter=',')
-
 ### Check that all the field names are present
-required_flds = [tagDateTimeOrig, tagLong, tagLat]
-for fld in required_flds:
-    if not fld in csvReader.fieldnames:
-        print("Required tag not found: " + fld)
-        print("Make sure all the images in this folder have a DateTimeOriginal and geostamp tags")
-        os.system("pause")
-        quit()
-
-### Input CSV data into a list of tuples
-file_dt = []
-for row in csvReader:
-    # SourceFile, FileName, DateTimeOriginal, GPSLatitude, GPSLongitude
-    allOK = True
-    badTags = ""
-
-    try:
-        dtobj = datetime.strptime(row[tagDateTimeOrig], '%Y:%m:%d %H:%M:%S')
-    except ValueError:
-        badTags = badTags + tagDateTimeOrig + ", "
-        allOK = False
-
-    try:
-        x = float(row[tagLong])
-    except ValueError:
-        badTags = badTags + tagLong + ", " 
-        allOK = False
-
-    try:
-        x = float(row[tagLat])
-    except ValueError:
-        badTags = badTags + tagLat + ", " 
-        allOK = False
-
-    if allOK:
-        if add_yaw:
-            file_dt.append((row['FileName'], dtobj, row[tagLong], row[tagLat], row[tagYawFlight], row[tagYawGimbal]))    #add a tuple
-        else:
-            file_dt.append((row['FileName'], dtobj, row[tagLong], row[tagLat]))    #add a tuple
-    else:
-        print(Style.BRIGHT + Fore.RED + row['FileName'] + " will be excluded. Invalid EXIF tag(s): " + badTags[0:-2] + Style.RESET_ALL)
-
-## Remember index locations within the tuple for later
-IDX_FN = 0
-IDX_DTOBJ = 1
-IDX_LONG = 2
-IDX_LAT = 3
-IDX_YAW_FLIGHT = 4
-IDX_YAW_GIMBAL = 5
-
-## Sort file_dt based on datetime
-file_dt.sort(key=itemgetter(IDX_DTOBJ))
-
-## Compute the time interval between images
-timezero = file_dt[0][1]
-timediffs = [0]
-for fdt in file_dt[1:]:
-    this_offset = fdt[1] - timezero
-    timediffs.append(this_offset.total_seconds())
-    timezero = fdt[1]
-#print("Time intervals (seconds): " + str(timediffs))
+for fld in tagsMissing:
+    print("Required tag not found: " + fld)
+    print("Make sure all the images in this folder have a DateTimeOriginal and geostamp tags")
+    os.system("pause")
+    quit()
 
 ShowMenuYN = True
+ComputeStreamsYN = True   ## split the images into streams first time through (and when the key changes)
 ComputeFlightGroupsYN = True   ## compute flight groups first time through (at least)
 
 while ShowMenuYN:
+    if ComputeStreamsYN:
+        ## Split the images into streams (one for all the images if m2s_StreamKey is 'none'), and
+        ## get the sampling intervals of the one with the most images (see uav_pipeline.StreamInfo)
+        si = uav_pipeline.StreamInfo(imgs, m2s_StreamKey)
+        ComputeStreamsYN = False
+
     if ComputeFlightGroupsYN:
         ## MAKE THE GROUPS
+        ## flights is a list containing lists with two elements: i) an array of indices from imgs, and ii) constructed subdir name
+        opt = uav_pipeline.Options(globals())
+        flights = uav_pipeline.group_flights(imgs, opt, si)
         if m2s_YN:
-            ## Compute the absolute time threshhold (gap) in seconds
-            if m2s_ThreshUnits == "multiple of median sampling interval":
-                thresh_abs = m2s_ThreshVal * median(timediffs)
-            else:
-                thresh_abs = m2s_ThreshVal
-
-            ## OLD: flights is a list containing the first and last index from file_dt, plus a constructed subdir name
-            ## flights is a list containing lists with two elements: i) a list of indices from file_dt, and ii) constructed subdir name
-            flights = []
-            start_idx = 0
-            cur_flight_num = 0
-            for i in range(len(file_dt)):
-                if i == (len(file_dt)-1) or timediffs[i] >= thresh_abs:
-                    ## Add a flight - either the last one, or the one that just ended
-                    end_idx = i-1 if timediffs[i] >= thresh_abs else i
-                    subdir = m2s_SubdirTemplate                    
-                    ## subdir = subdir.replace("{FltNum}", "%02d" % (len(flights) + m2s_FirstFlightNum))
-                    subdir = subdir.replace("{FltNum}", "%02d" % (cur_flight_num + m2s_FirstFlightNum))
-                    subdir = subdir.replace("{StartTime}", file_dt[start_idx][IDX_DTOBJ].strftime('%H%M'))
-                    subdir = subdir.replace("{EndTime}", file_dt[end_idx][IDX_DTOBJ].strftime('%H%M'))
-                    subdir = subdir.replace("{Date}", file_dt[end_idx][IDX_DTOBJ].strftime('%Y%m%d'))
-
-                    if m2s_DivideTifJpgYN:
-                        tif_idx = []
-                        for j in range(start_idx, end_idx + 1):
-                            if file_dt[j][0].lower().endswith(".tif"):
-                                tif_idx.append(j)
-                        if len(tif_idx) > 0:
-                            flights.append([tif_idx, os.path.join(subdir, m2s_SubDirTIF)])
-                        jpg_idx = []
-                        for j in range(start_idx, end_idx + 1):
-                            if file_dt[j][0].lower().endswith(".jpg"):
-                                jpg_idx.append(j)
-                        if len(jpg_idx) > 0:
-                            flights.append([jpg_idx, os.path.join(subdir, m2s_SubDirJPG)])
-                    else:
-                        flights.append([range(start_idx, end_idx + 1), subdir])
-                    cur_flight_num = cur_flight_num + 1
-                    start_idx = i
-
-                #elif timediffs[i] >= thresh_abs:
-                    ## Start a new flight
-                    #subdir = m2s_SubdirTemplate                    
-                    #subdir = subdir.replace("{FltNum}", "%02d" % (len(flights) + m2s_FirstFlightNum))
-                    #subdir = subdir.replace("{StartTime}", file_dt[start_idx][IDX_DTOBJ].strftime('%H%M'))
-                    #subdir = subdir.replace("{EndTime}", file_dt[i-1][IDX_DTOBJ].strftime('%H%M'))
-                    #subdir = subdir.replace("{Date}", file_dt[i][IDX_DTOBJ].strftime('%Y%m%d'))
-                    #flights.append([start_idx, i-1, subdir])
-                    #flights.append([range(start_idx, i), subdir])
-                    #start_idx = i
-
-        else:
-            # Just one 'flight'
-            #flights = [[0, len(file_dt)-1, "all"]]
-            flights = [[range(len(file_dt)), "all"]]
+            ## The absolute time threshhold (gap) in seconds
+            thresh_abs = uav_pipeline.thresholds(opt, si)[0]
         ComputeFlightGroupsYN = False
 
     ## Display menu
     print("\n---------------------------------------------")
     print("Input directory: " + coltxt(fnInputDir,"g"))
-    print("Num images found: " + coltxt(str(len(file_dt)),"g"))
-    print("Min, Median, and Max sampling interval (seconds): " + coltxt(str(min(timediffs[1:])) + ", " + str(median(timediffs)) + ", " + str(max(timediffs[1:])),"g"))
+    print("Num images found: " + coltxt(str(len(imgs)),"g"))
+    print("Min, Median, and Max sampling interval (seconds" + ("" if m2s_StreamKey == "none" else ", " + si.names[si.primary]) + "): " +
+          coltxt(str(float(si.timediffs[1:].min())) + ", " + str(si.median_interval) + ", " + str(float(si.timediffs[1:].max())),"g"))
     print("      -------------")
     print("Move files into sub-" + coltxt("D","c") + "irectories by flight: " + coltxt(str(m2s_YN),"g"))
     if m2s_YN:
         print("Flight Parsing Options:")
+        print("  Split into str" + coltxt("E","c") + "ams (cameras) by: " + coltxt(m2s_StreamKey,"g"))
+        if m2s_StreamKey != "none":
+            streamCounts = si.counts()
+            for i in range(len(si.names)):
+                print("   - " + coltxt(si.names[i],"g") + " (" + str(streamCounts[i]) + " images, median interval " + str(si.medians[i]) + " seconds)")
         print("  Threshhold " + coltxt("U","c") + "nits: " + coltxt(m2s_ThreshUnits,"g"))
         print("  Threshhold " + coltxt("V","c") + "al: " + coltxt(str(m2s_ThreshVal),"g"))
         print("    --> will create a new flight every time a gap is found of at least " + str(thresh_abs) + " seconds")
+        ## Number of flights for a range of thresholds, without regrouping
+        if m2s_ThreshUnits == "multiple of median sampling interval":
+            threshUnit = si.median_interval
+            sweepLabels = [str(m) + "x" for m in flight_groups.SWEEP_MULTIPLES]
+        else:
+            threshUnit = 1
+            sweepLabels = [str(int(round(m * si.median_interval))) + "s" for m in flight_groups.SWEEP_MULTIPLES]
+        sweepFlights = flight_groups.num_flights(si.sorted_gaps, [m * si.median_interval for m in flight_groups.SWEEP_MULTIPLES])
+        print("    Threshhold -> number of flights: " + " | ".join(lbl + ": " + str(n) for lbl, n in zip(sweepLabels, sweepFlights.tolist())))
+        if si.knee is not None:
+            ## A round number within the jump if there is one
+            suggestedVal = int(round(si.knee[0] / threshUnit))
+            if not si.knee[1] < suggestedVal * threshUnit <= si.knee[2]:
+                suggestedVal = round(si.knee[0] / threshUnit, 2)
+            print("    Suggested threshhold: " + coltxt(str(suggestedVal), "g") + " (" + str(int(flight_groups.num_flights(si.sorted_gaps, suggestedVal * threshUnit))) +
+                  " flights, gaps jump from " + str(int(si.knee[1])) + " to " + str(int(si.knee[2])) + " seconds), " + coltxt("A", "c") + "pply it")
         print("  Subdirectory name " + coltxt("T","c") + "emplate: " + m2s_SubdirTemplate)
         print("  " + coltxt("F","c") + "irst flight number: " + coltxt(str(m2s_FirstFlightNum),"g"))
-        print("  Se" + coltxt("P","c") + "arate JPGs and TIFs: " + coltxt(str(m2s_DivideTifJpgYN),"g"))
+        print("  Se" + coltxt("P","c") + "arate " + ("JPGs and TIFs" if m2s_StreamKey == "none" else "streams") + " into subdirectories: " + coltxt(str(m2s_DivideTifJpgYN),"g"))
         print("  Flight directory(s):")
         for i in range(len(flights)):
             print("   - " + coltxt(flights[i][1],"g") + " (" + str(len(flights[i][0])) + ")")
         print("  " + coltxt("M","c") + "ove or " + coltxt("C","c") + "opy: " + coltxt(m2s_MoveCopy,"g"))
+        if m2s_MoveCopy == "copy":
+            print("  Verify copies with chec" + coltxt("K","c") + "sums: " + coltxt(str(m2s_VerifyCopyYN),"g"))
+        print("  Find " + coltxt("R","c") + "e-flown images (within " + str(m2s_DupDistance) + " m and " + str(m2s_DupYawTol) + " degrees): " + coltxt(str(m2s_DupDetectYN),"g"))
     print("Create point " + coltxt("S","c") + "hapefiles: " + coltxt(str(shpCreateYN),"g"))
+    if shpCreateYN:
+        print("  Output f" + coltxt("O","c") + "rmat: " + coltxt(exportFormat,"g"))
+        print("  Flight " + coltxt("L","c") + "ines: " + coltxt(str(flightLinesYN),"g"))
+        print("  Minimum convex polygons (" + coltxt("H","c") + "ulls): " + coltxt(str(flightHullsYN),"g"))
+        if str(projEPSG).lower() == "utm":
+            strProj = "UTM zone of the images (EPSG:" + str(projection.utm_epsg(imgs.lon, imgs.lat)) + ")"
+        elif projEPSG:
+            strProj = "EPSG:" + str(projEPSG)
+        else:
+            strProj = "none (WGS84 long/lat)"
+        print("  Pro" + coltxt("J","c") + "ection: " + coltxt(strProj,"g"))
+        print("  Covera" + coltxt("G","c") + "e and gaps (fewer than " + str(coverageMinImages) + " images): " + coltxt(str(coverageYN),"g"))
+    print(coltxt("W","c") + "rite these settings to a config file for batch-uav-imgs.py")
 
-    strPrompt = "Continue [y/n or d/u/v/f/m/c/p/s]? " if m2s_YN else "Continue [y/n or d/s]? "
+    strPrompt = "Continue [y/n or d/e/u/v/a/f/m/c/p/r/s" + ("/k" if m2s_MoveCopy == "copy" else "") + ("/o/l/h/j/g" if shpCreateYN else "") + "/w]? " if m2s_YN else "Continue [y/n or d/s" + ("/o/l/h/j/g" if shpCreateYN else "") + "/w]? "
     contYN = input(strPrompt)
     if contYN.lower() == "y": 
         ShowMenuYN = False
     elif contYN.lower() == "d":
         m2s_YN = not m2s_YN
         ComputeFlightGroupsYN = True
+    elif contYN.lower() == "e":
+        m2s_StreamKey = flight_groups.STREAM_KEYS[(flight_groups.STREAM_KEYS.index(m2s_StreamKey) + 1) % len(flight_groups.STREAM_KEYS)]
+        ComputeStreamsYN = True
+        ComputeFlightGroupsYN = True
     elif contYN.lower() == "u":
         m2s_ThreshUnits = "multiple of median sampling interval" if m2s_ThreshUnits == 'seconds' else 'seconds'
         ComputeFlightGroupsYN = True
@@ -336,8 +276,25 @@ while ShowMenuYN:
         m2s_MoveCopy = "copy"
     elif contYN.lower() == "m":
         m2s_MoveCopy = "move"
+    elif contYN.lower() == "k":
+        m2s_VerifyCopyYN = not m2s_VerifyCopyYN
+    elif contYN.lower() == "r":
+        m2s_DupDetectYN = not m2s_DupDetectYN
     elif contYN.lower() == "s":
         shpCreateYN = not shpCreateYN
+    elif contYN.lower() == "o":
+        exportFormat = "gpkg" if exportFormat == "shp" else "shp"
+    elif contYN.lower() == "l":
+        flightLinesYN = not flightLinesYN
+    elif contYN.lower() == "h":
+        flightHullsYN = not flightHullsYN
+    elif contYN.lower() == "g":
+        coverageYN = not coverageYN
+    elif contYN.lower() == "j":
+        try:
+            projEPSG = uav_pipeline.parse_epsg(input("EPSG code to project to (0 = none, 'utm' = UTM zone of the images): "))
+        except ValueError as e:
+            print(coltxt(str(e), "r"))
     elif contYN.lower() == "p":
         m2s_DivideTifJpgYN = not m2s_DivideTifJpgYN
         ComputeFlightGroupsYN = True
@@ -350,18 +307,37 @@ while ShowMenuYN:
         m2s_FirstFlightNum = int(input("First flight number: "))
         ComputeFlightGroupsYN = True
     elif contYN.lower() == "v":
-        m2s_ThreshVal = int(input("Threshhold value: "))
+        m2s_ThreshVal = float(input("Threshhold value: "))
+        if m2s_ThreshVal == int(m2s_ThreshVal):
+            m2s_ThreshVal = int(m2s_ThreshVal)
+        ComputeFlightGroupsYN = True
+    elif contYN.lower() == "w":
+        fnConfig = input("Config file to save the settings to: ").strip().strip('\'"')
+        if fnConfig != "":
+            uav_pipeline.write_config(fnConfig, uav_pipeline.Options(globals()), {"batch": {"folders": fnInputDir}})
+            print("Saved the settings to " + fnConfig + ". To use them: python batch-uav-imgs.py " + fnConfig)
+    elif contYN.lower() == "a" and m2s_YN and si.knee is not None:
+        m2s_ThreshVal = suggestedVal
         ComputeFlightGroupsYN = True
     else:
         quit()
 
+opt = uav_pipeline.Options(globals())
+
+## FIND RE-FLOWN IMAGES (see reflights.py)
+## Images from different flights (time gaps) within m2s_DupDistance and m2s_DupYawTol
+## of each other are reported, and marked in the Dup_Of field of the shapefiles
+dupOfFns = None
+if m2s_YN and m2s_DupDetectYN:
+    dupOfFns, numDups = uav_pipeline.find_reflown(fnInputDir, imgs, flights, opt, si, log)
+
 ## Create subdirectories and move files
 if m2s_YN:
+    placements, existingSubDirs = uav_pipeline.plan_placements(fnInputDir, imgs, flights)
     overwrite_subdir = "u"
     for i in range(len(flights)):
         fnSubDir = flights[i][1]
-        fnSubDirFullPath = os.path.join(fnInputDir, fnSubDir)
-        if os.path.exists(fnSubDirFullPath):
+        if fnSubDir in existingSubDirs:
             if overwrite_subdir != "a":
                 print("Sub-directory " + fnSubDir + " already exists. Any files in it with the same name will be overwritten.")
                 overwrite_subdir = input("Continue [y/n/a]? ")
@@ -370,106 +346,27 @@ if m2s_YN:
                     quit()
         else:
             print("Creating subdirectory " + fnSubDir)
-            thisdir = fnInputDir
-            for dirpart in fnSubDir.split(os.sep):
-                thisdir = os.path.join(thisdir, dirpart)
-                if not os.path.exists(thisdir):
-                    print(" - going to make the directory " + thisdir)
-                    os.mkdir(thisdir)
-
-        if m2s_MoveCopy == "move":
-            print("Moving files to " + fnSubDir + "...")
-        elif m2s_MoveCopy == "copy":
-            print("Copying files to " + fnSubDir + "...")
-
-        #for j in range(flights[i][0], flights[i][1]+1):
-        for j in flights[i][0]:
-            fnSrc = os.path.join(fnInputDir, file_dt[j][IDX_FN])
-            fnDest = os.path.join(fnSubDirFullPath, file_dt[j][IDX_FN])
-            print(str(j) + ": " + os.path.basename(os.path.normpath(fnSrc)) + " ==> " + os.path.basename(os.path.normpath(fnDest)))
-            if m2s_MoveCopy == "move":
-                os.rename(fnSrc, fnDest)
-            elif m2s_MoveCopy == "copy":
-                copyfile(fnSrc, fnDest)
-
-## CREATE POINT SHAPEFILE OF IMAGE CENTROIDS
-if gdalYN and shpCreateYN:
-    print("Exporting image centroids")
-
-    # Set up the shapefile driver
-    driver = ogr.GetDriverByName("ESRI Shapefile")
-
-    for flight_info in flights:  
-        # Create the data source
-        if m2s_YN:
-            fnShp = os.path.join(fnInputDir, flight_info[1], (flight_info[1] + shape_file_suffix).replace(os.sep, "_"))  
-        else:
-            fnShp = os.path.join(fnInputDir, fnInputLastDir + shape_file_suffix)  
-        data_source = driver.CreateDataSource(fnShp)
-
-        # Create the spatial reference, WGS84
-        srs = osr.SpatialReference()
-        srs.ImportFromEPSG(4326)
-
-        # Create the layer
-        layer = data_source.CreateLayer("Img", srs, ogr.wkbPoint)
 
-        # Add fields
-        fldFn = ogr.FieldDefn("fn", ogr.OFTString)
-        fldFn.SetWidth(254)
-        layer.CreateField(fldFn)
+    if m2s_MoveCopy == "move":
+        print("Moving " + str(len(placements)) + " files...")
+    elif m2s_MoveCopy == "copy":
+        print("Copying " + str(len(placements)) + " files...")
+    for fnSrc, fnDest, e in uav_pipeline.place_images(fnInputDir, placements, opt):
+        print(coltxt("Error placing " + fnSrc + ": " + str(e), "r"))
 
-        fldDate = ogr.FieldDefn("date", ogr.OFTString)
-        fldDate.SetWidth(10)
-        layer.CreateField(fldDate)
+## PROJECT THE COORDINATES (see uav_pipeline.project_images)
+if shpCreateYN:
+    uav_pipeline.project_images(imgs, opt, log)
 
-        fldTime = ogr.FieldDefn("time", ogr.OFTString)
-        fldTime.SetWidth(10)
-        layer.CreateField(fldTime)
-
-        layer.CreateField(ogr.FieldDefn("Latitude", ogr.OFTReal))
-        layer.CreateField(ogr.FieldDefn("Longitude", ogr.OFTReal))
-
-        if add_yaw:
-            layer.CreateField(ogr.FieldDefn("Yaw_Flight", ogr.OFTReal))
-            layer.CreateField(ogr.FieldDefn("Yaw_Gimbal", ogr.OFTReal))
-
-        ## Add records
-        #for i in range(flight_info[0], flight_info[1] + 1):
-        for i in flight_info[0]:
-
-            # create the feature
-            feature = ogr.Feature(layer.GetLayerDefn())
-
-            # Set the attributes using the values from file_dt
-            feature.SetField("fn", file_dt[i][IDX_FN])
-            feature.SetField("date", file_dt[i][IDX_DTOBJ].strftime('%Y:%m:%d'))
-            feature.SetField("time", file_dt[i][IDX_DTOBJ].strftime('%H:%M:%S'))
-            feature.SetField("latitude", file_dt[i][IDX_LAT])
-            feature.SetField("longitude", file_dt[i][IDX_LONG])
-
-            if add_yaw:
-                feature.SetField("yaw_flight", file_dt[i][IDX_YAW_FLIGHT])            
-                feature.SetField("yaw_gimbal", file_dt[i][IDX_YAW_GIMBAL])            
-
-            # create the WKT for the feature using Python string formatting
-            wkt = "POINT(%f %f)" %  (float(file_dt[i][IDX_LONG]) , float(file_dt[i][IDX_LAT]))
-
-            # Create the point from the Well Known Txt
-            point = ogr.CreateGeometryFromWkt(wkt)
-
-            # Set the feature geometry using the point
-            feature.SetGeometry(point)
-
-            # Create the feature in the layer (shapefile)
-            layer.CreateFeature(feature)
-
-            # Dereference the feature
-            feature = None
-
-        # Save and close the data source
-        data_source = None
+## COVERAGE ANALYSIS (see footprints.py)
+coverageResult = None
+if shpCreateYN and coverageYN:
+    coverageResult = uav_pipeline.coverage_analysis(fnInputDir, imgs, flights, opt, log)
 
+## CREATE POINT SHAPEFILE OF IMAGE CENTROIDS (a shapefile for each flight, or one GeoPackage)
+if shpCreateYN:
+    print("Exporting image centroids")
+    for fnShp in uav_pipeline.export_layers(fnInputDir, imgs, flights, opt, dupOfFns, coverageResult):
         print("Created " + fnShp)
 
 print(Style.BRIGHT + Fore.YELLOW + "Done" + Style.RESET_ALL)
@@ -478,12 +375,7 @@ print("\nStill to come:")
 print("  - rename script to uav-img-sort-and-map")
 print("  - add a GUI")
 print("  - images with missing lat or long tags should still be sorted, but just omitted from shapefile construction")
-print("  - option to project")
-print("  - run it on multiple directories at once")
-print("  - option to make a MCP")
-print("  - add Spatial Index (sbx and sbn files)")
-print("  - option to recreate flight line")
-print("  - give exif_info.csv a better name (based on the template for the shapefile), or first create it in Temp space and then rename")
+print("  - add ESRI Spatial Index (sbx and sbn files) to the shapefiles (they get a .qix index, which ArcGIS doesn't read)")
 print("  - additional option for where to save the shapefile (and what to name it)")
 print("  - make the filename field in the attrbitute table a hotlink to the file (?)")
 print("  - offer a couple of preset subdir name templates")
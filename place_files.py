@@ -0,0 +1,468 @@
+## Move or copy images into their flight subdirectories
+## (c) Andy Lyons, 2017
+
+## Files are placed by a pool of threads. Copies use the fastest method the OS
+## offers: a reflink (copy-on-write clone) where the filesystem supports it, then
+## os.copy_file_range / os.sendfile (the data never passes through Python), then
+## a plain buffered copy. Destination directories are created up front in one
+## batch, and progress is reported as throughput and ETA rather than a line
+## per file.
+
+## A journal of the planned and completed placements can be kept in the input
+## folder. If a run is interrupted (disk full, drive unplugged, Ctrl-C), the
+## next run can resume from the journal, skipping files that were already
+## placed after checking their size, and finishing only the rest.
+
+## Copies can also be verified. The source is read once, and the checksum is
+## computed from the same buffers that are written to the destination. The
+## destination is then read back and its checksum compared, and the checksums
+## are saved in a manifest in each destination folder (in the format used by
+## b2sum / xxhsum, so they can be checked again later).
+
+import os, sys, time, errno, json, hashlib
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import xxhash
+    xxhashYN = True
+except ImportError:
+    xxhashYN = False
+
+try:
+    import fcntl
+    FICLONE = 0x40049409    # Linux ioctl to clone a file (btrfs, xfs, ...)
+except ImportError:
+    fcntl = None
+
+## Methods the OS doesn't have
+UNAVAILABLE = set(name for name, missing in [("reflink", fcntl is None),
+                                             ("copy_file_range", not hasattr(os, "copy_file_range")),
+                                             ("sendfile", not hasattr(os, "sendfile") or sys.platform != "linux")] if missing)
+
+## Methods that failed on a destination device (st_dev -> set of names) aren't
+## tried again on that device, but still are on the others
+failed_methods = {}
+
+def method_ok(dev, name):
+    return name not in UNAVAILABLE and name not in failed_methods.get(dev, ())
+
+def method_failed(dev, name):
+    failed_methods.setdefault(dev, set()).add(name)
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+## Copy the contents of one open file to another using the kernel if possible.
+## Returns the name of the method used.
+def copy_fd(fdSrc, fdDest):
+    dev = os.fstat(fdDest).st_dev
+    if method_ok(dev, "reflink"):
+        try:
+            fcntl.ioctl(fdDest, FICLONE, fdSrc)
+            return "reflink"
+        except OSError:
+            method_failed(dev, "reflink")
+    if method_ok(dev, "copy_file_range"):
+        try:
+            copied = 0
+            while True:
+                n = os.copy_file_range(fdSrc, fdDest, CHUNK_SIZE)
+                if n == 0:
+                    break
+                copied = copied + n
+            return "copy_file_range"
+        except OSError:
+            if copied > 0:
+                raise
+            method_failed(dev, "copy_file_range")
+    if method_ok(dev, "sendfile"):
+        try:
+            offset = 0
+            while True:
+                n = os.sendfile(fdDest, fdSrc, offset, CHUNK_SIZE)
+                if n == 0:
+                    break
+                offset = offset + n
+            return "sendfile"
+        except OSError:
+            if offset > 0:
+                raise
+            method_failed(dev, "sendfile")
+    while True:
+        buf = os.read(fdSrc, 1024 * 1024)
+        if not buf:
+            break
+        os.write(fdDest, buf)
+    return "read/write"
+
+def copy_file(fnSrc, fnDest, fsyncYN=False):
+    with open(fnSrc, "rb") as fSrc:
+        with open(fnDest, "wb") as fDest:
+            copy_fd(fSrc.fileno(), fDest.fileno())
+            if fsyncYN:
+                fDest.flush()
+                os.fsync(fDest.fileno())
+
+## Name of the manifest file and the hash function for each checksum type
+HASH_TYPES = {"blake2b": ("manifest.blake2b", hashlib.blake2b)}
+if xxhashYN:
+    HASH_TYPES["xxh128"] = ("manifest.xxh128", xxhash.xxh3_128)
+
+VERIFY_BUF_SIZE = 4 * 1024 * 1024
+
+def hash_file(fn, hash_type="blake2b"):
+    h = HASH_TYPES[hash_type][1]()
+    with open(fn, "rb") as f:
+        while True:
+            buf = f.read(VERIFY_BUF_SIZE)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+## Copy a file, computing its checksum while it's copied, then read back the
+## destination and confirm it matches. If fsyncYN, the destination is flushed to
+## disk and dropped from the page cache first, so it's read back from the disk
+## itself. Returns the checksum.
+def copy_file_verified(fnSrc, fnDest, fsyncYN=False, hash_type="blake2b"):
+    h = HASH_TYPES[hash_type][1]()
+    buf = bytearray(VERIFY_BUF_SIZE)
+    view = memoryview(buf)
+    with open(fnSrc, "rb", buffering=0) as fSrc:
+        with open(fnDest, "wb", buffering=0) as fDest:
+            while True:
+                n = fSrc.readinto(buf)
+                if not n:
+                    break
+                h.update(view[:n])
+                fDest.write(view[:n])
+            if fsyncYN:
+                os.fsync(fDest.fileno())
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fDest.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    digest = h.hexdigest()
+    if hash_file(fnDest, hash_type) != digest:
+        raise IOError("checksum of the copy doesn't match the original")
+    return digest
+
+## Checksum manifests, one per destination folder. Lines are appended as each
+## file is placed, so a resumed run adds to the same manifests.
+class Manifests(object):
+    def __init__(self, hash_type="blake2b"):
+        self.hash_type = hash_type
+        self.fnManifest = HASH_TYPES[hash_type][0]
+        self.files = {}
+
+    def add(self, fnDest, digest):
+        dirname = os.path.dirname(fnDest)
+        if dirname not in self.files:
+            self.files[dirname] = open(os.path.join(dirname, self.fnManifest), "a")
+        self.files[dirname].write(digest + "  " + os.path.basename(fnDest) + "\n")
+
+    ## Return the destination files that aren't in the manifest of their folder yet
+    def missing(self, fnDests):
+        listed = {}
+        missing = []
+        for fnDest in fnDests:
+            dirname = os.path.dirname(fnDest)
+            if dirname not in listed:
+                listed[dirname] = set()
+                fn = os.path.join(dirname, self.fnManifest)
+                if os.path.exists(fn):
+                    with open(fn) as f:
+                        listed[dirname] = set(line.rstrip("\n").split("  ", 1)[-1] for line in f)
+            if os.path.basename(fnDest) not in listed[dirname]:
+                missing.append(fnDest)
+        return missing
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+def move_file(fnSrc, fnDest, fsyncYN=False):
+    try:
+        os.replace(fnSrc, fnDest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        ## Different drive, so copy and delete
+        copy_file(fnSrc, fnDest, fsyncYN)
+        os.remove(fnSrc)
+
+## fsync a directory so renames and new entries in it are durable (no-op on Windows)
+def fsync_dir(dirname):
+    if os.name == "nt":
+        return
+    fd = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def fsync_file(fn):
+    with open(fn, "rb+") as f:
+        os.fsync(f.fileno())
+
+def fmt_bytes(n):
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return ("%d " if unit == "bytes" else "%.1f ") % n + unit
+        n = n / 1024.0
+
+def fmt_secs(secs):
+    secs = int(secs)
+    return "%d:%02d:%02d" % (secs // 3600, (secs // 60) % 60, secs % 60)
+
+## Prints a single updating status line with throughput and ETA
+class Progress(object):
+    def __init__(self, verb, num_files, num_bytes, interval=0.5):
+        self.verb = verb
+        self.num_files = num_files
+        self.num_bytes = num_bytes
+        self.files_done = 0
+        self.bytes_done = 0
+        self.interval = interval
+        self.t0 = time.time()
+        self.last_print = 0
+
+    def update(self, nbytes, force=False):
+        self.files_done = self.files_done + 1
+        self.bytes_done = self.bytes_done + nbytes
+        now = time.time()
+        if force or now - self.last_print >= self.interval or self.files_done == self.num_files:
+            self.last_print = now
+            elapsed = max(now - self.t0, 1e-6)
+            rate = self.bytes_done / elapsed
+            if self.bytes_done > 0 and self.num_bytes > self.bytes_done:
+                eta = (self.num_bytes - self.bytes_done) / rate
+            else:
+                eta = 0
+            sys.stdout.write("\r  " + self.verb + " " + str(self.files_done) + "/" + str(self.num_files) + " files, " +
+                             fmt_bytes(self.bytes_done) + " of " + fmt_bytes(self.num_bytes) + ", " +
+                             fmt_bytes(rate) + "/s, ETA " + fmt_secs(eta) + "   ")
+            sys.stdout.flush()
+
+    def finish(self):
+        elapsed = time.time() - self.t0
+        sys.stdout.write("\n  " + str(self.files_done) + " files (" + fmt_bytes(self.bytes_done) + ") in " + fmt_secs(elapsed) + "\n")
+        sys.stdout.flush()
+
+## Name of the journal file kept in the input folder
+fnJournal = "placement_journal.jsonl"
+
+## Write-ahead journal of placements. The first lines record the mode and every
+## planned (fnSrc, fnDest, size); a line is then appended as each file is placed.
+## The journal is deleted when all the files have been placed.
+class Journal(object):
+    def __init__(self, fn, flush_interval=1.0):
+        self.fn = fn
+        self.f = None
+        self.flush_interval = flush_interval
+        self.last_flush = 0
+
+    ## Start a new journal with the planned placements
+    def start(self, mode, jobs, sizes, hash_type=None):
+        self.f = open(self.fn, "w")
+        self.f.write(json.dumps({"mode": mode, "verify": hash_type}) + "\n")
+        for (fnSrc, fnDest), size in zip(jobs, sizes):
+            self.f.write(json.dumps({"plan": [fnSrc, fnDest, size]}) + "\n")
+        self.sync()
+
+    ## Continue an existing journal
+    def reopen(self):
+        self.f = open(self.fn, "a")
+
+    def done(self, fnSrc):
+        self.f.write(json.dumps({"done": fnSrc}) + "\n")
+        if time.time() - self.last_flush >= self.flush_interval:
+            self.sync()
+
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.last_flush = time.time()
+
+    def close(self):
+        if self.f is not None:
+            self.sync()
+            self.f.close()
+            self.f = None
+
+    ## All done, delete the journal
+    def finish(self):
+        self.close()
+        os.remove(self.fn)
+
+## Read a journal. Returns the mode, the list of planned (fnSrc, fnDest) jobs,
+## their sizes, the set of fnSrc that were recorded as done, and the checksum
+## type if copies were being verified (else None). A partly written last line
+## (e.g. from a crash) is ignored.
+def read_journal(fn):
+    mode = None
+    hash_type = None
+    jobs = []
+    sizes = []
+    done = set()
+    with open(fn) as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if "plan" in rec:
+                jobs.append((rec["plan"][0], rec["plan"][1]))
+                sizes.append(rec["plan"][2])
+            elif "done" in rec:
+                done.add(rec["done"])
+            elif "mode" in rec:
+                mode = rec["mode"]
+                hash_type = rec.get("verify")
+    return mode, jobs, sizes, done, hash_type
+
+## Check whether a job has already been completed (a cheap size check)
+def job_complete(mode, fnSrc, fnDest, size):
+    try:
+        if os.path.getsize(fnDest) != size:
+            return False
+    except OSError:
+        return False
+    return mode == "copy" or not os.path.exists(fnSrc)
+
+## Split the jobs in a journal into those that are already complete and those
+## that still need to be done. Jobs recorded as done are confirmed with a size
+## check; moves whose source is gone and whose destination has the right size
+## are also complete (the journal line may not have been flushed).
+def resume_jobs(mode, jobs, sizes, done):
+    completed = []
+    remaining = []
+    for (fnSrc, fnDest), size in zip(jobs, sizes):
+        if (fnSrc in done or mode == "move") and job_complete(mode, fnSrc, fnDest, size):
+            completed.append((fnSrc, fnDest))
+        else:
+            remaining.append((fnSrc, fnDest))
+    return completed, remaining
+
+## Verify copies that were completed by an earlier (interrupted) run but aren't
+## in a manifest yet. Returns a list of (fnSrc, fnDest, error) for any that
+## don't match.
+def verify_placed(jobs, manifests):
+    errors = []
+    missing = set(manifests.missing([fnDest for fnSrc, fnDest in jobs]))
+    for fnSrc, fnDest in jobs:
+        if fnDest in missing:
+            digest = hash_file(fnDest, manifests.hash_type)
+            if hash_file(fnSrc, manifests.hash_type) == digest:
+                manifests.add(fnDest, digest)
+            else:
+                errors.append((fnSrc, fnDest, IOError("checksum of the copy doesn't match the original")))
+    manifests.close()
+    return errors
+
+## Create all the destination directories in one pass
+def make_dirs(dirnames):
+    for dirname in sorted(set(dirnames)):
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+## Place a list of (fnSrc, fnDest) jobs.
+##   mode: "move" or "copy"
+##   num_workers: number of threads (0 = default), or of threads per group
+##   fsync_policy: "none" (leave it to the OS), "file" (fsync each file as it's
+##      placed), or "end" (fsync all the files and directories once at the end)
+##   on_done: function called with (fnSrc, fnDest) as each file is placed. It's
+##      called in the calling thread, so it's safe to update e.g. a sqlite cache.
+##   journal: a Journal to record the plan and progress in (if resuming, one
+##      that has been reopened)
+##   manifests: for copies, a Manifests object. Each copy is verified and its
+##      checksum added to the manifest of its folder.
+##   groups: a group for each job (e.g. the card it's copied from). Each group
+##      gets its own pool of num_workers threads, so a slow group (e.g. a slow
+##      card) can't hold up the others.
+## Returns a list of (fnSrc, fnDest, error) for any files that failed (including
+## sources that are missing, which are left out of the journal).
+def place_files(jobs, mode="move", num_workers=0, fsync_policy="none", on_done=None, progressYN=True, journal=None, manifests=None,
+                groups=None):
+    if num_workers < 1:
+        num_workers = 8
+    if groups is None:
+        groups = [0] * len(jobs)
+    errors = []
+    sizes = []
+    found = []
+    foundGroups = []
+    for (fnSrc, fnDest), group in zip(jobs, groups):
+        try:
+            sizes.append(os.path.getsize(fnSrc))
+            found.append((fnSrc, fnDest))
+            foundGroups.append(group)
+        except OSError as e:
+            errors.append((fnSrc, fnDest, e))
+    jobs = found
+    numMissing = len(errors)
+    make_dirs(os.path.dirname(fnDest) for fnSrc, fnDest in jobs)
+    if journal is not None and journal.f is None:
+        journal.start(mode, jobs, sizes, manifests.hash_type if manifests is not None else None)
+    fsync_each = fsync_policy == "file"
+    if mode == "move":
+        place = move_file
+    elif manifests is not None:
+        place = lambda fnSrc, fnDest, fsyncYN: copy_file_verified(fnSrc, fnDest, fsyncYN, manifests.hash_type)
+    else:
+        place = copy_file
+    progress = Progress("Moved" if mode == "move" else "Copied", len(jobs), sum(sizes)) if progressYN else None
+    placed = []
+    with ExitStack() as stack:
+        executors = {}
+        futures = {}
+        for i, (fnSrc, fnDest) in enumerate(jobs):
+            group = foundGroups[i]
+            if group not in executors:
+                executors[group] = stack.enter_context(ThreadPoolExecutor(max_workers=num_workers))
+            futures[executors[group].submit(place, fnSrc, fnDest, fsync_each)] = i
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                fnSrc, fnDest = jobs[i]
+                try:
+                    digest = future.result()
+                except (OSError, IOError) as e:
+                    errors.append((fnSrc, fnDest, e))
+                    continue
+                if manifests is not None and mode == "copy":
+                    manifests.add(fnDest, digest)
+                if journal is not None:
+                    journal.done(fnSrc)
+                placed.append((fnSrc, fnDest))
+                if on_done is not None:
+                    on_done(fnSrc, fnDest)
+                if progress is not None:
+                    progress.update(sizes[i])
+        except KeyboardInterrupt:
+            ## Stop as soon as the files being placed right now are finished
+            for future in futures:
+                future.cancel()
+            if journal is not None:
+                journal.close()
+            if manifests is not None:
+                manifests.close()
+            print("\nInterrupted. Run the script again on the same folder to resume.")
+            raise
+    if progress is not None:
+        progress.finish()
+    if manifests is not None:
+        manifests.close()
+
+    if fsync_policy in ("file", "end"):
+        if fsync_policy == "end" and mode == "copy":
+            for fnSrc, fnDest in placed:
+                fsync_file(fnDest)
+        for dirname in set(os.path.dirname(fnDest) for fnSrc, fnDest in placed):
+            fsync_dir(dirname)
+
+    if journal is not None:
+        if len(errors) == numMissing:
+            journal.finish()
+        else:
+            journal.close()
+    return errors
@@ -0,0 +1,141 @@
+## Project the image coordinates from WGS84 longitude/latitude
+## (c) Andy Lyons, 2017
+
+## All the points are converted in one call. pyproj is used if it's installed,
+## then GDAL's osr. Without either, UTM zones (EPSG 326xx and 327xx) are
+## computed here with the Krueger series for the transverse Mercator
+## projection (accurate to well under a millimeter within a zone), on whole
+## arrays at once.
+
+import importlib.util
+import numpy as np
+
+pyprojYN = importlib.util.find_spec("pyproj") is not None
+osrYN = importlib.util.find_spec("osgeo") is not None
+
+WGS84 = 4326
+
+## WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+## UTM parameters
+UTM_K0 = 0.9996
+UTM_FALSE_EASTING = 500000.0
+UTM_FALSE_NORTHING_SOUTH = 10000000.0
+
+## EPSG code of the UTM zone that the (median) point falls in
+def utm_epsg(lon, lat):
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    ok = ~(np.isnan(lon) | np.isnan(lat))
+    if not ok.any():
+        raise ValueError("no coordinates to pick a UTM zone from")
+    zone = int(np.floor((np.median(lon[ok]) + 180) / 6)) % 60 + 1
+    return (32600 if np.median(lat[ok]) >= 0 else 32700) + zone
+
+## Zone number and hemisphere of a UTM EPSG code (None if it isn't one)
+def utm_zone(epsg):
+    if 32601 <= epsg <= 32660:
+        return epsg - 32600, "N"
+    if 32701 <= epsg <= 32760:
+        return epsg - 32700, "S"
+    return None
+
+## Transverse Mercator (Krueger series to n^6, see Karney 2011, "Transverse
+## Mercator with an accuracy of a few nanometers") on the WGS84 ellipsoid
+def transverse_mercator(lon, lat, lon0, k0, false_easting, false_northing):
+    n = WGS84_F / (2 - WGS84_F)
+    e = np.sqrt(WGS84_F * (2 - WGS84_F))
+    big_a = WGS84_A / (1 + n) * (1 + n ** 2 / 4 + n ** 4 / 64 + n ** 6 / 256)
+    alpha = [n / 2 - 2 * n ** 2 / 3 + 5 * n ** 3 / 16 + 41 * n ** 4 / 180 - 127 * n ** 5 / 288 + 7891 * n ** 6 / 37800,
+             13 * n ** 2 / 48 - 3 * n ** 3 / 5 + 557 * n ** 4 / 1440 + 281 * n ** 5 / 630 - 1983433 * n ** 6 / 1935360,
+             61 * n ** 3 / 240 - 103 * n ** 4 / 140 + 15061 * n ** 5 / 26880 + 167603 * n ** 6 / 181440,
+             49561 * n ** 4 / 161280 - 179 * n ** 5 / 168 + 6601661 * n ** 6 / 7257600,
+             34729 * n ** 5 / 80640 - 3418889 * n ** 6 / 1995840,
+             212378941 * n ** 6 / 319334400]
+
+    phi = np.radians(np.asarray(lat, dtype=np.float64))
+    lam = np.radians(np.asarray(lon, dtype=np.float64) - lon0)
+    sin_phi = np.sin(phi)
+    t = np.sinh(np.arctanh(sin_phi) - e * np.arctanh(e * sin_phi))
+    xi1 = np.arctan2(t, np.cos(lam))
+    eta1 = np.arctanh(np.sin(lam) / np.sqrt(1 + t * t))
+    xi = xi1.copy()
+    eta = eta1.copy()
+    for j in range(1, 7):
+        xi += alpha[j - 1] * np.sin(2 * j * xi1) * np.cosh(2 * j * eta1)
+        eta += alpha[j - 1] * np.cos(2 * j * xi1) * np.sinh(2 * j * eta1)
+    return false_easting + k0 * big_a * eta, false_northing + k0 * big_a * xi
+
+## Project longitude and latitude arrays to a UTM zone with the built-in code
+def project_utm(lon, lat, epsg):
+    zone, hemisphere = utm_zone(epsg)
+    return transverse_mercator(lon, lat, zone * 6 - 183, UTM_K0, UTM_FALSE_EASTING,
+                               UTM_FALSE_NORTHING_SOUTH if hemisphere == "S" else 0.0)
+
+## Project longitude and latitude arrays to epsg. Returns x, y and the name of
+## the method used. Raises ValueError if the projection isn't available.
+def project(lon, lat, epsg):
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    if pyprojYN:
+        import pyproj
+        transformer = pyproj.Transformer.from_crs(WGS84, epsg, always_xy=True)
+        x, y = transformer.transform(lon, lat)
+        return np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), "pyproj"
+    if osrYN:
+        from osgeo import osr
+        src = osr.SpatialReference()
+        src.ImportFromEPSG(WGS84)
+        dst = osr.SpatialReference()
+        dst.ImportFromEPSG(epsg)
+        for srs in (src, dst):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        pts = np.array(osr.CoordinateTransformation(src, dst).TransformPoints(np.column_stack((lon, lat)).tolist()))
+        if len(pts) == 0:
+            return lon.copy(), lat.copy(), "osr"
+        return pts[:, 0], pts[:, 1], "osr"
+    if utm_zone(epsg) is not None:
+        x, y = project_utm(lon, lat, epsg)
+        return x, y, "built-in transverse Mercator"
+    raise ValueError("projecting to EPSG:" + str(epsg) + " needs pyproj or GDAL (only UTM zones are built in)")
+
+## Well-known text of a spatial reference system, in the ESRI flavor (for .prj
+## files) or the OGC one (for GeoPackages). Returns None if it isn't known.
+WGS84_WKT_ESRI = 'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]'
+WGS84_WKT_OGC = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]'
+
+def srs_wkt(epsg, esri=False):
+    if epsg == WGS84:
+        return WGS84_WKT_ESRI if esri else WGS84_WKT_OGC
+    if pyprojYN:
+        import pyproj
+        return pyproj.CRS.from_epsg(epsg).to_wkt("WKT1_ESRI" if esri else "WKT1_GDAL")
+    if osrYN:
+        from osgeo import osr
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(epsg)
+        if esri:
+            srs.MorphToESRI()
+        return srs.ExportToWkt()
+    if utm_zone(epsg) is None:
+        return None
+    zone, hemisphere = utm_zone(epsg)
+    false_northing = UTM_FALSE_NORTHING_SOUTH if hemisphere == "S" else 0.0
+    if esri:
+        return 'PROJCS["WGS_1984_UTM_Zone_%d%s",%s,PROJECTION["Transverse_Mercator"],PARAMETER["False_Easting",500000.0],' \
+               'PARAMETER["False_Northing",%.1f],PARAMETER["Central_Meridian",%.1f],PARAMETER["Scale_Factor",0.9996],' \
+               'PARAMETER["Latitude_Of_Origin",0.0],UNIT["Meter",1.0]]' % (zone, hemisphere, WGS84_WKT_ESRI, false_northing, zone * 6 - 183)
+    return 'PROJCS["WGS 84 / UTM zone %d%s",%s,PROJECTION["Transverse_Mercator"],PARAMETER["latitude_of_origin",0],' \
+           'PARAMETER["central_meridian",%d],PARAMETER["scale_factor",0.9996],PARAMETER["false_easting",500000],' \
+           'PARAMETER["false_northing",%d],UNIT["metre",1,AUTHORITY["EPSG","9001"]],AXIS["Easting",EAST],AXIS["Northing",NORTH],' \
+           'AUTHORITY["EPSG","%d"]]' % (zone, hemisphere, WGS84_WKT_OGC, zone * 6 - 183, false_northing, epsg)
+
+## Name of a spatial reference system, for the GeoPackage
+def srs_name(epsg):
+    if epsg == WGS84:
+        return "WGS 84 geodetic"
+    if utm_zone(epsg) is not None:
+        return "WGS 84 / UTM zone %d%s" % utm_zone(epsg)
+    return "EPSG:" + str(epsg)
@@ -0,0 +1,131 @@
+## Find images of the same spot taken in different flights (e.g. lines flown
+## again when a mission is resumed after a battery swap)
+## (c) Andy Lyons, 2017
+
+## The image centers are hashed into a grid of square cells as wide as the
+## distance tolerance, so every pair of images within that distance is in the
+## same cell or a neighboring one. Sorting by cell and comparing each cell with
+## itself and four of its neighbors (the other four are covered from the other
+## side) finds all the close pairs in near O(n), with array operations.
+
+import csv
+import numpy as np
+import flight_geom
+
+## Neighboring cells that each cell is compared with (column, row offsets)
+NEIGHBORS = [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]
+
+## All the pairs of points within dist of each other. Points with missing
+## coordinates are left out. Returns arrays of the indices of the two points
+## (i < j within a cell) and the distance between them.
+def pairs_within(x, y, dist):
+    ok = np.flatnonzero(~(np.isnan(x) | np.isnan(y)))
+    if len(ok) < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    col = np.floor(x[ok] / dist).astype(np.int64)
+    row = np.floor(y[ok] / dist).astype(np.int64)
+    col -= col.min() - 1
+    row -= row.min() - 1
+    ## One number per cell, with a margin of a row so neighbors don't wrap around
+    nrows = int(row.max()) + 2
+    key = col * nrows + row
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    pts = ok[order]
+    cells, first, count = np.unique(key, return_index=True, return_counts=True)
+
+    pair_i = []
+    pair_j = []
+    for dc, dr in NEIGHBORS:
+        nbr = cells + dc * nrows + dr
+        pos = np.minimum(np.searchsorted(cells, nbr), len(cells) - 1)
+        a = np.flatnonzero(cells[pos] == nbr)
+        b = pos[a]
+        ## Every point in cell a with every point in cell b
+        na = count[a]
+        nb = count[b]
+        num = na * nb
+        cell_pair = np.repeat(np.arange(len(a)), num)
+        k = np.arange(len(cell_pair)) - np.repeat(np.cumsum(num) - num, num)
+        ia = first[a][cell_pair] + k // nb[cell_pair]
+        ib = first[b][cell_pair] + k % nb[cell_pair]
+        if (dc, dr) == (0, 0):
+            keep = ia < ib
+            ia = ia[keep]
+            ib = ib[keep]
+        pair_i.append(pts[ia])
+        pair_j.append(pts[ib])
+    i = np.concatenate(pair_i)
+    j = np.concatenate(pair_j)
+    d = np.hypot(x[i] - x[j], y[i] - y[j])
+    close = d <= dist
+    return i[close], j[close], d[close]
+
+## Difference between two headings (degrees, 0 to 180). It's 0 if either is unknown.
+def heading_diff(a, b):
+    diff = np.abs((a - b + 180) % 360 - 180)
+    return np.where(np.isnan(diff), 0.0, diff)
+
+## Find the images that were taken within dist meters and yaw_tol degrees of an
+## image of the same kind (file extension, and stream if given) from an earlier
+## flight. flight_num is the flight (time segment) of each image, and streams
+## the stream (camera) number, see flight_groups.py. Returns arrays with, for each
+## image, the index of the closest such image (-1 if there isn't one), the
+## distance to it and the difference in heading.
+def find_duplicates(imgs, flight_num, dist, yaw_tol, streams=None):
+    n = len(imgs)
+    dup_of = np.full(n, -1, dtype=np.int64)
+    dup_dist = np.full(n, np.nan)
+    dup_yaw = np.full(n, np.nan)
+    if n == 0:
+        return dup_of, dup_dist, dup_yaw
+    x, y = flight_geom.local_meters(imgs.x, imgs.y, imgs.projected())
+    yaw = imgs.yaw()
+    ext, ext_values = imgs.field_codes("ext")
+    kind = ext if streams is None else streams * len(ext_values) + ext
+
+    i, j, d = pairs_within(x, y, dist)
+    dyaw = heading_diff(yaw[i], yaw[j])
+    keep = (flight_num[i] != flight_num[j]) & (kind[i] == kind[j]) & (dyaw <= yaw_tol)
+    if not keep.any():
+        return dup_of, dup_dist, dup_yaw
+    i, j, d, dyaw = i[keep], j[keep], d[keep], dyaw[keep]
+
+    ## The image from the later flight is the duplicate, of the closest image
+    ## from an earlier flight
+    later = np.where(flight_num[i] > flight_num[j], i, j)
+    earlier = np.where(flight_num[i] > flight_num[j], j, i)
+    order = np.lexsort((d, later))
+    closest = order[np.concatenate(([True], np.diff(later[order]) != 0))]
+    dup_of[later[closest]] = earlier[closest]
+    dup_dist[later[closest]] = d[closest]
+    dup_yaw[later[closest]] = dyaw[closest]
+    return dup_of, dup_dist, dup_yaw
+
+## Count the duplicates of each flight (a list of flights, each with an array of
+## image indices and a name, see flight_groups.make_flights). Returns a list with,
+## for each flight, the number of duplicates and a dictionary with the number of
+## them in each earlier flight.
+def overlap_report(flights, dup_of):
+    flight_of = np.full(len(dup_of), -1, dtype=np.int64)
+    for k, flight_info in enumerate(flights):
+        flight_of[flight_info[0]] = k
+    report = []
+    for flight_info in flights:
+        idx = flight_info[0][dup_of[flight_info[0]] >= 0]
+        earlier, counts = np.unique(flight_of[dup_of[idx]], return_counts=True)
+        report.append((len(idx), dict(zip(earlier.tolist(), counts.tolist()))))
+    return report
+
+## Save the duplicates in a csv file, one row per duplicate image
+def write_csv(fnCsv, imgs, flights, dup_of, dup_dist, dup_yaw):
+    flight_name = np.empty(len(imgs), dtype=object)
+    for flight_info in flights:
+        flight_name[flight_info[0]] = flight_info[1]
+    with open(fnCsv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["FileName", "Flight", "Dup_Of", "Dup_Flight", "Dist_m", "Yaw_Diff"])
+        for k in np.flatnonzero(dup_of >= 0).tolist():
+            writer.writerow([imgs.fn(k), flight_name[k], imgs.fn(dup_of[k]), flight_name[dup_of[k]],
+                             "%.2f" % dup_dist[k], "%.1f" % dup_yaw[k]])
+    return fnCsv
@@ -0,0 +1,712 @@
+## Export the image centroids (and other layers) to GIS files
+## (c) Andy Lyons, 2017
+
+## A layer is described by a list of fields, a list of records (tuples with one
+## value per field), and the geometry: for points, arrays of x and y; for lines
+## and polygons, a list with one (n, 2) array of vertices per feature (or, for
+## a polygon with holes, a list of rings with the outer ring first). Geometries
+## are built directly from the numbers (no WKT), and separate files (e.g. one
+## per flight) are written in parallel threads.
+
+## There are two writers for ESRI shapefiles:
+##   write_layer_shp: writes the .shp, .shx, .dbf, .prj (and .cpg) files itself,
+##      packing all the records at once with numpy. No dependencies.
+##   write_layer_ogr: uses GDAL/OGR. Each call makes its own OGR objects (including
+##      the spatial reference), so files can be written in parallel threads.
+## GDAL is only imported if the OGR writer is used. Both also write a .qix
+## quadtree spatial index (read by QGIS, MapServer and GDAL), built from the
+## coordinate arrays.
+## write_gpkg writes all the flights into a single GeoPackage (an SQLite
+## database) with sqlite3, including an R-tree spatial index.
+
+import os, struct, sqlite3, importlib.util
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import flight_geom, projection, footprints
+
+gdalYN = importlib.util.find_spec("osgeo") is not None
+ogr = None
+osr = None
+
+def import_ogr():
+    global ogr, osr
+    if ogr is None:
+        import osgeo.ogr
+        import osgeo.osr
+        osr = osgeo.osr
+        ogr = osgeo.ogr
+
+## Fields of the point layer: (name, type, width). Type is 'str', 'int' or 'real'.
+POINT_FIELDS = [("fn", "str", 254), ("date", "str", 10), ("time", "str", 10), ("Latitude", "real", 0), ("Longitude", "real", 0)]
+YAW_FIELDS = [("Yaw_Flight", "real", 0), ("Yaw_Gimbal", "real", 0)]
+XY_FIELDS = [("X", "real", 0), ("Y", "real", 0)]
+DUP_FIELDS = [("Dup_Of", "str", 254)]
+
+def point_fields(imgs, add_yaw=True, dup_of=None):
+    return POINT_FIELDS + (YAW_FIELDS if add_yaw else []) + (XY_FIELDS if imgs.projected() else []) + \
+           (DUP_FIELDS if dup_of is not None else [])
+
+## Construct the fields, records and geometry of the image centroids in idx.
+## If the images have been projected, the geometry is in projected coordinates
+## and they're also added as X and Y fields. dup_of is an optional array with
+## the file name of the image each one duplicates ('' if none, see reflights.py),
+## added as the Dup_Of field.
+def point_layer(imgs, idx, add_yaw=True, dup_of=None):
+    idx = np.asarray(idx, dtype=np.int64)
+    xs = imgs.x[idx]
+    ys = imgs.y[idx]
+    xy = list(zip(xs.tolist(), ys.tolist())) if imgs.projected() else [()] * len(idx)
+    dups = list(zip(dup_of[idx].tolist())) if dup_of is not None else [()] * len(idx)
+    records = []
+    for k, (fn, date, time, lon, lat, yaw_flight, yaw_gimbal) in enumerate(imgs.iter_rows(idx)):
+        rec = (fn, date, time, lat, lon) + ((yaw_flight, yaw_gimbal) if add_yaw else ())
+        records.append(rec + xy[k] + dups[k])
+    return point_fields(imgs, add_yaw, dup_of), records, (xs, ys)
+
+## Construct a line layer with the flight line of each flight (the image
+## centers in timestamp order), simplified with tolerance meters
+LINE_FIELDS = [("flight", "str", 254), ("flight_id", "int", 0), ("num_imgs", "int", 0), ("start_time", "str", 19),
+               ("end_time", "str", 19), ("vertices", "int", 0), ("length_m", "real", 0)]
+
+def flight_lines_layer(imgs, flights, tolerance=0):
+    records = []
+    shapes = []
+    for i, flight_info in enumerate(flights):
+        idx = flight_info[0]
+        line = flight_geom.flight_line(imgs.x, imgs.y, idx, tolerance, imgs.projected())
+        if line is None:
+            continue
+        xy, length = line
+        records.append((flight_info[1], i + 1, len(idx), imgs.datetime(idx[0]).strftime("%Y:%m:%d %H:%M:%S"),
+                        imgs.datetime(idx[-1]).strftime("%Y:%m:%d %H:%M:%S"), len(xy), length))
+        shapes.append(xy)
+    return LINE_FIELDS, records, shapes
+
+## Construct a polygon layer with the minimum convex polygon (hull) of each flight
+HULL_FIELDS = [("flight", "str", 254), ("flight_id", "int", 0), ("num_imgs", "int", 0), ("area_ha", "real", 0)]
+
+def flight_hulls_layer(imgs, flights):
+    records = []
+    shapes = []
+    for i, flight_info in enumerate(flights):
+        hull = flight_geom.flight_hull(imgs.x, imgs.y, flight_info[0], imgs.projected())
+        if hull is None:
+            continue
+        xy, area = hull
+        records.append((flight_info[1], i + 1, len(flight_info[0]), area / 10000))
+        shapes.append(xy)
+    return HULL_FIELDS, records, shapes
+
+## Construct a polygon layer with the under-covered areas found by the coverage
+## analysis (footprints.Coverage)
+GAP_FIELDS = [("gap_id", "int", 0), ("area_m2", "real", 0), ("holes", "int", 0)]
+
+def coverage_gaps_layer(cov):
+    records = [(i + 1, footprints.polygon_area(rings), len(rings) - 1) for i, rings in enumerate(cov.gaps)]
+    return GAP_FIELDS, records, cov.gaps
+
+## A new spatial reference (OGR objects aren't safe to share between threads)
+def new_srs(epsg):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    return srs
+
+## Construct an OGR line or polygon from an array of vertices (or a list of
+## rings for a polygon with holes)
+def ogr_shape(geom_type, xy):
+    if geom_type == "line":
+        line = ogr.Geometry(ogr.wkbLineString)
+        for x, y in xy.tolist():
+            line.AddPoint_2D(x, y)
+        return line
+    polygon = ogr.Geometry(ogr.wkbPolygon)
+    for ring_xy in polygon_rings(xy):
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for x, y in ring_xy.tolist():
+            ring.AddPoint_2D(x, y)
+        ring.CloseRings()
+        polygon.AddGeometry(ring)
+    return polygon
+
+## Write a layer to a shapefile with OGR
+def write_layer_ogr(fnShp, fields, records, geoms, epsg=4326, geom_type="point"):
+    import_ogr()
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    data_source = driver.CreateDataSource(fnShp)
+    ogr_geom_types = {"point": ogr.wkbPoint, "line": ogr.wkbLineString, "polygon": ogr.wkbPolygon}
+    layer = data_source.CreateLayer("Img" if geom_type == "point" else os.path.splitext(os.path.basename(fnShp))[0],
+                                    new_srs(epsg), ogr_geom_types[geom_type])
+
+    # Add fields
+    ogr_types = {"str": ogr.OFTString, "int": ogr.OFTInteger, "real": ogr.OFTReal}
+    for name, kind, width in fields:
+        fld = ogr.FieldDefn(name, ogr_types[kind])
+        if width > 0:
+            fld.SetWidth(width)
+        layer.CreateField(fld)
+    defn = layer.GetLayerDefn()
+    real_cols = [i for i in range(len(fields)) if fields[i][1] == "real"]
+    str_cols = [i for i in range(len(fields)) if fields[i][1] != "real"]
+
+    ## Add records (the shapefile driver writes each feature straight to the
+    ## file, it doesn't support transactions)
+    if geom_type == "point":
+        xs = geoms[0].tolist()
+        ys = geoms[1].tolist()
+    for k in range(len(records)):
+        rec = records[k]
+        feature = ogr.Feature(defn)
+        for i in str_cols:
+            feature.SetField(i, rec[i])
+        for i in real_cols:
+            if rec[i] == rec[i]:    # leave NaN (missing) values null
+                feature.SetField(i, rec[i])
+        if geom_type == "point":
+            geom = ogr.Geometry(ogr.wkbPoint)
+            geom.AddPoint_2D(xs[k], ys[k])
+        else:
+            geom = ogr_shape(geom_type, geoms[k])
+        feature.SetGeometry(geom)
+        layer.CreateFeature(feature)
+
+    # Save and close the data source
+    data_source = None
+    if geom_type == "point":
+        write_qix(os.path.splitext(fnShp)[0] + ".qix", np.asarray(geoms[0], dtype=np.float64), np.asarray(geoms[1], dtype=np.float64))
+    return fnShp
+
+
+## Shape types
+SHP_POINT = 1
+SHP_TYPES = {"point": SHP_POINT, "line": 3, "polygon": 5}
+
+## Width and decimals used for 'real' fields (the same as OGR), and width of 'int' fields
+REAL_WIDTH = 24
+REAL_DECIMALS = 15
+INT_WIDTH = 10
+
+## Main file header (100 bytes) of a .shp or .shx file
+def shp_header(shape_type, file_len_bytes, bbox):
+    hdr = np.zeros(1, dtype=[("code", ">i4"), ("unused", ">i4", 5), ("len", ">i4"), ("version", "<i4"), ("type", "<i4"), ("bbox", "<f8", 4), ("zm", "<f8", 4)])
+    hdr["code"] = 9994
+    hdr["len"] = file_len_bytes // 2
+    hdr["version"] = 1000
+    hdr["type"] = shape_type
+    hdr["bbox"] = bbox
+    return hdr.tobytes()
+
+## Pack the .shp and .shx records of a set of points
+def shp_points(xs, ys):
+    n = len(xs)
+    recs = np.zeros(n, dtype=[("num", ">i4"), ("len", ">i4"), ("type", "<i4"), ("x", "<f8"), ("y", "<f8")])
+    recs["num"] = np.arange(1, n + 1)
+    recs["len"] = 10
+    recs["type"] = SHP_POINT
+    recs["x"] = xs
+    recs["y"] = ys
+    idx = np.zeros(n, dtype=[("offset", ">i4"), ("len", ">i4")])
+    idx["offset"] = (100 + 28 * np.arange(n)) // 2
+    idx["len"] = 10
+    if n > 0:
+        bbox = (xs.min(), ys.min(), xs.max(), ys.max())
+    else:
+        bbox = (0, 0, 0, 0)
+    return recs.tobytes(), idx.tobytes(), bbox
+
+## Signed area of a ring (positive if counter-clockwise)
+def ring_area(xy):
+    x = xy[:, 0]
+    y = xy[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+## Close a polygon ring and put it in the given direction
+def oriented_ring(xy, clockwise):
+    if len(xy) > 0 and (xy[0] != xy[-1]).any():
+        xy = np.vstack((xy, xy[:1]))
+    if (ring_area(xy) < 0) != clockwise:
+        xy = xy[::-1]
+    return xy
+
+## The rings of a polygon: a polygon is an array of vertices, or a list of rings
+## (the outer ring first, then the holes)
+def polygon_rings(shape):
+    if isinstance(shape, np.ndarray):
+        return [shape]
+    return list(shape)
+
+## The vertices of a line, or the outer ring of a polygon
+def outer_vertices(shape):
+    return polygon_rings(shape)[0]
+
+## Pack the .shp and .shx records of lines (one part each) or polygons (one
+## part per ring). Outer rings are written clockwise and holes counter-clockwise,
+## as the format requires.
+def shp_shapes(shapes, shape_type):
+    recs = []
+    idx = []
+    pos = 100
+    for num, shape in enumerate(shapes):
+        if shape_type == SHP_TYPES["polygon"]:
+            rings = [oriented_ring(np.asarray(ring, dtype="<f8"), k == 0) for k, ring in enumerate(polygon_rings(shape))]
+        else:
+            rings = [shape]
+        xy = np.ascontiguousarray(np.vstack(rings), dtype="<f8")
+        starts = np.cumsum([0] + [len(ring) for ring in rings[:-1]])
+        content = struct.pack("<i4dii", shape_type, xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max(), len(rings), len(xy)) + \
+                  np.asarray(starts, dtype="<i4").tobytes() + xy.tobytes()
+        recs.append(struct.pack(">ii", num + 1, len(content) // 2) + content)
+        idx.append(struct.pack(">ii", pos // 2, len(content) // 2))
+        pos = pos + 8 + len(content)
+    if len(shapes) > 0:
+        xy = np.vstack([outer_vertices(shape) for shape in shapes])
+        bbox = (xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max())
+    else:
+        bbox = (0, 0, 0, 0)
+    return b"".join(recs), b"".join(idx), bbox
+
+## Format a column of numbers as fixed width text (blank for NaN), and return
+## the number of decimals used
+def format_reals(vals):
+    vals = np.asarray(vals, dtype=np.float64)
+    ## NaN, infinite and values too big for the field are written as null
+    ok = np.isfinite(vals) & (np.abs(vals) < 10.0 ** (REAL_WIDTH - 2))
+    decimals = REAL_DECIMALS
+    if ok.any():
+        int_digits = len("%d" % np.abs(vals[ok]).max())
+        decimals = max(0, min(REAL_DECIMALS, REAL_WIDTH - int_digits - 2))
+    ## One format operation for the whole column
+    txt = (("%" + str(REAL_WIDTH) + "." + str(decimals) + "f") * len(vals)) % tuple(np.where(ok, vals, 0.0).tolist())
+    col = np.frombuffer(txt.encode("ascii"), dtype="S" + str(REAL_WIDTH)).copy()
+    col[~ok] = b" " * REAL_WIDTH
+    return col, decimals
+
+## Format a column of integers as fixed width text
+def format_ints(vals):
+    txt = (("%" + str(INT_WIDTH) + "d") * len(vals)) % tuple(vals)
+    return np.frombuffer(txt.encode("ascii"), dtype="S" + str(INT_WIDTH))
+
+## Format a column of strings as fixed width (space padded) utf-8 text, cut on a
+## character boundary so a multi-byte character is never split
+def format_strs(vals, width):
+    txt = b"".join(v.encode("utf-8")[:width].decode("utf-8", "ignore").encode("utf-8").ljust(width) for v in vals)
+    return np.frombuffer(txt, dtype="S" + str(width))
+
+## Construct the .dbf file for a list of records
+def dbf_bytes(fields, records):
+    n = len(records)
+    cols = []
+    descs = []
+    for i, (name, kind, width) in enumerate(fields):
+        vals = [rec[i] for rec in records]
+        if kind == "str":
+            col = format_strs(vals, width)
+            descs.append((name, b"C", width, 0))
+        elif kind == "int":
+            col = format_ints(vals)
+            width = INT_WIDTH
+            descs.append((name, b"N", width, 0))
+        else:
+            col, decimals = format_reals(vals)
+            width = REAL_WIDTH
+            descs.append((name, b"N", width, decimals))
+        cols.append((col, width))
+
+    ## All the records are packed at once with a structured array
+    recs = np.zeros(n, dtype=[("deleted", "S1")] + [("f" + str(i), "S" + str(cols[i][1])) for i in range(len(cols))])
+    recs["deleted"] = b" "
+    for i in range(len(cols)):
+        recs["f" + str(i)] = cols[i][0] if n > 0 else []
+    rec_len = 1 + sum(width for col, width in cols)
+
+    today = date.today()
+    hdr_len = 32 + 32 * len(descs) + 1
+    hdr = bytes([3, today.year - 1900, today.month, today.day]) + np.array([n], "<u4").tobytes() + \
+          np.array([hdr_len, rec_len], "<u2").tobytes() + bytes(20)
+    for name, kind, width, decimals in descs:
+        hdr = hdr + name.encode("ascii")[:10].ljust(11, b"\x00") + kind + bytes(4) + bytes([width, decimals]) + bytes(14)
+    return hdr + b"\x0d" + recs.tobytes() + b"\x1a"
+
+## Write a layer to a shapefile without GDAL
+def write_layer_shp(fnShp, fields, records, geoms, epsg=4326, geom_type="point"):
+    base = os.path.splitext(fnShp)[0]
+    shape_type = SHP_TYPES[geom_type]
+    if geom_type == "point":
+        xs, ys = [np.asarray(a, dtype=np.float64) for a in geoms]
+        shp_recs, shx_recs, bbox = shp_points(xs, ys)
+    else:
+        shp_recs, shx_recs, bbox = shp_shapes(geoms, shape_type)
+    with open(base + ".shp", "wb") as f:
+        f.write(shp_header(shape_type, 100 + len(shp_recs), bbox))
+        f.write(shp_recs)
+    with open(base + ".shx", "wb") as f:
+        f.write(shp_header(shape_type, 100 + len(shx_recs), bbox))
+        f.write(shx_recs)
+    with open(base + ".dbf", "wb") as f:
+        f.write(dbf_bytes(fields, records))
+    with open(base + ".cpg", "w") as f:
+        f.write("UTF-8")
+    prj = projection.srs_wkt(epsg, esri=True)
+    if prj is not None:
+        with open(base + ".prj", "w") as f:
+            f.write(prj)
+    if geom_type == "point":
+        write_qix(base + ".qix", xs, ys)
+    return fnShp
+
+## Maximum depth of the quadtree, and number of points a node holds before it's split
+QIX_MAX_DEPTH = 16
+QIX_LEAF_SIZE = 8
+
+## Spread the lower 16 bits of each value out to the even bits (for Morton codes)
+def spread_bits(v):
+    v = v & 0xFFFF
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
+
+## Write a quadtree spatial index (.qix, the format of shapelib's shptree and
+## MapServer's shptree utility) for a set of points. The points are sorted by
+## their Morton (Z-order) code on a grid over the bounding box, so every node of
+## the quadtree is a run of the sorted points with the same code prefix, and
+## each level of the tree is found at once with array operations. Points are
+## kept in the leaves, and empty quadrants are left out.
+def write_qix(fnQix, xs, ys):
+    n = len(xs)
+    ok = ~(np.isnan(xs) | np.isnan(ys))
+    ids = np.flatnonzero(ok)
+    if len(ids) > 0:
+        x = xs[ids]
+        y = ys[ids]
+        side = (1 << QIX_MAX_DEPTH) - 1
+        gx = ((x - x.min()) / max(x.max() - x.min(), 1e-12) * side).astype(np.int64)
+        gy = ((y - y.min()) / max(y.max() - y.min(), 1e-12) * side).astype(np.int64)
+        keys = spread_bits(gx) | (spread_bits(gy) << 1)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        ids = ids[order]
+        x = x[order]
+        y = y[order]
+
+        ## Nodes of each level: the runs of points sharing a key prefix, whose
+        ## parent was split
+        m = len(ids)
+        starts = np.zeros(1, dtype=np.int64)
+        exists = np.ones(1, dtype=bool)
+        split = exists & (m > QIX_LEAF_SIZE)
+        node_levels = []
+        level = 0
+        while True:
+            counts = np.diff(np.append(starts, m))
+            nsub = np.zeros(len(starts), dtype=np.int64)
+            next_level = None
+            if split.any() and level < QIX_MAX_DEPTH:
+                prefix = keys >> (2 * (QIX_MAX_DEPTH - level - 1))
+                child_starts = np.concatenate(([0], np.flatnonzero(prefix[1:] != prefix[:-1]) + 1))
+                parent = np.searchsorted(starts, child_starts, side="right") - 1
+                child_exists = exists[parent] & split[parent]
+                nsub = np.bincount(parent[child_exists], minlength=len(starts))
+                next_level = (child_starts, child_exists)
+            else:
+                split = np.zeros(len(starts), dtype=bool)
+            sel = np.flatnonzero(exists)
+            node_levels.append((starts[sel], counts[sel], np.full(len(sel), level), nsub[sel], split[sel],
+                                np.minimum.reduceat(x, starts)[sel], np.minimum.reduceat(y, starts)[sel],
+                                np.maximum.reduceat(x, starts)[sel], np.maximum.reduceat(y, starts)[sel]))
+            if next_level is None:
+                break
+            starts, exists = next_level
+            counts = np.diff(np.append(starts, m))
+            split = exists & (counts > QIX_LEAF_SIZE)
+            level = level + 1
+        depth = level + 1
+        starts, counts, levels, nsub, split, minx, miny, maxx, maxy = [np.concatenate(col) for col in zip(*node_levels)]
+
+        ## Sorting the nodes by first point, then level, puts them in the order
+        ## they're written (each node followed by its subnodes). The offset of a
+        ## node is the size of all its subnodes.
+        pre = np.lexsort((levels, starts))
+        starts, counts, nsub, split, minx, miny, maxx, maxy = [col[pre] for col in (starts, counts, nsub, split, minx, miny, maxx, maxy)]
+        num_ids = np.where(split, 0, counts)
+        sizes = 44 + 4 * num_ids
+        cum = np.concatenate(([0], np.cumsum(sizes)))
+        subtree_end = np.searchsorted(starts, starts + counts, side="left")
+        offsets = cum[subtree_end] - cum[1:]
+
+        ids = ids.astype("<i4")
+        parts = []
+        for k, (offset, lo, cnt, nsub_k, x0, y0, x1, y1) in enumerate(zip(offsets.tolist(), starts.tolist(), num_ids.tolist(), nsub.tolist(),
+                                                                       minx.tolist(), miny.tolist(), maxx.tolist(), maxy.tolist())):
+            parts.append(struct.pack("<i4di", offset, x0, y0, x1, y1, cnt))
+            if cnt > 0:
+                parts.append(ids[lo:lo + cnt].tobytes())
+            parts.append(struct.pack("<i", nsub_k))
+    else:
+        depth = 1
+        parts = [struct.pack("<i4dii", 0, 0.0, 0.0, 0.0, 0.0, 0, 0)]
+
+    with open(fnQix, "wb") as f:
+        f.write(b"SQT\x01\x01\x00\x00\x00" + struct.pack("<ii", n, depth))
+        f.write(b"".join(parts))
+    return fnQix
+
+## Write several layers in parallel. jobs is a list of (fn, fields, records,
+## geoms), with the geometry type ('point', 'line' or 'polygon') as an optional
+## fifth element. Returns the list of files written, in the same order.
+def write_layers(jobs, writer, num_workers=0, epsg=4326):
+    if num_workers < 1:
+        num_workers = 4
+    with ThreadPoolExecutor(max_workers=min(num_workers, max(1, len(jobs)))) as executor:
+        futures = [executor.submit(writer, *job[:4], epsg=epsg, geom_type=job[4] if len(job) > 4 else "point") for job in jobs]
+        return [future.result() for future in futures]
+
+GPKG_TYPES = {"str": "TEXT", "int": "INTEGER", "real": "DOUBLE"}
+
+## Tables every GeoPackage has (version 1.2)
+GPKG_TABLES = """
+CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER NOT NULL PRIMARY KEY, organization TEXT NOT NULL,
+    organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+    description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+    min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+    CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id));
+CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+    CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+    CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+    CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id));
+CREATE TABLE gpkg_extensions (table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, definition TEXT NOT NULL,
+    scope TEXT NOT NULL, CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name));
+INSERT INTO gpkg_spatial_ref_sys VALUES ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system');
+INSERT INTO gpkg_spatial_ref_sys VALUES ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system');
+"""
+
+## Triggers that keep the R-tree up to date if the features are edited later (by
+## a GIS client, which provides the ST_ functions). {t} is the table name.
+GPKG_RTREE_TRIGGERS = """
+CREATE TRIGGER rtree_{t}_geom_insert AFTER INSERT ON {t} WHEN (new.geom NOT NULL AND NOT ST_IsEmpty(NEW.geom))
+BEGIN INSERT OR REPLACE INTO rtree_{t}_geom VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)); END;
+CREATE TRIGGER rtree_{t}_geom_update1 AFTER UPDATE OF geom ON {t} WHEN OLD.fid = NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom))
+BEGIN INSERT OR REPLACE INTO rtree_{t}_geom VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)); END;
+CREATE TRIGGER rtree_{t}_geom_update2 AFTER UPDATE OF geom ON {t} WHEN OLD.fid = NEW.fid AND (NEW.geom ISNULL OR ST_IsEmpty(NEW.geom))
+BEGIN DELETE FROM rtree_{t}_geom WHERE id = OLD.fid; END;
+CREATE TRIGGER rtree_{t}_geom_update3 AFTER UPDATE ON {t} WHEN OLD.fid != NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom))
+BEGIN DELETE FROM rtree_{t}_geom WHERE id = OLD.fid;
+INSERT OR REPLACE INTO rtree_{t}_geom VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)); END;
+CREATE TRIGGER rtree_{t}_geom_update4 AFTER UPDATE ON {t} WHEN OLD.fid != NEW.fid AND (NEW.geom ISNULL OR ST_IsEmpty(NEW.geom))
+BEGIN DELETE FROM rtree_{t}_geom WHERE id IN (OLD.fid, NEW.fid); END;
+CREATE TRIGGER rtree_{t}_geom_delete AFTER DELETE ON {t} WHEN old.geom NOT NULL
+BEGIN DELETE FROM rtree_{t}_geom WHERE id = OLD.fid; END;
+"""
+
+## Construct a single point layer with all the flights, adding the flight
+## (subdirectory name) and a flight_id (1, 2, ...) so they can be filtered
+def flights_point_layer(imgs, flights, add_yaw=True, dup_of=None):
+    layers = [point_layer(imgs, flight_info[0], add_yaw, dup_of) for flight_info in flights]
+    return join_point_layers([flight_info[1] for flight_info in flights], layers, point_fields(imgs, add_yaw, dup_of))
+
+## Join the point layers of each flight (from point_layer, with the given fields)
+## into one, as flights_point_layer
+def join_point_layers(names, layers, flt_fields):
+    fields = [("flight", "str", 254), ("flight_id", "int", 0)]
+    records = []
+    xs = []
+    ys = []
+    for i, (name, (fields_i, flt_records, (flt_xs, flt_ys))) in enumerate(zip(names, layers)):
+        prefix = (name, i + 1)
+        records.extend(prefix + rec for rec in flt_records)
+        xs.append(flt_xs)
+        ys.append(flt_ys)
+    return fields + flt_fields, records, (np.concatenate(xs) if xs else np.zeros(0), np.concatenate(ys) if ys else np.zeros(0))
+
+## GeoPackage geometry blobs of a set of points (header with no envelope + little endian WKB)
+def gpkg_points(xs, ys, srs_id):
+    n = len(xs)
+    recs = np.zeros(n, dtype=[("magic", "S2"), ("version", "u1"), ("flags", "u1"), ("srs_id", "<i4"),
+                              ("byte_order", "u1"), ("type", "<u4"), ("x", "<f8"), ("y", "<f8")])
+    recs["magic"] = b"GP"
+    recs["flags"] = 1    # little endian, no envelope
+    recs["srs_id"] = srs_id
+    recs["byte_order"] = 1
+    recs["type"] = 1    # wkbPoint
+    recs["x"] = xs
+    recs["y"] = ys
+    buf = recs.tobytes()
+    size = recs.dtype.itemsize
+    return [buf[i:i + size] for i in range(0, len(buf), size)]
+
+## GeoPackage geometry blobs of lines or polygons (header with the envelope +
+## little endian WKB). Outer rings are written counter-clockwise and holes
+## clockwise.
+def gpkg_shapes(shapes, geom_type, srs_id):
+    blobs = []
+    for shape in shapes:
+        if geom_type == "polygon":
+            rings = [np.ascontiguousarray(oriented_ring(np.asarray(ring, dtype="<f8"), k > 0), dtype="<f8")
+                     for k, ring in enumerate(polygon_rings(shape))]
+            wkb = struct.pack("<BII", 1, 3, len(rings)) + b"".join(struct.pack("<I", len(ring)) + ring.tobytes() for ring in rings)
+            xy = rings[0]
+        else:
+            xy = np.ascontiguousarray(shape, dtype="<f8")
+            wkb = struct.pack("<BII", 1, 2, len(xy)) + xy.tobytes()
+        hdr = b"GP" + struct.pack("<BBi4d", 0, 3, srs_id, xy[:, 0].min(), xy[:, 0].max(), xy[:, 1].min(), xy[:, 1].max())
+        blobs.append(hdr + wkb)
+    return blobs
+
+## Bounding box of each feature: arrays of min x, max x, min y and max y
+def feature_bounds(geoms, geom_type):
+    if geom_type == "point":
+        xs, ys = [np.asarray(a, dtype=np.float64) for a in geoms]
+        return xs, xs, ys, ys
+    outers = [outer_vertices(shape) for shape in geoms]
+    bounds = np.array([(xy[:, 0].min(), xy[:, 0].max(), xy[:, 1].min(), xy[:, 1].max()) for xy in outers]).reshape(-1, 4)
+    return bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3]
+
+## Position of each point along a Hilbert curve (on a 2^order grid over the
+## bounding box). Nearby points get nearby positions.
+def hilbert_index(xs, ys, order=16):
+    side = (1 << order) - 1
+    x = ((xs - xs.min()) / max(xs.max() - xs.min(), 1e-12) * side).astype(np.int64)
+    y = ((ys - ys.min()) / max(ys.max() - ys.min(), 1e-12) * side).astype(np.int64)
+    d = np.zeros(len(x), dtype=np.int64)
+    s = 1 << (order - 1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant
+        flip = ~ry & rx
+        x = np.where(flip, side - x, x)
+        y = np.where(flip, side - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s = s >> 1
+    return d
+
+## Round float64 values down (or up) to the nearest float32, the way SQLite's
+## R-tree stores bounds
+def float32_down(vals):
+    f = vals.astype(np.float32)
+    return np.where(f > vals, np.nextafter(f, np.float32(-np.inf)), f)
+
+def float32_up(vals):
+    f = vals.astype(np.float32)
+    return np.where(f < vals, np.nextafter(f, np.float32(np.inf)), f)
+
+## Fill an empty SQLite R-tree (virtual table 'rtree') with the bounding boxes
+## of features all at once, writing the nodes into its shadow tables. The boxes
+## are sorted along a Hilbert curve (by their centers) and packed into full
+## nodes from the leaves up (a packed Hilbert R-tree), which is much faster
+## than inserting them one at a time and gives a tighter tree.
+def pack_rtree(conn, rtree, ids, minx, maxx, miny, maxy):
+    node_size = conn.execute("SELECT length(data) FROM " + rtree + "_node WHERE nodeno = 1").fetchone()[0]
+    per_node = (node_size - 4) // 24
+    order = np.argsort(hilbert_index((minx + maxx) / 2, (miny + maxy) / 2), kind="stable")
+
+    ## levels[0] are the features, levels[1] the bounding boxes of the leaves,
+    ## and so on up to the entries that fit in the root node
+    levels = [[ids[order], float32_down(minx[order]), float32_up(maxx[order]), float32_down(miny[order]), float32_up(maxy[order])]]
+    while len(levels[-1][1]) > per_node:
+        starts = np.arange(0, len(levels[-1][1]), per_node)
+        minx, maxx, miny, maxy = levels[-1][1:]
+        levels.append([None, np.minimum.reduceat(minx, starts), np.maximum.reduceat(maxx, starts),
+                       np.minimum.reduceat(miny, starts), np.maximum.reduceat(maxy, starts)])
+
+    ## Number the nodes from the root (1) down. The entries of each level above
+    ## the leaves are the nodes holding the level below.
+    depth = len(levels) - 1
+    num_nodes = [(len(level[1]) + per_node - 1) // per_node for level in levels]
+    first_node = [0] * len(levels)
+    first_node[depth] = 1
+    for lev in range(depth, 0, -1):
+        first_node[lev - 1] = first_node[lev] + num_nodes[lev]
+    node_nums = [np.arange(first_node[lev], first_node[lev] + num_nodes[lev]) for lev in range(len(levels))]
+
+    cell = np.dtype([("id", ">i8"), ("minx", ">f4"), ("maxx", ">f4"), ("miny", ">f4"), ("maxy", ">f4")])
+    nodes = []
+    parents = []
+    for lev in range(len(levels)):
+        cells = np.zeros(len(levels[lev][1]), dtype=cell)
+        cells["id"] = levels[lev][0] if lev == 0 else node_nums[lev - 1]
+        for fld, vals in zip(("minx", "maxx", "miny", "maxy"), levels[lev][1:]):
+            cells[fld] = vals
+        for k in range(num_nodes[lev]):
+            data = cells[k * per_node:(k + 1) * per_node]
+            hdr = np.array([depth if lev == depth else 0, len(data)], dtype=">u2").tobytes()
+            nodes.append((int(node_nums[lev][k]), (hdr + data.tobytes()).ljust(node_size, b"\x00")))
+        if lev < depth:
+            parents.extend(zip(node_nums[lev].tolist(), node_nums[lev + 1][np.arange(num_nodes[lev]) // per_node].tolist()))
+    leaf_nums = node_nums[0][np.arange(len(ids)) // per_node]
+
+    conn.executemany("INSERT OR REPLACE INTO " + rtree + "_node (nodeno, data) VALUES (?, ?)", nodes)
+    conn.executemany("INSERT INTO " + rtree + "_parent (nodeno, parentnode) VALUES (?, ?)", parents)
+    conn.executemany("INSERT INTO " + rtree + "_rowid (rowid, nodeno) VALUES (?, ?)", zip(levels[0][0].tolist(), leaf_nums.tolist()))
+
+## GeoPackage geometry type names
+GPKG_GEOM_TYPES = {"point": "POINT", "line": "LINESTRING", "polygon": "POLYGON"}
+
+## Write one layer into an open GeoPackage, with an R-tree spatial index
+def gpkg_add_layer(conn, table, fields, records, geoms, srs_id, geom_type="point"):
+    if geom_type == "point":
+        xs, ys = [np.asarray(a, dtype=np.float64) for a in geoms]
+        blobs = gpkg_points(xs, ys, srs_id)
+    else:
+        blobs = gpkg_shapes(geoms, geom_type, srs_id)
+    cols = ", ".join('"' + name + '" ' + GPKG_TYPES[kind] for name, kind, width in fields)
+    conn.execute('CREATE TABLE "' + table + '" (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, geom ' + GPKG_GEOM_TYPES[geom_type] + ", " + cols + ")")
+    sql = 'INSERT INTO "' + table + '" VALUES (?, ?' + ", ?" * len(fields) + ")"
+    conn.executemany(sql, ((k + 1, blob) + records[k] for k, blob in enumerate(blobs)))
+
+    minx, maxx, miny, maxy = feature_bounds(geoms, geom_type)
+    ok = ~(np.isnan(minx) | np.isnan(miny))
+    bbox = (minx[ok].min(), miny[ok].min(), maxx[ok].max(), maxy[ok].max()) if ok.any() else (None, None, None, None)
+    conn.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, max_y, srs_id) VALUES (?, 'features', ?, ?, ?, ?, ?, ?)",
+                 (table, table) + tuple(None if v is None else float(v) for v in bbox) + (srs_id,))
+    conn.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', ?, ?, 0, 0)", (table, GPKG_GEOM_TYPES[geom_type], srs_id))
+
+    ## Spatial index (skipped if this SQLite was built without the R-tree module)
+    rtree = "rtree_" + table + "_geom"
+    try:
+        conn.execute("CREATE VIRTUAL TABLE " + rtree + " USING rtree(id, minx, maxx, miny, maxy)")
+    except sqlite3.OperationalError:
+        rtree = None
+    if rtree is not None:
+        fids = np.flatnonzero(ok)
+        if len(fids) > 0:
+            pack_rtree(conn, rtree, fids + 1, minx[fids], maxx[fids], miny[fids], maxy[fids])
+        for sql in GPKG_RTREE_TRIGGERS.replace("{t}", table).split("END;")[:-1]:
+            conn.execute(sql + "END;")
+        conn.execute("INSERT INTO gpkg_extensions VALUES (?, 'geom', 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')", (table,))
+
+    ## Attribute index on the flight id
+    if "flight_id" in [name for name, kind, width in fields]:
+        conn.execute('CREATE INDEX "' + table + '_flight_id" ON "' + table + '" (flight_id)')
+
+## Write layers into a new GeoPackage (any existing file is replaced). layers is
+## a list of (table, fields, records, geoms), with the geometry type as an
+## optional fifth element (as for write_layers).
+def write_gpkg(fnGpkg, layers, epsg=4326):
+    for ext in ("", "-journal", "-wal", "-shm"):
+        if os.path.exists(fnGpkg + ext):
+            os.remove(fnGpkg + ext)
+    conn = sqlite3.connect(fnGpkg)
+    try:
+        conn.execute("PRAGMA application_id = 1196444487")    # 'GPKG'
+        conn.execute("PRAGMA user_version = 10200")
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.executescript(GPKG_TABLES)
+        ## WGS 84 must always be defined, along with the two undefined systems
+        for srs in sorted(set([projection.WGS84, epsg])):
+            definition = projection.srs_wkt(srs)
+            if definition is not None:
+                conn.execute("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, 'EPSG', ?, ?, NULL)", (projection.srs_name(srs), srs, srs, definition))
+        definition = projection.srs_wkt(epsg)
+        srs_id = epsg if definition is not None else 0
+        with conn:
+            for layer in layers:
+                gpkg_add_layer(conn, *layer[:4], srs_id=srs_id, geom_type=layer[4] if len(layer) > 4 else "point")
+    finally:
+        conn.close()
+    return fnGpkg
@@ -0,0 +1,29 @@
+## Tests of batch mode (batch-uav-imgs.py)
+
+import os, importlib.util
+
+fnScript = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "batch-uav-imgs.py")
+spec = importlib.util.spec_from_file_location("batch_uav_imgs", fnScript)
+batch = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(batch)
+
+TEMPLATE = "Flt{FltNum}_{StartTime}_{EndTime}"
+
+def make_dirs(root, dirs):
+    for d in dirs:
+        fnDir = os.path.join(root, *d.split("/"))
+        os.makedirs(fnDir)
+        with open(os.path.join(fnDir, "DJI_0001.JPG"), "wb") as f:
+            f.write(b"\xff\xd8")
+
+def test_find_folders_skips_flights(tmp_path):
+    root = str(tmp_path)
+    make_dirs(root, ["A", "A/Flt01_0930_1015", "A/Flt02_1030_1050/rgb", "A/Flight notes", "B", "B/Flt3", "B/Flt04_1100_1130x"])
+    expected = ["A", "A/Flight notes", "B", "B/Flt04_1100_1130x", "B/Flt3"]
+    folders = batch.find_folders([os.path.join(root, "A"), os.path.join(root, "B")], True, TEMPLATE)
+    assert [os.path.relpath(fn, root).replace(os.sep, "/") for fn in folders] == expected
+    folders = batch.find_folders([os.path.join(root, "**")], False, TEMPLATE)
+    assert sorted(os.path.relpath(fn, root).replace(os.sep, "/") for fn in folders) == ["."] + expected
+
+    ## Without a template every folder with images is found
+    assert len(batch.find_folders([root], True)) == 7
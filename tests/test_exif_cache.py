@@ -0,0 +1,124 @@
+## Tests of the header cache
+
+import os, sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import exif_cache
+
+def make_files(dirname, names):
+    os.makedirs(dirname, exist_ok=True)
+    fns = []
+    for name in names:
+        fn = os.path.join(dirname, name)
+        with open(fn, "wb") as f:
+            f.write(name.encode())
+        fns.append(fn)
+    return fns
+
+def test_lookup_round_trip(tmp_path):
+    fns = make_files(str(tmp_path), ["a.JPG", "b.JPG"])
+    cache = exif_cache.ExifCache(str(tmp_path))
+    cache.store([{"SourceFile": fns[0], "FileName": "a.JPG", "DateTimeOriginal": "2017:08:18 09:00:00"}])
+    cache.close()
+    cache = exif_cache.ExifCache(str(tmp_path))
+    rows, misses = cache.lookup(fns, ["DateTimeOriginal"])
+    assert [row["FileName"] for row in rows] == ["a.JPG"]
+    assert rows[0]["DateTimeOriginal"] == "2017:08:18 09:00:00"
+    assert misses == [fns[1]]
+    ## A cached entry without all the tags is a miss
+    rows, misses = cache.lookup(fns[:1], ["DateTimeOriginal", "GPSLatitude"])
+    assert rows == [] and misses == fns[:1]
+    cache.close()
+
+def test_missing_file_is_a_miss(tmp_path):
+    fns = make_files(str(tmp_path), ["a.JPG", "b.JPG"])
+    cache = exif_cache.ExifCache(str(tmp_path))
+    cache.store([{"SourceFile": fn, "FileName": os.path.basename(fn), "DateTimeOriginal": "2017:08:18 09:00:00"} for fn in fns])
+    ## Deleted (or moved away) after it was listed
+    os.remove(fns[0])
+    rows, misses = cache.lookup(fns, ["DateTimeOriginal"])
+    assert [row["FileName"] for row in rows] == ["b.JPG"] and misses == fns[:1]
+    cache.close()
+
+def test_modified_file_is_a_miss(tmp_path):
+    fns = make_files(str(tmp_path), ["a.JPG"])
+    cache = exif_cache.ExifCache(str(tmp_path))
+    cache.put(fns[0], {"DateTimeOriginal": "x"})
+    with open(fns[0], "ab") as f:
+        f.write(b"more")
+    assert cache.lookup(fns, ["DateTimeOriginal"]) == ([], fns)
+    cache.close()
+
+def test_moved_and_subfolder(tmp_path):
+    fns = make_files(str(tmp_path), ["a.JPG"])
+    cache = exif_cache.ExifCache(str(tmp_path))
+    cache.put(fns[0], {"DateTimeOriginal": "x"})
+    fnDest = os.path.join(str(tmp_path), "Flt01", "a.JPG")
+    os.makedirs(os.path.dirname(fnDest))
+    os.rename(fns[0], fnDest)
+    cache.moved(fns[0], fnDest)
+    cache.close()
+    ## A run on the flight subdirectory uses the cache of its parent
+    cache = exif_cache.ExifCache(os.path.dirname(fnDest))
+    assert cache.root == str(tmp_path)
+    rows, misses = cache.lookup([fnDest], ["DateTimeOriginal"])
+    assert len(rows) == 1 and misses == []
+    cache.close()
+
+def fill_cache(args):
+    dirname, fns = args
+    cache = exif_cache.ExifCache(dirname)
+    for fn in fns:
+        cache.put(fn, {"DateTimeOriginal": os.path.basename(fn)})
+    cache.close()
+    return cache.db is None
+
+def test_parallel_writers(tmp_path):
+    ## A folder and its subfolders use the same cache from several processes at once
+    root = str(tmp_path)
+    make_files(root, [])
+    sqlite3.connect(os.path.join(root, exif_cache.fnCache)).close()
+    jobs = []
+    for k in range(4):
+        dirname = os.path.join(root, "sub%d" % k)
+        jobs.append((dirname, make_files(dirname, ["IMG_%04d.JPG" % i for i in range(600)])))
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        assert all(pool.map(fill_cache, jobs))
+    cache = exif_cache.ExifCache(root)
+    for dirname, fns in jobs:
+        rows, misses = cache.lookup(fns, ["DateTimeOriginal"])
+        assert misses == []
+    cache.close()
+
+def test_locked_cache_is_turned_off(tmp_path, monkeypatch):
+    ## Another process holding the write lock for too long turns the cache off
+    ## instead of raising
+    monkeypatch.setattr(exif_cache, "LOCK_TIMEOUT", 0.1)
+    monkeypatch.setattr(exif_cache, "COMMIT_EVERY", 1)
+    fns = make_files(str(tmp_path), ["a.JPG"])
+    cache = exif_cache.ExifCache(str(tmp_path))
+    other = sqlite3.connect(cache.fn)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        cache.put(fns[0], {"DateTimeOriginal": "x"})
+        cache.commit()
+    finally:
+        other.rollback()
+        other.close()
+    assert cache.db is None
+    cache.close()
+
+def test_lookup_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(exif_cache, "LOOKUP_CHUNK", 3)
+    fns = make_files(str(tmp_path), ["IMG_%02d.JPG" % i for i in range(10)])
+    cache = exif_cache.ExifCache(str(tmp_path))
+    cache.store([{"SourceFile": fn, "FileName": os.path.basename(fn), "DateTimeOriginal": str(i)} for i, fn in enumerate(fns) if i % 4 != 1])
+    cache.close()
+    ## Entries written by another process after the cache was opened are found too
+    cache = exif_cache.ExifCache(str(tmp_path))
+    other = exif_cache.ExifCache(str(tmp_path))
+    other.store([{"SourceFile": fns[1], "FileName": "IMG_01.JPG", "DateTimeOriginal": "1"}])
+    other.close()
+    rows, misses = cache.lookup(fns, ["DateTimeOriginal"])
+    assert [row["DateTimeOriginal"] for row in rows] == [str(i) for i in range(10) if i not in (5, 9)]
+    assert misses == [fns[5], fns[9]]
+    cache.close()
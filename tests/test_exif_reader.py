@@ -0,0 +1,63 @@
+## Tests of the built-in header reader, on images from make_synthetic_imgs.py
+
+import os
+from datetime import datetime
+import pytest
+import exif_reader, uav_pipeline, make_synthetic_imgs
+
+TAGS = uav_pipeline.tag_list(True)
+
+def write(tmp_path, fn, data):
+    fn = os.path.join(str(tmp_path), fn)
+    with open(fn, "wb") as f:
+        f.write(data)
+    return fn
+
+@pytest.mark.parametrize("kind", ["jpg", "tif_le", "tif_be"])
+def test_round_trip(tmp_path, kind):
+    dt = datetime(2017, 8, 18, 9, 30, 15)
+    if kind == "jpg":
+        data = make_synthetic_imgs.make_jpeg(dt, 38.5123, -122.3456, 161.25, 92.5, -88.0, 61.25, "SN123", 32 * 1024)
+        fn = write(tmp_path, "a.JPG", data)
+    else:
+        data = make_synthetic_imgs.make_tiff(dt, -38.5123, 122.3456, 161.25, 92.5, -88.0, 61.25, "SN123", 4096,
+                                             "<" if kind == "tif_le" else ">")
+        fn = write(tmp_path, "a.TIF", data)
+    row = exif_reader.read_row(fn, TAGS)
+    lat, lon = (38.5123, -122.3456) if kind == "jpg" else (-38.5123, 122.3456)
+    assert row["DateTimeOriginal"] == "2017:08:18 09:30:15"
+    assert float(row["GPSLatitude"]) == pytest.approx(lat, abs=1e-6)
+    assert float(row["GPSLongitude"]) == pytest.approx(lon, abs=1e-6)
+    assert float(row["GPSAltitude"]) == pytest.approx(161.25, abs=1e-3)
+    assert float(row["FlightYawDegree"]) == pytest.approx(92.5)
+    assert float(row["GimbalYawDegree"]) == pytest.approx(-88.0)
+    assert float(row["RelativeAltitude"]) == pytest.approx(61.25)
+    assert row["SerialNumber"] == "SN123"
+    camera = make_synthetic_imgs.CAMERA_JPG if kind == "jpg" else make_synthetic_imgs.CAMERA_TIF
+    assert (row["Make"], row["Model"]) == camera[:2]
+    assert float(row["FocalLength"]) == pytest.approx(camera[2])
+    assert int(row["FocalLengthIn35mmFormat"]) == camera[3]
+    assert (int(row["ExifImageWidth"]), int(row["ExifImageHeight"])) == camera[4:6]
+
+def test_synthetic_folder(tmp_path):
+    numFiles, totalBytes = make_synthetic_imgs.make_images(str(tmp_path), 30, 3, tifEvery=5, headerKB=8)
+    fns = exif_reader.list_images(str(tmp_path))
+    assert len(fns) == numFiles == 30
+    rows = [row for row, fn in exif_reader.iter_files(fns, TAGS, uav_pipeline.required_flds)]
+    assert all(row is not None for row in rows)
+    assert sum(1 for row in rows if row["FileName"].endswith(".TIF")) == 6
+    ## Every row parses into image records
+    for row in rows:
+        uav_pipeline.parse_row(row)
+
+def test_corrupt_segment_length(tmp_path):
+    ## An APP1 length below 2 must not be read as a huge (negative) segment
+    fn = write(tmp_path, "bad.JPG", b"\xff\xd8\xff\xe1\x00\x01" + b"x" * 100)
+    with pytest.raises(exif_reader.ExifReadError):
+        exif_reader.read_tags(fn, TAGS)
+    assert list(exif_reader.iter_files([fn], TAGS)) == [(None, fn)]
+
+def test_not_an_image(tmp_path):
+    fn = write(tmp_path, "text.JPG", b"hello world")
+    with pytest.raises(exif_reader.ExifReadError):
+        exif_reader.read_tags(fn, TAGS)
@@ -0,0 +1,43 @@
+## Tests of the out-of-core sort of image records
+
+import numpy as np
+import pytest
+import external_sort, flight_groups, img_records
+
+@pytest.mark.parametrize("seed", range(5))
+def test_interval_counts_median(seed):
+    rng = np.random.RandomState(seed)
+    ts = np.cumsum(rng.choice([0, 1, 2, 2, 3, 5, 900], size=rng.randint(2, 3000)))
+    intervals = external_sort.IntervalCounts()
+    for t in ts.tolist():
+        intervals.add(t)
+    diffs = np.diff(ts)
+    assert intervals.median() == np.median(diffs[diffs != 0])
+    assert intervals.median() == flight_groups.median_interval(flight_groups.time_diffs(ts))
+
+def test_interval_counts_empty():
+    intervals = external_sort.IntervalCounts()
+    assert intervals.median() is None
+    for t in [5, 5, 5]:
+        intervals.add(t)
+    assert intervals.median() is None
+
+def test_merged_runs_in_time_order(tmp_path):
+    rng = np.random.RandomState(0)
+    ts = rng.randint(0, 500, 1000)
+    runs = external_sort.RecordRuns(run_size=64, tmpdir=str(tmp_path))
+    for i, t in enumerate(ts.tolist()):
+        runs.add("IMG_%04d.JPG" % i, t, -122.0 + i * 1e-5, 38.0, make="DJI" if i % 3 else "MicaSense")
+    try:
+        merged = list(runs.merged())
+        assert len(runs) == len(merged) == len(ts) and len(runs.runs) == 16
+        ## Sorted by time, then file name, the same as ImageRecords.sort_by_time
+        imgs = img_records.ImageRecords()
+        for i, t in enumerate(ts.tolist()):
+            imgs.append("IMG_%04d.JPG" % i, t, -122.0 + i * 1e-5, 38.0, make="DJI" if i % 3 else "MicaSense")
+        imgs.sort_by_time()
+        assert [rec[0] for rec in merged] == imgs.fns()
+        assert [rec[-3] for rec in merged] == [imgs.values["make"][code] for code in imgs.make.tolist()]
+        assert [rec[2] for rec in merged] == imgs.lon.tolist()
+    finally:
+        runs.close()
@@ -0,0 +1,108 @@
+## Tests of the flight lines and hulls, against simple reference versions
+
+import math
+import numpy as np
+import pytest
+import flight_geom
+
+## Douglas-Peucker the usual way, one segment at a time (keeps the first of
+## equally far vertices)
+def reference_dp(x, y, tolerance):
+    keep = set([0, len(x) - 1])
+    def dist(i, a, b):
+        dx = x[b] - x[a]
+        dy = y[b] - y[a]
+        len2 = dx * dx + dy * dy
+        t = 0.0 if len2 == 0 else min(max(((x[i] - x[a]) * dx + (y[i] - y[a]) * dy) / len2, 0.0), 1.0)
+        return math.hypot(x[i] - (x[a] + t * dx), y[i] - (y[a] + t * dy))
+    def split(a, b):
+        if b - a < 2:
+            return
+        d = [dist(i, a, b) for i in range(a + 1, b)]
+        i = a + 1 + d.index(max(d))
+        if d[i - a - 1] > tolerance:
+            keep.add(i)
+            split(a, i)
+            split(i, b)
+    split(0, len(x) - 1)
+    return sorted(keep)
+
+## A lawnmower pattern with GPS noise, some hovering (repeated points) and a
+## line that comes back on itself
+def flight_path(seed, n):
+    rng = np.random.RandomState(seed)
+    i = np.arange(n)
+    line = i // 50
+    pos = np.where(line % 2 == 0, i % 50, 49 - i % 50)
+    x = line * 30.0 + rng.normal(0, 0.6, n)
+    y = pos * 8.0 + rng.normal(0, 0.6, n)
+    x[100:110] = x[100]
+    y[100:110] = y[100]
+    x[200:] = x[200:][::-1]
+    return x, y
+
+@pytest.mark.parametrize("seed", range(4))
+def test_simplify_dp(seed):
+    x, y = flight_path(seed, 400)
+    for tolerance in (0.5, 1.0, 5.0, 50.0):
+        keep = flight_geom.simplify_dp(x, y, tolerance)
+        assert keep.tolist() == reference_dp(x.tolist(), y.tolist(), tolerance)
+
+def test_simplify_dp_short_lines():
+    assert flight_geom.simplify_dp(np.array([0.0, 1.0]), np.array([0.0, 1.0]), 1.0).tolist() == [0, 1]
+    x = np.array([0.0, 1.0, 2.0, 3.0])
+    y = np.array([0.0, 0.5, -0.5, 0.0])
+    assert flight_geom.simplify_dp(x, y, 0).tolist() == [0, 1, 2, 3]
+    assert flight_geom.simplify_dp(x, y, 0.6).tolist() == [0, 3]
+    ## A closed loop (the first and last vertices are the same)
+    x = np.array([0.0, 10.0, 10.0, 0.0, 0.0])
+    y = np.array([0.0, 0.0, 10.0, 10.0, 0.0])
+    assert flight_geom.simplify_dp(x, y, 1.0).tolist() == reference_dp(x.tolist(), y.tolist(), 1.0)
+
+## The edges of the convex hull by brute force: i -> j is a (counter-clockwise)
+## hull edge if no point is to its right, and the points on its line are between
+## i and j. Returns the next vertex of each vertex (as coordinates).
+def brute_force_hull(x, y):
+    pts = sorted(set(zip(x.tolist(), y.tolist())))
+    px = np.array([p[0] for p in pts])
+    py = np.array([p[1] for p in pts])
+    following = {}
+    for i in range(len(pts)):
+        for j in range(len(pts)):
+            if i == j:
+                continue
+            dx = px[j] - px[i]
+            dy = py[j] - py[i]
+            cross = dx * (py - py[i]) - dy * (px - px[i])
+            t = (px - px[i]) * dx + (py - py[i]) * dy
+            if (cross >= 0).all() and ((cross > 0) | ((t >= 0) & (t <= dx * dx + dy * dy))).all():
+                following[pts[i]] = pts[j]
+    return following
+
+@pytest.mark.parametrize("seed", range(5))
+def test_convex_hull(seed):
+    rng = np.random.RandomState(seed)
+    ## Points on a small integer lattice, so many are collinear or repeated
+    for n, size in ((5, 3), (40, 6), (120, 20), (120, 1000)):
+        x = rng.randint(0, size, n).astype(np.float64)
+        y = rng.randint(0, size, n).astype(np.float64)
+        hull = flight_geom.convex_hull(x, y)
+        expected = brute_force_hull(x, y)
+        vertices = list(zip(x[hull].tolist(), y[hull].tolist()))
+        if len(expected) < 3:
+            continue
+        assert len(vertices) == len(expected)
+        assert all(expected[vertices[k - 1]] == vertices[k] for k in range(len(vertices)))
+        assert flight_geom.polygon_area(x[hull], y[hull]) > 0
+
+def test_convex_hull_degenerate():
+    x = np.array([0.0, 1.0, 2.0, 3.0])
+    assert sorted(flight_geom.convex_hull(x, x * 2).tolist()) == [0, 3]
+    assert flight_geom.flight_hull(np.ones(5), np.ones(5), np.arange(5), metric=True) is None
+    assert flight_geom.flight_hull(x, x * 2, np.arange(4), metric=True) is None
+    ## A square with points on its edges and inside
+    x = np.array([0.0, 5.0, 10.0, 10.0, 10.0, 0.0, 3.0, 0.0])
+    y = np.array([0.0, 0.0, 0.0, 4.0, 10.0, 10.0, 3.0, 5.0])
+    assert flight_geom.convex_hull(x, y).tolist() == [0, 2, 4, 5]
+    xy, area = flight_geom.flight_hull(x, y, np.arange(len(x)), metric=True)
+    assert area == 100.0
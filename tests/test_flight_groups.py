@@ -0,0 +1,175 @@
+## Tests of splitting images into flights, against the loop in the original
+## version of parse-uav-imgs.py
+
+import os
+import numpy as np
+import pytest
+import flight_groups, img_records
+
+TEMPLATE = "Flt{FltNum}_{StartTime}_{EndTime}"
+
+## The original loop (with datetimes replaced by epoch seconds)
+def baseline_flights(ts, fns, thresh_abs, first_num=1, divide_tif_jpg=False):
+    timediffs = [0] + [ts[i] - ts[i - 1] for i in range(1, len(ts))]
+    hhmm = lambda t: img_records.to_datetime(t).strftime("%H%M")
+    flights = []
+    start_idx = 0
+    cur_flight_num = 0
+    for i in range(len(ts)):
+        if i == (len(ts) - 1) or timediffs[i] >= thresh_abs:
+            end_idx = i - 1 if timediffs[i] >= thresh_abs else i
+            subdir = TEMPLATE.replace("{FltNum}", "%02d" % (cur_flight_num + first_num))
+            subdir = subdir.replace("{StartTime}", hhmm(ts[start_idx])).replace("{EndTime}", hhmm(ts[end_idx]))
+            if divide_tif_jpg:
+                tif_idx = [j for j in range(start_idx, end_idx + 1) if fns[j].lower().endswith(".tif")]
+                if len(tif_idx) > 0:
+                    flights.append([tif_idx, os.path.join(subdir, "mss")])
+                jpg_idx = [j for j in range(start_idx, end_idx + 1) if fns[j].lower().endswith(".jpg")]
+                if len(jpg_idx) > 0:
+                    flights.append([jpg_idx, os.path.join(subdir, "rgb")])
+            else:
+                flights.append([list(range(start_idx, end_idx + 1)), subdir])
+            cur_flight_num = cur_flight_num + 1
+            start_idx = i
+    return flights
+
+## Images every 1-3 seconds in flights separated by 10-30 minutes, every 5th a TIF
+def sample(seed, num_flights=6):
+    rng = np.random.RandomState(seed)
+    ts = []
+    t = img_records.parse_datetime("2017:08:18 09:00:00")
+    for k in range(num_flights):
+        for i in range(rng.randint(5, 200)):
+            ts.append(t)
+            t = t + int(rng.randint(1, 4))
+        t = t + int(rng.randint(600, 1800))
+    ts = np.array(ts, dtype=np.int64)
+    fns = ["IMG_%04d.TIF" % i if i % 5 == 4 else "DJI_%04d.JPG" % i for i in range(len(ts))]
+    return ts, fns
+
+def as_lists(flights):
+    return [[list(np.asarray(idx).tolist()), name] for idx, name in flights]
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("divide", [False, True])
+def test_same_as_baseline(seed, divide):
+    ts, fns = sample(seed)
+    flights = flight_groups.make_flights(ts, fns, 60, TEMPLATE, 1, divide)
+    assert as_lists(flights) == baseline_flights(ts, fns, 60, 1, divide)
+
+def test_first_num_and_threshold():
+    ts, fns = sample(1)
+    ## Every gap of 3 seconds or more starts a flight
+    flights = flight_groups.make_flights(ts, fns, 3, TEMPLATE, 7)
+    assert as_lists(flights) == baseline_flights(ts, fns, 3, 7)
+    assert flights[0][1].startswith("Flt07_")
+
+def test_last_image_after_a_gap():
+    ## The original loop left out the last image if it followed a gap; it now
+    ## gets a flight of its own
+    ts = np.array([0, 2, 4, 6, 1000], dtype=np.int64)
+    fns = ["DJI_%04d.JPG" % i for i in range(5)]
+    flights = flight_groups.make_flights(ts, fns, 60, TEMPLATE, 1)
+    assert [idx.tolist() for idx, name in flights] == [[0, 1, 2, 3], [4]]
+    assert [idx for idx, name in baseline_flights(ts, fns, 60)] == [[0, 1, 2, 3]]
+
+def test_median_interval():
+    ts = np.array([0, 2, 2, 5, 7, 100], dtype=np.int64)
+    diffs = flight_groups.time_diffs(ts)
+    assert diffs.tolist() == [0, 2, 0, 3, 2, 93]
+    ## Zeros (the first element, images in the same second) are left out
+    assert flight_groups.median_interval(diffs) == 2.5
+    assert flight_groups.median_interval(flight_groups.time_diffs(np.array([5], dtype=np.int64))) is None
+
+def test_num_flights():
+    ts, fns = sample(2)
+    gaps = flight_groups.sorted_gaps(flight_groups.time_diffs(ts))
+    for thresh in [2, 3, 60, 700, 5000]:
+        assert flight_groups.num_flights(gaps, thresh) == len(flight_groups.make_flights(ts, fns, thresh, TEMPLATE, 1))
+
+def test_knee_threshold():
+    ## The knee falls between the intervals within the flights and the gaps between them
+    ts, fns = sample(2)
+    diffs = flight_groups.time_diffs(ts)
+    gaps = flight_groups.sorted_gaps(diffs)
+    thresh, below, above = flight_groups.knee_threshold(gaps, flight_groups.median_interval(diffs))
+    assert below == 3 and above == gaps[gaps > 3].min() and below < thresh < above
+    assert flight_groups.num_flights(gaps, thresh) == 6
+
+    ## A jump of KNEE_MIN_RATIO is a knee, a smaller one isn't
+    ratio = flight_groups.KNEE_MIN_RATIO
+    assert flight_groups.knee_threshold(np.array([2.0, 2.0, 2.0 * ratio]), 2.0) == pytest.approx((2.0 * np.sqrt(ratio), 2.0, 2.0 * ratio))
+    assert flight_groups.knee_threshold(np.array([2.0, 2.0, 2.0 * ratio - 0.01]), 2.0) is None
+    ## Gaps shorter than the median are left out
+    assert flight_groups.knee_threshold(np.array([0.1, 2.0, 2.0, 2.5]), 2.0) is None
+
+def test_knee_threshold_one_flight():
+    ## No gaps at all (one image), or a single flight
+    assert flight_groups.knee_threshold(np.array([], dtype=np.int64), None) is None
+    assert flight_groups.knee_threshold(np.array([], dtype=np.int64), 2.0) is None
+    ts, fns = sample(3, num_flights=1)
+    diffs = flight_groups.time_diffs(ts)
+    assert flight_groups.knee_threshold(flight_groups.sorted_gaps(diffs), flight_groups.median_interval(diffs)) is None
+
+def test_interleaved_streams():
+    ## Two cameras taking images at once: split by stream, the gaps of each are
+    ## found separately and the pieces that overlap are merged into one flight
+    a = np.arange(0, 200, 10)
+    b = np.arange(3, 200, 10)
+    later = np.arange(2000, 2100, 10)
+    ts = np.concatenate((a, b, later))
+    streams = np.concatenate((np.zeros(len(a)), np.ones(len(b)), np.zeros(len(later)))).astype(np.int64)
+    order = np.argsort(ts, kind="stable")
+    ts = ts[order]
+    streams = streams[order]
+    ## With one stream the 3 and 7 second intervals would split the images at a 5 second threshold
+    flight = flight_groups.flight_numbers(ts, streams, 15)
+    assert flight.tolist() == [0] * (len(a) + len(b)) + [1] * len(later)
+
+def test_counts_median():
+    rng = np.random.RandomState(3)
+    for n in [1, 2, 5, 50, 501]:
+        vals = rng.randint(1, 20, n)
+        counts = dict(zip(*np.unique(vals, return_counts=True)))
+        assert flight_groups.counts_median(counts) == np.median(vals)
+    assert flight_groups.counts_median({}) is None
+
+@pytest.mark.parametrize("seed", range(3))
+def test_collector_median_out_of_order(seed):
+    ## Images arriving in shuffled batches (e.g. cards copied out of order) give
+    ## the same threshold as the median of all the timestamps sorted
+    ts, fns = sample(seed)
+    rng = np.random.RandomState(seed)
+    order = rng.permutation(len(ts))
+    collector = flight_groups.FlightCollector(10, "multiple of median sampling interval")
+    assert collector.thresh_abs() is None
+    added = 0
+    for batch in np.array_split(order, 20):
+        collector.add([(fns[i], int(ts[i])) for i in batch])
+        added = added + len(batch)
+        seen = np.sort(ts[order[:added]])
+        expected = flight_groups.median_interval(flight_groups.time_diffs(seen))
+        assert collector.thresh_abs() == (None if expected is None else 10 * expected)
+
+def test_collector_closes_flights():
+    ts, fns = sample(4, num_flights=3)
+    collector = flight_groups.FlightCollector(60)
+    collector.add([(fns[i], int(ts[i])) for i in range(len(ts))])
+    flights = collector.close_flights()
+    expected = flight_groups.make_flights(ts, fns, 60, TEMPLATE, 1)
+    ## The last flight may still be growing
+    assert [[img[0] for img in flight] for flight in flights] == [[fns[i] for i in idx] for idx, name in expected[:-1]]
+    assert collector.pending() == len(expected[-1][0])
+    ## A late image within the threshold of a closed flight joins it
+    late = collector.add([("late.JPG", int(ts[expected[0][0][-1]]) + 30)])
+    assert late == [(("late.JPG", int(ts[expected[0][0][-1]]) + 30), 0)]
+    assert len(collector.close_flights(final=True)) == 1 and collector.pending() == 0
+
+def test_collector_add_closed():
+    ## A flight closed before a restart still takes late images, and its
+    ## images count towards the median interval
+    collector = flight_groups.FlightCollector(10, "multiple of median sampling interval")
+    collector.add_closed([100, 102, 104, 106])
+    assert collector.thresh_abs() == 20
+    assert collector.add([("late.JPG", 115), ("new.JPG", 500)]) == [(("late.JPG", 115), 0)]
+    assert collector.pending() == 1
@@ -0,0 +1,128 @@
+## Tests of the coverage grid, against point-in-polygon tests of every cell
+
+from collections import deque
+import numpy as np
+import pytest
+import footprints
+
+GRID = footprints.Grid(100.0, -50.0, 2.0, 30, 40)
+
+def cell_centers(grid):
+    rows, cols = np.mgrid[0:grid.nrows, 0:grid.ncols]
+    return grid.x0 + (cols + 0.5) * grid.cell, grid.y0 + (rows + 0.5) * grid.cell
+
+## Number of convex polygons covering each cell center, testing every center
+## against every polygon
+def brute_force_counts(polygons, grid):
+    xc, yc = cell_centers(grid)
+    counts = np.zeros(xc.shape, dtype=np.int32)
+    for xy in polygons:
+        sides = [(bx - ax) * (yc - ay) - (by - ay) * (xc - ax) for (ax, ay), (bx, by) in zip(xy, np.roll(xy, -1, axis=0))]
+        counts += np.all([s >= 0 for s in sides], axis=0) | np.all([s <= 0 for s in sides], axis=0)
+    return counts
+
+## Random rotated rectangles (like image footprints), some partly off the grid
+def rectangles(rng, n):
+    center = np.column_stack((rng.uniform(90, 190, n), rng.uniform(-60, 20, n)))
+    angle = rng.uniform(0, 2 * np.pi, n)
+    half = np.column_stack((rng.uniform(1, 15, n), rng.uniform(1, 10, n)))
+    corners = np.empty((n, 4, 2))
+    for k, (sx, sy) in enumerate(((-1, -1), (1, -1), (1, 1), (-1, 1))):
+        dx = sx * half[:, 0]
+        dy = sy * half[:, 1]
+        corners[:, k, 0] = center[:, 0] + dx * np.cos(angle) - dy * np.sin(angle)
+        corners[:, k, 1] = center[:, 1] + dx * np.sin(angle) + dy * np.cos(angle)
+    return corners
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rasterize_convex(seed):
+    rng = np.random.RandomState(seed)
+    corners = rectangles(rng, 50)
+    assert (footprints.rasterize_convex(corners, GRID) == brute_force_counts(corners, GRID)).all()
+    ## Clockwise polygons with different numbers of vertices (as a list)
+    polygons = []
+    for i in range(20):
+        cx, cy, r = rng.uniform(100, 180), rng.uniform(-50, 10), rng.uniform(2, 20)
+        a = -np.sort(rng.uniform(0, 2 * np.pi, rng.randint(3, 9)))
+        polygons.append(np.column_stack((cx + r * np.cos(a), cy + r * np.sin(a))))
+    assert (footprints.rasterize_convex(polygons, GRID) == brute_force_counts(polygons, GRID)).all()
+
+def test_rasterize_empty():
+    assert footprints.rasterize_convex([], GRID).sum() == 0
+    ## A polygon that falls between the cell centers
+    tiny = np.array([[[101.1, -49.9], [101.9, -49.9], [101.9, -49.1]]])
+    assert footprints.rasterize_convex(tiny, GRID).sum() == 0
+
+## Areas of the mask connected through cell sides, numbered in the order their
+## first cell is found going along the rows (flood fill)
+def flood_fill(mask):
+    labels = np.full(mask.shape, -1)
+    num = 0
+    for r0, c0 in zip(*np.nonzero(mask)):
+        if labels[r0, c0] >= 0:
+            continue
+        labels[r0, c0] = num
+        queue = deque([(r0, c0)])
+        while queue:
+            r, c = queue.popleft()
+            for rn, cn in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                if 0 <= rn < mask.shape[0] and 0 <= cn < mask.shape[1] and mask[rn, cn] and labels[rn, cn] < 0:
+                    labels[rn, cn] = num
+                    queue.append((rn, cn))
+        num += 1
+    return labels, num
+
+## Whether each point is inside the rings (even-odd rule)
+def inside_rings(rings, px, py):
+    inside = np.zeros(px.shape, dtype=bool)
+    for xy in rings:
+        for (ax, ay), (bx, by) in zip(xy, np.roll(xy, -1, axis=0)):
+            if ay != by:
+                crosses = ((ay > py) != (by > py)) & (px < ax + (py - ay) * (bx - ax) / (by - ay))
+                inside ^= crosses
+    return inside
+
+@pytest.mark.parametrize("seed", range(4))
+def test_polygonize(seed):
+    rng = np.random.RandomState(seed)
+    for p in (0.2, 0.5, 0.7):
+        mask = rng.uniform(size=(GRID.nrows, GRID.ncols)) < p
+        labels, num = flood_fill(mask)
+        polygons = footprints.polygonize(mask, GRID)
+
+        ## One polygon per area, with the area of its cells
+        assert len(polygons) == num
+        areas = [footprints.polygon_area(rings) for rings in polygons]
+        assert areas == [(labels == k).sum() * GRID.cell ** 2 for k in range(num)]
+        assert sum(areas) == mask.sum() * GRID.cell ** 2
+
+        ## Outer rings counter-clockwise, holes clockwise, and the cell centers
+        ## inside the rings are exactly the cells of the mask
+        assert all(footprints.ring_area(rings[0]) > 0 and all(footprints.ring_area(xy) < 0 for xy in rings[1:])
+                   for rings in polygons)
+        xc, yc = cell_centers(GRID)
+        assert (inside_rings([xy for rings in polygons for xy in rings], xc, yc) == mask).all()
+        for k, rings in enumerate(polygons):
+            assert (inside_rings(rings, xc, yc) == (labels == k)).all()
+
+@pytest.mark.parametrize("seed", range(4))
+def test_label_areas(seed):
+    rng = np.random.RandomState(seed)
+    mask = rng.uniform(size=(25, 35)) < 0.55
+    labels, num = flood_fill(mask)
+    rows, cols = np.nonzero(mask)
+    found = footprints.label_areas(mask)(rows, cols)
+    ## The same areas, whatever they're called
+    pairs = set(zip(found.tolist(), labels[rows, cols].tolist()))
+    assert len(pairs) == num == len(set(found.tolist()))
+
+def test_polygonize_hole_and_pinch():
+    mask = np.zeros((5, 6), dtype=bool)
+    mask[0:4, 0:4] = True
+    mask[1:3, 1:3] = False    # a 2 x 2 hole
+    mask[4, 4] = True          # only touches the square's corner
+    grid = footprints.Grid(0.0, 0.0, 1.0, 5, 6)
+    polygons = footprints.polygonize(mask, grid)
+    assert [len(rings) for rings in polygons] == [2, 1]
+    assert [footprints.polygon_area(rings) for rings in polygons] == [12.0, 1.0]
+    assert footprints.polygonize(np.zeros((3, 3), dtype=bool), grid) == []
@@ -0,0 +1,75 @@
+## Tests of the column-oriented image records
+
+import math
+import numpy as np
+import pytest
+import img_records
+
+def records():
+    imgs = img_records.ImageRecords()
+    imgs.append("b.JPG", 20, -122.1, 38.1, 90.0, 91.5, make="DJI", model="FC6310", serial="1")
+    imgs.append("a.TIF", 10, -122.2, 38.2, make="MicaSense", model="RedEdge-M", serial="2")
+    imgs.append("c.JPG", 10, -122.3, 38.3, -90.0, float("nan"), make="DJI", model="FC6310", serial="1")
+    return imgs.finish()
+
+def test_parse_datetime():
+    ts = img_records.parse_datetime("2017:08:18 09:30:15")
+    assert img_records.to_datetime(ts).strftime("%Y-%m-%d %H:%M:%S") == "2017-08-18 09:30:15"
+    assert img_records.date_time_strings([ts]) == (["2017:08:18"], ["09:30:15"])
+    with pytest.raises(ValueError):
+        img_records.parse_datetime("2017:08:18")
+    assert math.isnan(img_records.parse_float("")) and img_records.parse_float("1.5") == 1.5
+
+def test_columns():
+    imgs = records()
+    assert len(imgs) == 3
+    assert imgs.fns() == ["b.JPG", "a.TIF", "c.JPG"]
+    assert imgs.ts.dtype == np.int64 and imgs.lon.dtype == np.float64
+    assert math.isnan(imgs.yaw_flight[1])
+    ## The gimbal yaw, or the flight yaw if it's missing
+    assert imgs.yaw().tolist()[0] == 91.5 and imgs.yaw().tolist()[2] == -90.0
+    ## String columns are codes into the distinct values
+    assert imgs.make.tolist() == [0, 1, 0]
+    assert imgs.values["model"] == ["FC6310", "RedEdge-M"]
+
+def test_record_size():
+    imgs = records()
+    assert imgs.rel_alt.dtype == np.float32 and imgs.yaw_flight.dtype == np.float64
+    size = sum(getattr(imgs, col).nbytes for col in imgs.columns())
+    assert size == len(imgs) * img_records.RECORD_BYTES
+    assert len(imgs.names) == len("b.JPGa.TIFc.JPG")
+    ## The footprint columns keep their values (to float32 precision)
+    imgs = img_records.ImageRecords()
+    imgs.append("d.JPG", 0, -122.0, 38.0, gps_alt=161.25, rel_alt=61.3, focal=8.8, focal35=24.0, img_width=5472, img_height=3648)
+    imgs.finish()
+    assert imgs.rel_alt[0] == pytest.approx(61.3, rel=1e-7) and imgs.img_width[0] == 5472 and imgs.gps_alt[0] == 161.25
+
+def test_sort_is_stable():
+    imgs = records()
+    imgs.sort_by_time()
+    ## a.TIF and c.JPG were taken in the same second and keep the order they were added in
+    assert imgs.fns() == ["a.TIF", "c.JPG", "b.JPG"]
+    assert imgs.lat.tolist() == [38.2, 38.3, 38.1]
+    assert imgs.x is imgs.lon
+
+def test_take_and_rows():
+    imgs = records()
+    sub = imgs.take(np.array([2, 0]))
+    assert sub.fns() == ["c.JPG", "b.JPG"]
+    rows = list(sub.iter_rows())
+    assert rows[1][:5] == ("b.JPG", "1970:01:01", "00:00:20", -122.1, 38.1)
+
+def test_projected():
+    imgs = records()
+    imgs.set_xy([1.0, 2.0, 3.0], [4.0, 5.0, 6.0], 32610)
+    assert imgs.projected()
+    imgs.sort_by_time()
+    assert imgs.x.tolist() == [2.0, 3.0, 1.0]
+    assert imgs.lon.tolist() == [-122.2, -122.3, -122.1]
+
+def test_field_codes():
+    imgs = records()
+    codes, values = imgs.field_codes("ext")
+    assert values == ["jpg", "tif"] and codes.tolist() == [0, 1, 0]
+    codes, values = imgs.field_codes("serial")
+    assert [values[c] for c in codes] == ["1", "2", "1"]
@@ -0,0 +1,123 @@
+## Tests of moving and copying images into flight subdirectories
+
+import os, threading
+import pytest
+import place_files
+
+def make_jobs(tmp_path, n, sub="Flt01"):
+    jobs = []
+    for i in range(n):
+        fnSrc = os.path.join(str(tmp_path), "IMG_%04d.JPG" % i)
+        with open(fnSrc, "wb") as f:
+            f.write(os.urandom(1000 + i))
+        jobs.append((fnSrc, os.path.join(str(tmp_path), sub, "IMG_%04d.JPG" % i)))
+    return jobs
+
+def contents(fn):
+    with open(fn, "rb") as f:
+        return f.read()
+
+@pytest.mark.parametrize("mode", ["move", "copy"])
+def test_place(tmp_path, mode):
+    jobs = make_jobs(tmp_path, 20)
+    data = [contents(fnSrc) for fnSrc, fnDest in jobs]
+    placed = []
+    errors = place_files.place_files(jobs, mode, 4, "end", lambda fnSrc, fnDest: placed.append(fnDest), progressYN=False)
+    assert errors == []
+    assert sorted(placed) == sorted(fnDest for fnSrc, fnDest in jobs)
+    assert [contents(fnDest) for fnSrc, fnDest in jobs] == data
+    assert all(os.path.exists(fnSrc) == (mode == "copy") for fnSrc, fnDest in jobs)
+
+def test_verified_copy(tmp_path):
+    jobs = make_jobs(tmp_path, 5)
+    manifests = place_files.Manifests("blake2b")
+    assert place_files.place_files(jobs, "copy", 2, progressYN=False, manifests=manifests) == []
+    fnManifest = os.path.join(str(tmp_path), "Flt01", "manifest.blake2b")
+    with open(fnManifest) as f:
+        lines = sorted(f.read().splitlines())
+    assert lines == sorted(place_files.hash_file(fnDest) + "  " + os.path.basename(fnDest) for fnSrc, fnDest in jobs)
+
+def test_missing_source(tmp_path):
+    ## A missing file is reported as an error, and the others are still placed
+    jobs = make_jobs(tmp_path, 5)
+    os.remove(jobs[2][0])
+    journal = place_files.Journal(os.path.join(str(tmp_path), place_files.fnJournal))
+    errors = place_files.place_files(jobs, "move", 2, progressYN=False, journal=journal)
+    assert [(fnSrc, fnDest) for fnSrc, fnDest, e in errors] == [jobs[2]]
+    assert isinstance(errors[0][2], OSError)
+    assert all(os.path.exists(fnDest) for fnSrc, fnDest in jobs if fnSrc != jobs[2][0])
+    assert not os.path.exists(journal.fn)
+
+def test_failed_method_is_per_device(monkeypatch):
+    monkeypatch.setattr(place_files, "failed_methods", {})
+    monkeypatch.setattr(place_files, "UNAVAILABLE", set())
+    place_files.method_failed(1, "reflink")
+    assert not place_files.method_ok(1, "reflink")
+    assert place_files.method_ok(1, "copy_file_range")
+    assert place_files.method_ok(2, "reflink")
+
+## An interrupted run: the journal has the plan, and the first num_done jobs
+## were placed (the last of them without its journal line)
+def interrupted(tmp_path, mode, jobs, num_done):
+    journal = place_files.Journal(os.path.join(str(tmp_path), place_files.fnJournal))
+    sizes = [os.path.getsize(fnSrc) for fnSrc, fnDest in jobs]
+    journal.start(mode, jobs, sizes)
+    place_files.make_dirs(os.path.dirname(fnDest) for fnSrc, fnDest in jobs)
+    for k, (fnSrc, fnDest) in enumerate(jobs[:num_done]):
+        (place_files.move_file if mode == "move" else place_files.copy_file)(fnSrc, fnDest)
+        if k < num_done - 1:
+            journal.done(fnSrc)
+    journal.f.write('{"done": "partly writ')
+    journal.close()
+    return journal.fn
+
+@pytest.mark.parametrize("mode", ["move", "copy"])
+def test_journal_resume(tmp_path, mode):
+    jobs = make_jobs(tmp_path, 10)
+    data = [contents(fnSrc) for fnSrc, fnDest in jobs]
+    fnJournal = interrupted(tmp_path, mode, jobs, 4)
+
+    jrnMode, jrnJobs, jrnSizes, jrnDone, jrnHashType = place_files.read_journal(fnJournal)
+    assert jrnMode == mode and jrnJobs == jobs and jrnHashType is None
+    assert jrnDone == set(fnSrc for fnSrc, fnDest in jobs[:3])
+    completed, remaining = place_files.resume_jobs(jrnMode, jrnJobs, jrnSizes, jrnDone)
+    ## A move whose source is gone is complete even without its journal line;
+    ## a copy without its line is done again
+    numCompleted = 4 if mode == "move" else 3
+    assert completed == jobs[:numCompleted] and remaining == jobs[numCompleted:]
+
+    journal = place_files.Journal(fnJournal)
+    journal.reopen()
+    assert place_files.place_files(remaining, jrnMode, 2, progressYN=False, journal=journal) == []
+    assert not os.path.exists(fnJournal)
+    assert [contents(fnDest) for fnSrc, fnDest in jobs] == data
+
+def test_resume_rechecks_sizes(tmp_path):
+    ## A placed file whose size doesn't match the plan is placed again
+    jobs = make_jobs(tmp_path, 3)
+    fnJournal = interrupted(tmp_path, "copy", jobs, 3)
+    with open(jobs[0][1], "wb") as f:
+        f.write(b"truncated")
+    completed, remaining = place_files.resume_jobs(*place_files.read_journal(fnJournal)[:4])
+    assert completed == jobs[1:2] and remaining == [jobs[0], jobs[2]]
+
+def test_slow_group_does_not_block_others(tmp_path, monkeypatch):
+    ## The copies from card 0 are stuck until every copy from card 1 is done.
+    ## With a pool of threads for each card, card 1 isn't held up.
+    jobs = make_jobs(tmp_path, 10)
+    groups = [i % 2 for i in range(len(jobs))]
+    release = threading.Event()
+    copy_file = place_files.copy_file
+    def slow_copy(fnSrc, fnDest, fsyncYN):
+        if groups[jobs.index((fnSrc, fnDest))] == 0:
+            release.wait(5)
+        return copy_file(fnSrc, fnDest, fsyncYN)
+    monkeypatch.setattr(place_files, "copy_file", slow_copy)
+    order = []
+    def done(fnSrc, fnDest):
+        order.append(groups[jobs.index((fnSrc, fnDest))])
+        if order.count(1) == 5:
+            release.set()
+    errors = place_files.place_files(jobs, "copy", 1, on_done=done, progressYN=False, groups=groups)
+    assert errors == []
+    assert order == [1] * 5 + [0] * 5
@@ -0,0 +1,107 @@
+## Tests of the projection setting and the built-in UTM projection
+
+import os
+import numpy as np
+import pytest
+import img_records, projection, uav_pipeline
+
+def records(points):
+    imgs = img_records.ImageRecords()
+    for i, (lon, lat) in enumerate(points):
+        imgs.append("%d.JPG" % i, i, lon, lat)
+    return imgs.finish()
+
+def test_parse_epsg():
+    assert uav_pipeline.parse_epsg("UTM") == "utm"
+    assert uav_pipeline.parse_epsg(" 32610 ") == 32610 and uav_pipeline.parse_epsg(4326) == 4326
+    assert uav_pipeline.parse_epsg("") == 0 and uav_pipeline.parse_epsg(0) == 0 and uav_pipeline.parse_epsg(None) == 0
+    for value in ["utm10", "-1", "4326.5", "EPSG:4326"]:
+        with pytest.raises(ValueError):
+            uav_pipeline.parse_epsg(value)
+
+def test_read_config(tmp_path):
+    fnConfig = os.path.join(str(tmp_path), "settings.ini")
+    for text, value in [("utm", "utm"), ("'32610'", 32610), ("", 0)]:
+        with open(fnConfig, "w") as f:
+            f.write("[options]\nprojEPSG = " + text + "\n")
+        opt = uav_pipeline.Options()
+        uav_pipeline.read_config(fnConfig, opt)
+        assert opt.projEPSG == value
+    with open(fnConfig, "w") as f:
+        f.write("[options]\nprojEPSG = zone 10\n")
+    with pytest.raises(ValueError):
+        uav_pipeline.read_config(fnConfig, uav_pipeline.Options())
+
+def test_bad_setting_is_logged():
+    imgs = records([(-122.3, 38.5)])
+    opt = uav_pipeline.Options()
+    opt.projEPSG = "zone 10"
+    msgs = []
+    uav_pipeline.project_images(imgs, opt, lambda msg, color=None: msgs.append(msg))
+    assert not imgs.projected()
+    assert "Can't project" in msgs[0]
+
+## Published UTM coordinates (WGS84): the first is the GeoConvert example in
+## GeographicLib, the rest are from PROJ 9.5 (rounded to a millimeter). They
+## cover both hemispheres, the central meridian and both edges of a zone.
+UTM_POINTS = [
+    (44.4, 33.3, 32638, 444140.545, 3684706.356),
+    (-122.3, 38.5, 32610, 561038.857, 4261525.547),
+    (-126.0, 45.0, 32610, 263553.974, 4987329.505),     # west edge of the zone
+    (-120.0001, 45.0, 32610, 736438.145, 4987329.213),  # east edge
+    (-123.0, 80.0, 32610, 500000.0, 8881585.816),
+    (3.0, 60.0, 32631, 500000.0, 6651411.190),
+    (18.42, -33.92, 32734, 261488.826, 6243716.333),
+    (21.0, -33.92, 32734, 500000.0, 6246714.206),
+    (146.0, -43.5, 32755, 419155.450, 5183172.958),
+    (150.0, -43.5, 32755, 742538.945, 5179285.742),     # east edge
+]
+
+def test_project_utm():
+    for lon, lat, epsg, x, y in UTM_POINTS:
+        px, py = projection.project_utm(np.array([lon]), np.array([lat]), epsg)
+        assert px[0] == pytest.approx(x, abs=1e-3) and py[0] == pytest.approx(y, abs=1e-3)
+    ## The equator on the central meridian is the origin of the zone
+    px, py = projection.project_utm(np.array([-123.0, -123.0]), np.array([0.0, -1e-9]), 32610)
+    assert px.tolist() == [500000.0, 500000.0] and py[0] == 0.0
+
+def test_project_without_libraries(monkeypatch):
+    monkeypatch.setattr(projection, "pyprojYN", False)
+    monkeypatch.setattr(projection, "osrYN", False)
+    lon, lat, epsg, x, y = UTM_POINTS[0]
+    px, py, method = projection.project([lon], [lat], epsg)
+    assert method == "built-in transverse Mercator" and px[0] == pytest.approx(x, abs=1e-3)
+    with pytest.raises(ValueError):
+        projection.project([lon], [lat], 3857)
+
+def test_utm_epsg():
+    assert projection.utm_epsg([44.4], [33.3]) == 32638
+    assert projection.utm_epsg([18.42], [-33.92]) == 32734
+    ## Zone edges belong to the zone to the east, and 180 wraps around to zone 1
+    assert projection.utm_epsg([-126.0], [45.0]) == 32610 and projection.utm_epsg([-120.0], [45.0]) == 32611
+    assert projection.utm_epsg([-180.0], [10.0]) == 32601 and projection.utm_epsg([180.0], [10.0]) == 32601
+    assert projection.utm_epsg([179.9], [-10.0]) == 32760
+    assert projection.utm_epsg([0.5], [0.0]) == 32631
+    ## The median point picks the zone, and missing coordinates are ignored
+    assert projection.utm_epsg([-122.9, -122.5, -119.0, np.nan], [38.0, np.nan, 38.2, 38.1]) == 32610
+    with pytest.raises(ValueError):
+        projection.utm_epsg([np.nan], [np.nan])
+    assert projection.utm_zone(32610) == (10, "N") and projection.utm_zone(32755) == (55, "S")
+    assert projection.utm_zone(4326) is None and projection.utm_zone(32661) is None
+
+def test_srs_wkt_without_libraries(monkeypatch):
+    monkeypatch.setattr(projection, "pyprojYN", False)
+    monkeypatch.setattr(projection, "osrYN", False)
+    assert projection.srs_wkt(4326) == projection.WGS84_WKT_OGC
+    assert projection.srs_wkt(4326, esri=True) == projection.WGS84_WKT_ESRI
+    assert projection.srs_wkt(3857) is None
+    wkt = projection.srs_wkt(32610)
+    assert wkt.startswith('PROJCS["WGS 84 / UTM zone 10N",' + projection.WGS84_WKT_OGC)
+    assert '"central_meridian",-123]' in wkt and '"false_northing",0]' in wkt and wkt.endswith('AUTHORITY["EPSG","32610"]]')
+    wkt = projection.srs_wkt(32755, esri=True)
+    assert wkt.startswith('PROJCS["WGS_1984_UTM_Zone_55S",' + projection.WGS84_WKT_ESRI)
+    assert '"Central_Meridian",147.0]' in wkt and '"False_Northing",10000000.0]' in wkt
+    for epsg, esri in [(32610, False), (32755, True)]:
+        wkt = projection.srs_wkt(epsg, esri)
+        assert wkt.count("[") == wkt.count("]")
+    assert projection.srs_name(32755) == "WGS 84 / UTM zone 55S" and projection.srs_name(3857) == "EPSG:3857"
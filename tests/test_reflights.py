@@ -0,0 +1,46 @@
+## Tests of the re-flight detection, against a brute force search
+
+import numpy as np
+import pytest
+import reflights
+
+## All the pairs within dist, from the distances between every two points
+def brute_force_pairs(x, y, dist):
+    d = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+    i, j = np.nonzero(np.triu(d <= dist, 1))
+    return dict(zip(zip(i.tolist(), j.tolist()), d[i, j].tolist()))
+
+def as_dict(i, j, d):
+    return dict(((min(a, b), max(a, b)), dist) for a, b, dist in zip(i.tolist(), j.tolist(), d.tolist()))
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pairs_within_random(seed):
+    rng = np.random.RandomState(seed)
+    n = 400
+    x = rng.uniform(-50, 50, n)
+    y = rng.uniform(-30, 70, n)
+    ## Some points on cell edges, some in the same place, some without coordinates
+    x[:20] = np.round(x[:20] / 2.0) * 2.0
+    y[:20] = np.round(y[:20] / 2.0) * 2.0
+    x[20:25] = x[25]
+    y[20:25] = y[25]
+    x[30] = np.nan
+    y[31] = np.nan
+    for dist in (0.5, 2.0, 7.5):
+        i, j, d = reflights.pairs_within(x, y, dist)
+        found = as_dict(i, j, d)
+        ## No pair is found twice
+        assert len(found) == len(i)
+        expected = brute_force_pairs(x, y, dist)
+        assert found.keys() == expected.keys()
+        assert all(abs(found[k] - expected[k]) < 1e-12 for k in expected)
+
+def test_pairs_within_few_points():
+    i, j, d = reflights.pairs_within(np.array([1.0]), np.array([2.0]), 5.0)
+    assert len(i) == len(j) == len(d) == 0
+    i, j, d = reflights.pairs_within(np.array([0.0, 3.0, np.nan]), np.array([0.0, 4.0, 0.0]), 5.0)
+    assert as_dict(i, j, d) == {(0, 1): 5.0}
+
+def test_heading_diff():
+    diff = reflights.heading_diff(np.array([10.0, 350.0, -170.0, np.nan]), np.array([350.0, 10.0, 170.0, 90.0]))
+    assert np.allclose(diff, [20.0, 20.0, 20.0, 0.0])
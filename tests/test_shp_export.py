@@ -0,0 +1,223 @@
+## Tests of the GIS file writers (shapefiles, the .qix index and GeoPackages),
+## reading the files back with struct and sqlite3
+
+import os, struct, sqlite3
+import numpy as np
+import shp_export
+
+FIELDS = [("fn", "str", 20), ("flight_id", "int", 0), ("Latitude", "real", 0)]
+
+def layer(n=30, seed=0):
+    rng = np.random.RandomState(seed)
+    xs = -122.0 + rng.rand(n)
+    ys = 38.0 + rng.rand(n)
+    records = [("IMG_%04d.JPG" % i, i % 3, float(ys[i])) for i in range(n)]
+    return xs, ys, records
+
+## Read the records of a .dbf file as lists of stripped strings
+def read_dbf(fnDbf):
+    with open(fnDbf, "rb") as f:
+        data = f.read()
+    n, hdr_len, rec_len = struct.unpack("<IHH", data[4:12])
+    fields = []
+    pos = 32
+    while data[pos] != 0x0D:
+        name = data[pos:pos + 11].split(b"\x00")[0].decode("ascii")
+        fields.append((name, data[pos + 11:pos + 12], data[pos + 16]))
+        pos = pos + 32
+    records = []
+    for k in range(n):
+        rec = data[hdr_len + k * rec_len + 1:hdr_len + (k + 1) * rec_len]
+        vals = []
+        for name, kind, width in fields:
+            vals.append(rec[:width].decode("utf-8").strip())
+            rec = rec[width:]
+        records.append(vals)
+    return fields, records
+
+## Read the points of a .shp file
+def read_shp_points(fnShp):
+    with open(fnShp, "rb") as f:
+        data = f.read()
+    code, = struct.unpack(">i", data[:4])
+    file_len, = struct.unpack(">i", data[24:28])
+    shape_type, = struct.unpack("<i", data[32:36])
+    pts = []
+    pos = 100
+    while pos < len(data):
+        num, length = struct.unpack(">ii", data[pos:pos + 8])
+        pts.append(struct.unpack("<idd", data[pos + 8:pos + 28])[1:])
+        pos = pos + 8 + 2 * length
+    return code, 2 * file_len, shape_type, pts
+
+def test_format_reals_non_finite():
+    col, decimals = shp_export.format_reals([1.5, float("inf"), float("-inf"), float("nan"), 1e300, -2.25])
+    assert col.dtype.itemsize == shp_export.REAL_WIDTH
+    vals = [v.decode("ascii").strip() for v in col.tolist()]
+    assert vals[1:5] == ["", "", "", ""]
+    assert float(vals[0]) == 1.5 and float(vals[5]) == -2.25
+    col, decimals = shp_export.format_reals([float("inf")])
+    assert col.tolist() == [b" " * shp_export.REAL_WIDTH]
+
+def test_format_strs_character_boundary():
+    ## 'é' is two bytes in UTF-8, so a cut at 5 bytes falls in the middle of the third one
+    col = shp_export.format_strs(["ééé", "abcdefg", ""], 5)
+    assert col.dtype.itemsize == 5
+    assert [v.decode("utf-8").rstrip() for v in col.tolist()] == ["éé", "abcde", ""]
+
+def test_shapefile_round_trip(tmp_path):
+    xs, ys, records = layer()
+    records[0] = ("Flüge_ñ", records[0][1], float("nan"))
+    fnShp = shp_export.write_layer_shp(str(tmp_path / "Flt01.shp"), FIELDS, records, (xs, ys))
+    code, size, shape_type, pts = read_shp_points(fnShp)
+    assert code == 9994 and size == os.path.getsize(fnShp) and shape_type == shp_export.SHP_POINT
+    assert np.array_equal(np.array(pts), np.column_stack((xs, ys)))
+
+    ## The .shx points at each record
+    with open(str(tmp_path / "Flt01.shx"), "rb") as f:
+        idx = np.frombuffer(f.read()[100:], dtype=[("offset", ">i4"), ("len", ">i4")])
+    assert (2 * idx["offset"]).tolist() == [100 + 28 * k for k in range(len(xs))]
+
+    fields, rows = read_dbf(str(tmp_path / "Flt01.dbf"))
+    assert [f[:2] for f in fields] == [("fn", b"C"), ("flight_id", b"N"), ("Latitude", b"N")]
+    assert len(rows) == len(records)
+    assert rows[0] == ["Flüge_ñ", "0", ""]
+    for row, rec in zip(rows[1:], records[1:]):
+        assert row[0] == rec[0] and int(row[1]) == rec[1] and abs(float(row[2]) - rec[2]) < 1e-12
+    with open(str(tmp_path / "Flt01.cpg")) as f:
+        assert f.read() == "UTF-8"
+
+## Read the parts of each shape in a line or polygon .shp file
+def read_shp_shapes(fnShp):
+    with open(fnShp, "rb") as f:
+        data = f.read()
+    shapes = []
+    pos = 100
+    while pos < len(data):
+        num, length = struct.unpack(">ii", data[pos:pos + 8])
+        shape_type, x0, y0, x1, y1, num_parts, num_points = struct.unpack("<i4dii", data[pos + 8:pos + 52])
+        starts = list(struct.unpack("<%di" % num_parts, data[pos + 52:pos + 52 + 4 * num_parts])) + [num_points]
+        xy = np.frombuffer(data[pos + 52 + 4 * num_parts:pos + 8 + 2 * length], dtype="<f8").reshape(-1, 2)
+        shapes.append((shape_type, (x0, y0, x1, y1), [xy[starts[i]:starts[i + 1]] for i in range(num_parts)]))
+        pos = pos + 8 + 2 * length
+    return shapes
+
+def test_line_and_polygon_round_trip(tmp_path):
+    line = np.array([[0.0, 0.0], [1.0, 2.0], [3.0, 1.0]])
+    shp_export.write_layer_shp(str(tmp_path / "lines.shp"), FIELDS[:1], [("Flt01",)], [line], geom_type="line")
+    shapes = read_shp_shapes(str(tmp_path / "lines.shp"))
+    assert len(shapes) == 1 and shapes[0][0] == 3 and shapes[0][1] == (0.0, 0.0, 3.0, 2.0)
+    assert np.array_equal(shapes[0][2][0], line)
+
+    ## A counter-clockwise outer ring and a clockwise hole are written the other way round
+    outer = np.array([[0.0, 0.0], [10.0, 0.0], [10.0, 10.0], [0.0, 10.0]])
+    hole = np.array([[2.0, 2.0], [2.0, 4.0], [4.0, 4.0], [4.0, 2.0]])
+    shp_export.write_layer_shp(str(tmp_path / "hulls.shp"), FIELDS[:1], [("Flt01",), ("Flt02",)],
+                               [[outer, hole], outer + 20.0], geom_type="polygon")
+    shapes = read_shp_shapes(str(tmp_path / "hulls.shp"))
+    assert [s[0] for s in shapes] == [5, 5]
+    rings = shapes[0][2]
+    assert len(rings) == 2 and len(shapes[1][2]) == 1
+    for ring in rings:
+        assert np.array_equal(ring[0], ring[-1])
+    assert shp_export.ring_area(rings[0]) < 0 and shp_export.ring_area(rings[1]) > 0
+    assert sorted(map(tuple, rings[0][:-1].tolist())) == sorted(map(tuple, outer.tolist()))
+    assert shapes[1][1] == (20.0, 20.0, 30.0, 30.0)
+    fields, rows = read_dbf(str(tmp_path / "hulls.dbf"))
+    assert rows == [["Flt01"], ["Flt02"]]
+
+## Walk a .qix quadtree, returning (bbox, ids, children) for the root node
+def read_qix(fnQix):
+    with open(fnQix, "rb") as f:
+        data = f.read()
+    assert data[:4] == b"SQT\x01"
+    n, depth = struct.unpack("<ii", data[8:16])
+    def node(pos):
+        offset, x0, y0, x1, y1, cnt = struct.unpack("<i4di", data[pos:pos + 40])
+        ids = list(struct.unpack("<%di" % cnt, data[pos + 40:pos + 40 + 4 * cnt]))
+        nsub, = struct.unpack("<i", data[pos + 40 + 4 * cnt:pos + 44 + 4 * cnt])
+        pos = pos + 44 + 4 * cnt
+        end = pos + offset
+        children = []
+        for k in range(nsub):
+            child, pos = node(pos)
+            children.append(child)
+        ## The offset skips all the subnodes
+        assert pos == end
+        return ((x0, y0, x1, y1), ids, children), pos
+    root, pos = node(16)
+    assert pos == len(data)
+    return n, depth, root
+
+def test_qix_covers_every_point(tmp_path):
+    xs, ys, records = layer(n=2000, seed=1)
+    xs[5] = np.nan
+    ## Points in the same place can't be split apart
+    xs[10:30] = xs[10]
+    ys[10:30] = ys[10]
+    shp_export.write_layer_shp(str(tmp_path / "Flt01.shp"), FIELDS, records, (xs, ys))
+    n, depth, root = read_qix(str(tmp_path / "Flt01.qix"))
+    assert n == len(xs) and depth > 1
+    found = []
+    def check(node, level):
+        (x0, y0, x1, y1), ids, children = node
+        ## Points are only in the leaves, and no leaf holds more than QIX_LEAF_SIZE unless it's at the maximum depth
+        assert (len(ids) == 0) != (len(children) == 0)
+        assert len(ids) <= shp_export.QIX_LEAF_SIZE or level == shp_export.QIX_MAX_DEPTH
+        for i in ids:
+            assert x0 <= xs[i] <= x1 and y0 <= ys[i] <= y1
+        found.extend(ids)
+        for child in children:
+            cx0, cy0, cx1, cy1 = child[0]
+            assert x0 <= cx0 and y0 <= cy0 and cx1 <= x1 and cy1 <= y1
+            check(child, level + 1)
+    check(root, 0)
+    assert sorted(found) == [i for i in range(len(xs)) if i != 5]
+
+def test_qix_empty_layer(tmp_path):
+    shp_export.write_qix(str(tmp_path / "empty.qix"), np.zeros(0), np.zeros(0))
+    n, depth, root = read_qix(str(tmp_path / "empty.qix"))
+    assert n == 0 and depth == 1 and root[1:] == ([], [])
+
+def test_geopackage_round_trip(tmp_path):
+    xs, ys, records = layer(n=500, seed=2)
+    line = np.column_stack((xs[:10], ys[:10]))
+    fnGpkg = shp_export.write_gpkg(str(tmp_path / "flights.gpkg"), [("Img", FIELDS, records, (xs, ys)),
+                                                                      ("Lines", FIELDS[:1], [("Flt01",)], [line], "line")])
+    conn = sqlite3.connect(fnGpkg)
+    try:
+        assert conn.execute("PRAGMA application_id").fetchone()[0] == 1196444487
+        assert sorted(r[0] for r in conn.execute("SELECT srs_id FROM gpkg_spatial_ref_sys")) == [-1, 0, 4326]
+        assert conn.execute("SELECT geometry_type_name, srs_id FROM gpkg_geometry_columns WHERE table_name = 'Img'").fetchone() == ("POINT", 4326)
+        bbox = conn.execute("SELECT min_x, min_y, max_x, max_y FROM gpkg_contents WHERE table_name = 'Img'").fetchone()
+        assert bbox == (xs.min(), ys.min(), xs.max(), ys.max())
+
+        rows = conn.execute('SELECT fid, geom, fn, flight_id, Latitude FROM "Img" ORDER BY fid').fetchall()
+        assert [r[2:] for r in rows] == records
+        for fid, geom, fn, flight_id, lat in rows:
+            magic, version, flags, srs_id, byte_order, wkb_type, x, y = struct.unpack("<2sBBiBIdd", geom)
+            assert (magic, flags, srs_id, wkb_type) == (b"GP", 1, 4326, 1)
+            assert (x, y) == (xs[fid - 1], ys[fid - 1])
+
+        geom = conn.execute('SELECT geom FROM "Lines"').fetchone()[0]
+        assert struct.unpack("<BII", geom[40:49]) == (1, 2, 10)
+        assert np.array_equal(np.frombuffer(geom[49:], dtype="<f8").reshape(-1, 2), line)
+
+        ## The R-tree finds the same points as a brute force search
+        x0, x1, y0, y1 = -121.8, -121.5, 38.2, 38.6
+        found = [r[0] for r in conn.execute("SELECT id FROM rtree_Img_geom WHERE maxx >= ? AND minx <= ? AND maxy >= ? AND miny <= ? ORDER BY id",
+                                            (x0, x1, y0, y1))]
+        assert found == (np.flatnonzero((xs >= x0) & (xs <= x1) & (ys >= y0) & (ys <= y1)) + 1).tolist()
+    finally:
+        conn.close()
+
+def test_geopackage_projected(tmp_path):
+    xs, ys, records = layer(n=5)
+    fnGpkg = shp_export.write_gpkg(str(tmp_path / "utm.gpkg"), [("Img", FIELDS, records, (xs * 1e5, ys * 1e5))], epsg=32610)
+    conn = sqlite3.connect(fnGpkg)
+    try:
+        ## WGS 84 is there even though the layers are in UTM
+        assert sorted(r[0] for r in conn.execute("SELECT srs_id FROM gpkg_spatial_ref_sys")) == [-1, 0, 4326, 32610]
+        assert conn.execute("SELECT srs_id FROM gpkg_contents").fetchone()[0] == 32610
+    finally:
+        conn.close()
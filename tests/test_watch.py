@@ -0,0 +1,95 @@
+## Tests of watch mode (watch-uav-imgs.py) and the folder watching helpers
+
+import os, json, time, importlib.util
+import folder_watch, uav_pipeline, make_synthetic_imgs
+
+fnScript = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "watch-uav-imgs.py")
+spec = importlib.util.spec_from_file_location("watch_uav_imgs", fnScript)
+watch = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(watch)
+
+def make_folder(tmp_path, n, flights):
+    fnDir = str(tmp_path)
+    make_synthetic_imgs.make_images(fnDir, n, flights, headerKB=1)
+    return fnDir, sorted(os.path.join(fnDir, fn) for fn in os.listdir(fnDir) if folder_watch.is_image(fn))
+
+def flight_files(fnDir):
+    return dict((fn, sorted(os.listdir(os.path.join(fnDir, fn)))) for fn in os.listdir(fnDir)
+                if os.path.isdir(os.path.join(fnDir, fn)))
+
+def test_repeated_files(tmp_path):
+    fnDir, fns = make_folder(tmp_path, 100, 1)
+    folder = watch.WatchedFolder(fnDir, uav_pipeline.Options())
+    folder.read(fns)
+    folder.read(fns[-5:])
+    folder.read(fns[-5:] + fns[-5:])
+    assert folder.collector.pending() == 100
+    folder.close(final=True)
+    folder.close_cache()
+    assert [len(flightImgs) for name, flightImgs in folder.flights] == [100]
+    assert list(flight_files(fnDir).values()) == [sorted(os.path.basename(fn) for fn in fns)]
+
+def test_restart(tmp_path):
+    fnDir, fns = make_folder(tmp_path, 60, 3)
+    folder = watch.WatchedFolder(fnDir, uav_pipeline.Options())
+    folder.read(fns)
+    folder.close(final=True)
+    folder.close_cache()
+    names = [name for name, flightImgs in folder.flights]
+    assert len(names) == 3
+
+    ## The flights keep their names and images after a restart, and images that
+    ## are still in the landing folder (e.g. after a copy) aren't read again
+    folder = watch.WatchedFolder(fnDir, uav_pipeline.Options())
+    assert [name for name, flightImgs in folder.flights] == names
+    assert len(folder.placed) == 60
+    folder.read(fns)
+    assert folder.collector.pending() == 0
+    folder.close_cache()
+
+def test_failed_images_on_restart(tmp_path):
+    fnDir, fns = make_folder(tmp_path, 40, 2)
+    folder = watch.WatchedFolder(fnDir, uav_pipeline.Options())
+    folder.read(fns)
+    folder.close(final=True)
+    folder.close_cache()
+    ## Mark the first flight's images as failed, as if they couldn't be moved
+    name, flightImgs = folder.flights[0]
+    folder.save({"flight": 0, "failed": [img[0] for img in flightImgs]})
+
+    folder = watch.WatchedFolder(fnDir, uav_pipeline.Options())
+    assert [len(flightImgs) for name, flightImgs in folder.flights] == [0, 20]
+    assert len(folder.placed) == 20
+    ts = [img[1] for img in folder.flights[1][1]]
+    assert folder.collector.closed[1] == [min(ts), max(ts)]
+
+    ## The failed images don't join their old flight when they're read again
+    folder.read([os.path.join(fnDir, name, img[0]) for img in flightImgs])
+    assert folder.collector.pending() == 20
+    folder.close_cache()
+
+def test_debouncer(tmp_path):
+    fn = os.path.join(str(tmp_path), "a.JPG")
+    with open(fn, "wb") as f:
+        f.write(b"x" * 10)
+    fnEmpty = os.path.join(str(tmp_path), "b.JPG")
+    open(fnEmpty, "wb").close()
+    debouncer = folder_watch.Debouncer(60)
+    debouncer.add([fn, fnEmpty, os.path.join(str(tmp_path), "missing.JPG")])
+    assert len(debouncer) == 2
+    assert debouncer.ready() == []
+
+    ## Files are ready once they've settled, but not while they're empty
+    debouncer.settle = 0
+    assert debouncer.ready() == [fn]
+    assert len(debouncer) == 1
+
+    ## A file that changed waits again, and one that disappeared is dropped
+    debouncer.settle = 60
+    debouncer.add([fn])
+    with open(fn, "ab") as f:
+        f.write(b"y")
+    assert debouncer.ready() == []
+    os.remove(fnEmpty)
+    debouncer.ready()
+    assert len(debouncer) == 1
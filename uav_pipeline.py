@@ -0,0 +1,670 @@
+## The steps of sorting and mapping a folder of images, shared by the interactive
+## script (parse-uav-imgs.py) and the batch script (batch-uav-imgs.py)
+## (c) Andy Lyons, 2017
+
+## Each step takes the options as an Options object, whose attributes have the
+## same names as the option variables at the top of parse-uav-imgs.py, and
+## reports what it's doing through a log function: log(msg, color=None), where
+## color is 'r' for errors (see print_log). Options can be saved to and read
+## from an INI config file, so the settings chosen in the interactive menu can be
+## used to run the batch script.
+
+import os, csv, ast, shutil
+from configparser import ConfigParser, Error as ConfigError
+import numpy as np
+import exif_reader, exiftool_pool, exif_cache, external_sort, place_files, projection, footprints, reflights
+import flight_groups, img_records, flight_geom, shp_export
+
+## The options and their defaults (the same as in parse-uav-imgs.py)
+OPTIONS = [
+    ("fnCSV", "exif_info.csv"),
+    ("csvCreateYN", False),
+    ("exiftool_workers", 0),
+    ("exif_cache_YN", True),
+    ("add_yaw", True),
+    ("m2s_YN", False),
+    ("m2s_ThreshUnits", "multiple of median sampling interval"),
+    ("m2s_ThreshVal", 10),
+    ("m2s_MoveCopy", "move"),
+    ("m2s_NumWorkers", 8),
+    ("m2s_FsyncPolicy", "none"),
+    ("m2s_VerifyCopyYN", False),
+    ("m2s_HashType", "blake2b"),
+    ("m2s_DivideTifJpgYN", False),
+    ("m2s_StreamKey", "none"),
+    ("m2s_DupDetectYN", False),
+    ("m2s_DupDistance", 2.0),
+    ("m2s_DupYawTol", 20),
+    ("dup_file_suffix", "_reflown.csv"),
+    ("m2s_SubDirJPG", "rgb"),
+    ("m2s_SubDirTIF", "mss"),
+    ("shpCreateYN", False),
+    ("m2s_FirstFlightNum", 1),
+    ("m2s_SubdirTemplate", "Flt{FltNum}_{StartTime}_{EndTime}"),
+    ("shape_file_suffix", "_pts.shp"),
+    ("shpWriter", "python"),
+    ("exportFormat", "shp"),
+    ("gpkg_file_suffix", "_imgs.gpkg"),
+    ("flightLinesYN", False),
+    ("flightLineTolerance", 1.0),
+    ("lines_file_suffix", "_flight_lines.shp"),
+    ("flightHullsYN", False),
+    ("hulls_file_suffix", "_flight_hulls.shp"),
+    ("projEPSG", 0),
+    ("coverageYN", False),
+    ("coverageMinImages", 5),
+    ("coverageCellSize", 0),
+    ("groundElevation", None),
+    ("cameraSensorWidth", 0),
+    ("coverage_file_suffix", "_coverage.asc"),
+    ("gaps_file_suffix", "_coverage_gaps.shp"),
+]
+DEFAULTS = dict(OPTIONS)
+
+## Section of the config file with the options
+CONFIG_SECTION = "options"
+
+class Options(object):
+    ## values is a dictionary (e.g. the globals() of the interactive script);
+    ## only the names in OPTIONS are used, the rest get their defaults
+    def __init__(self, values=None):
+        for name, value in OPTIONS:
+            setattr(self, name, value)
+        if values is not None:
+            self.update(values)
+
+    def update(self, values):
+        for name, value in OPTIONS:
+            if name in values:
+                setattr(self, name, values[name])
+
+    def items(self):
+        return [(name, getattr(self, name)) for name, value in OPTIONS]
+
+## Parse a value from a config file. Booleans can be yes/no, true/false, on/off
+## or 1/0, numbers and None are parsed as Python literals, and anything else is
+## a string (quotes are optional).
+def parse_option(text, default):
+    text = text.strip()
+    if isinstance(default, bool):
+        if text.lower() not in ConfigParser.BOOLEAN_STATES:
+            raise ValueError("not a boolean: " + text)
+        return ConfigParser.BOOLEAN_STATES[text.lower()]
+    try:
+        value = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+    return value if isinstance(value, (int, float, str)) or value is None else text
+
+## Parse the projection setting: 'utm' (the UTM zone of the images), 0 (none,
+## also for an empty value) or an EPSG code. Raises ValueError for anything else.
+def parse_epsg(value):
+    text = str(value).strip().strip('\'"')
+    if text.lower() == "utm":
+        return "utm"
+    if text == "" or text == "None":
+        return 0
+    if not text.isdigit():
+        raise ValueError("projEPSG must be 'utm', 0 or an EPSG code, not " + text)
+    return int(text)
+
+def new_config():
+    config = ConfigParser(interpolation=None)
+    config.optionxform = str    # option names are case sensitive
+    return config
+
+## Read the options from a config file into opt (any that are missing keep their
+## values). Returns the ConfigParser, so other sections (e.g. [batch]) can be read.
+## Raises ValueError if the file can't be read or has an unknown option.
+def read_config(fnConfig, opt):
+    config = new_config()
+    try:
+        if not config.read(fnConfig):
+            raise ValueError("can't read " + fnConfig)
+    except ConfigError as e:
+        raise ValueError(str(e))
+    if config.has_section(CONFIG_SECTION):
+        for name, text in config.items(CONFIG_SECTION):
+            if name not in DEFAULTS:
+                raise ValueError("unknown option in " + fnConfig + ": " + name)
+            setattr(opt, name, parse_option(text, DEFAULTS[name]))
+        opt.projEPSG = parse_epsg(opt.projEPSG)
+    return config
+
+## Save the options to a config file. extra is a dictionary of other sections
+## (each a dictionary of values) to add.
+def write_config(fnConfig, opt, extra=None):
+    config = new_config()
+    config[CONFIG_SECTION] = dict((name, str(value)) for name, value in opt.items())
+    for section, values in (extra or {}).items():
+        config[section] = values
+    with open(fnConfig, "w") as f:
+        config.write(f)
+    return fnConfig
+
+def print_log(msg, color=None):
+    print(msg)
+
+## Define tags in the image header (these work with all cameras tested so far)
+tagDateTimeOrig = "DateTimeOriginal"
+tagLat = "GPSLatitude"
+tagLong = "GPSLongitude"
+tagYawFlight = "FlightYawDegree"
+tagYawGimbal = "GimbalYawDegree"
+
+## Tags used to split the images into streams (optional)
+tagMake = "Make"
+tagModel = "Model"
+tagSerial = "SerialNumber"
+
+## Tags used to estimate the footprint of each image (optional)
+tagAltGPS = "GPSAltitude"
+tagAltRel = "RelativeAltitude"    # DJI, relative to the takeoff point
+tagFocal = "FocalLength"
+tagFocal35 = "FocalLengthIn35mmFormat"
+tagImgWidth = "ExifImageWidth"
+tagImgHeight = "ExifImageHeight"
+tagsCamera = [tagAltGPS, tagAltRel, tagFocal, tagFocal35, tagImgWidth, tagImgHeight]
+
+required_flds = [tagDateTimeOrig, tagLong, tagLat]
+
+## Notes
+## GoPro Hero4 also has -GPSDateStamp -GPSTimeStamp (UTC time)
+
+## All the tags that are read
+def tag_list(add_yaw=True):
+    return required_flds + ([tagYawFlight, tagYawGimbal] if add_yaw else []) + [tagMake, tagModel, tagSerial] + tagsCamera
+
+## True if exiftool is installed (it's only needed for images the built-in reader can't parse)
+def exiftool_available():
+    return shutil.which("exiftool") is not None
+
+## Parse and validate a row of header info. Returns the values of the image, in
+## the order ImageRecords.append takes them, or raises ValueError with the
+## required tags that are missing or invalid.
+def parse_row(row, add_yaw=True):
+    # SourceFile, FileName, DateTimeOriginal, GPSLatitude, GPSLongitude
+    badTags = []
+
+    try:
+        ts = img_records.parse_datetime(row.get(tagDateTimeOrig, ""))
+    except ValueError:
+        badTags.append(tagDateTimeOrig)
+
+    try:
+        lon = float(row.get(tagLong, ""))
+    except ValueError:
+        badTags.append(tagLong)
+
+    try:
+        lat = float(row.get(tagLat, ""))
+    except ValueError:
+        badTags.append(tagLat)
+
+    if len(badTags) > 0:
+        raise ValueError(", ".join(badTags))
+    if add_yaw:
+        yaw = (img_records.parse_float(row.get(tagYawFlight)), img_records.parse_float(row.get(tagYawGimbal)))
+    else:
+        yaw = (float("nan"), float("nan"))
+    camera = tuple(img_records.parse_float(row.get(tag)) for tag in tagsCamera)
+    cameraIds = (row.get(tagMake, ""), row.get(tagModel, ""), row.get(tagSerial, ""))
+    return (row['FileName'], ts, lon, lat) + yaw + camera + cameraIds
+
+## Read the header info of a list of images: from the cache (if not None) for
+## images that haven't changed since the last run, in-process for the rest, and
+## with exiftool for any images that couldn't be parsed. This is a generator that
+## yields (row, None) for each image that was read (as soon as it's read, and
+## after saving it in the cache), and (None, fn) for images that couldn't be.
+## Raises IOError if exiftool fails.
+def iter_headers(fns, tagsAll, exifCache=None, exiftool_workers=0, log=print_log):
+    if exifCache is not None:
+        cached_rows, fnsNew = exifCache.lookup(fns, tagsAll)
+        if len(cached_rows) > 0:
+            log("Header info for " + str(len(cached_rows)) + " image(s) found in " + exifCache.fn)
+        for row in cached_rows:
+            yield row, None
+        cached_rows = None
+    else:
+        fnsNew = fns
+
+    ## Read the headers in-process, then use exiftool for any images that couldn't be parsed
+    fnsExiftool = []
+    for row, fn in exif_reader.iter_files(fnsNew, tagsAll, required_flds):
+        if row is None:
+            fnsExiftool.append(fn)
+        else:
+            if exifCache is not None:
+                exifCache.store([row])
+            yield row, None
+
+    if len(fnsExiftool) > 0 and not exiftool_available():
+        log(str(len(fnsExiftool)) + " image(s) could not be read without exiftool and will be excluded", "r")
+        for fn in fnsExiftool:
+            yield None, fn
+    elif len(fnsExiftool) > 0:
+        log("Running exiftool on " + str(len(fnsExiftool)) + " image(s)...")
+        exiftoolPool = exiftool_pool.ExiftoolPool(exiftool_workers)
+        try:
+            for row in exiftoolPool.imap_rows(fnsExiftool, tagsAll):
+                if exifCache is not None:
+                    exifCache.store([row])
+                yield row, None
+        finally:
+            exiftoolPool.close()
+
+## Read the header info of the images in a folder (see iter_headers). Each row
+## is validated as it comes in, and added to an ImageRecords (a column-oriented
+## store, see img_records.py), which is returned sorted by time, along with the
+## list of required tags that weren't found in any image and the list of images
+## that were left out. Raises IOError if exiftool fails.
+def read_images(fnInputDir, opt, log=print_log):
+    tagsAll = tag_list(opt.add_yaw)
+    imgs = img_records.ImageRecords()
+    tagsFound = set()
+    excluded = []
+
+    ## Optionally save the header info to a csv file as it's read
+    if opt.csvCreateYN:
+        fCSV = open(os.path.join(fnInputDir, opt.fnCSV), "w", newline="")
+        csvWriter = csv.DictWriter(fCSV, fieldnames=["SourceFile", "FileName"] + tagsAll, extrasaction="ignore", restval="")
+        csvWriter.writeheader()
+    exifCache = exif_cache.ExifCache(fnInputDir) if opt.exif_cache_YN else None
+
+    try:
+        for row, fn in iter_headers(exif_reader.list_images(fnInputDir), tagsAll, exifCache, opt.exiftool_workers, log):
+            if row is None:
+                excluded.append(os.path.basename(fn))
+                continue
+            tagsFound.update(tag for tag in tagsAll if row.get(tag, "") != "")
+            if opt.csvCreateYN:
+                csvWriter.writerow(row)
+            try:
+                imgs.append(*parse_row(row, opt.add_yaw))
+            except ValueError as e:
+                excluded.append(row['FileName'])
+                log(row['FileName'] + " will be excluded. Invalid EXIF tag(s): " + str(e), "r")
+    finally:
+        if exifCache is not None:
+            exifCache.commit()
+            exifCache.close()
+        if opt.csvCreateYN:
+            fCSV.close()
+
+    ## Sort the images by time
+    imgs.sort_by_time()
+    return imgs, [fld for fld in required_flds if fld not in tagsFound], excluded
+
+## The images split into streams (see flight_groups.py), with the sampling
+## intervals of the stream with the most images (the primary stream)
+class StreamInfo(object):
+    def __init__(self, imgs, key):
+        ## One stream for all the images if key is 'none'
+        self.key = key
+        self.streams, self.names = flight_groups.make_streams([imgs.field_codes(fld) for fld in flight_groups.stream_fields(key)], len(imgs))
+        self.medians = flight_groups.stream_medians(imgs.ts, self.streams, len(self.names))
+        self.primary = flight_groups.primary_stream(self.streams)
+
+        ## Compute the time interval between images (of the primary stream)
+        self.timediffs = flight_groups.time_diffs(imgs.ts[self.streams == self.primary])
+        self.median_interval = self.medians[self.primary]
+
+        ## Sort the gaps once, so the number of flights for any threshold is a binary search
+        self.sorted_gaps = flight_groups.sorted_gaps(self.timediffs)
+        self.knee = flight_groups.knee_threshold(self.sorted_gaps, self.median_interval)
+
+    ## Number of images in each stream
+    def counts(self):
+        return np.bincount(self.streams, minlength=len(self.names))
+
+## The time threshold (gap, seconds) that starts a new flight, of the primary
+## stream and of each stream (an array, or a number if it's in seconds)
+def thresholds(opt, si):
+    if opt.m2s_ThreshUnits == "multiple of median sampling interval":
+        thresh_abs = opt.m2s_ThreshVal * si.median_interval
+        threshStreams = np.array([opt.m2s_ThreshVal * (med if med is not None else si.median_interval) for med in si.medians])
+    else:
+        thresh_abs = opt.m2s_ThreshVal
+        threshStreams = thresh_abs
+    return thresh_abs, threshStreams
+
+## Make the flights. Returns a list containing lists with two elements: i) an
+## array of indices from imgs, and ii) constructed subdir name (just one 'flight'
+## named 'all' if the images aren't being moved into subdirectories).
+def group_flights(imgs, opt, si):
+    if not opt.m2s_YN:
+        return [[np.arange(len(imgs)), "all"]]
+    thresh_abs, threshStreams = thresholds(opt, si)
+    return flight_groups.make_flights(imgs.ts, imgs.fns(), threshStreams, opt.m2s_SubdirTemplate, opt.m2s_FirstFlightNum,
+                                      opt.m2s_DivideTifJpgYN and si.key == "none", opt.m2s_SubDirTIF, opt.m2s_SubDirJPG,
+                                      si.streams, si.names, opt.m2s_DivideTifJpgYN and si.key != "none")
+
+## Base name of the files saved in the input directory (the name of the directory)
+def input_last_dir(fnInputDir):
+    return os.path.basename(os.path.normpath(fnInputDir))
+
+## FIND RE-FLOWN IMAGES (see reflights.py)
+## Images from different flights (time gaps) within m2s_DupDistance and m2s_DupYawTol
+## of each other are reported and saved in a csv file. Returns an array with the
+## name of the earlier image for each duplicate ('' for the others), for the
+## Dup_Of field of the shapefiles, and the number of duplicates.
+def find_reflown(fnInputDir, imgs, flights, opt, si, log=print_log):
+    thresh_abs, threshStreams = thresholds(opt, si)
+    fltNum = flight_groups.flight_numbers(imgs.ts, si.streams, threshStreams)
+    dupOf, dupDist, dupYaw = reflights.find_duplicates(imgs, fltNum, opt.m2s_DupDistance, opt.m2s_DupYawTol, si.streams)
+    numDups = int((dupOf >= 0).sum())
+    log("Re-flown images (within " + str(opt.m2s_DupDistance) + " m and " + str(opt.m2s_DupYawTol) + " degrees of an image from an earlier flight): " + str(numDups))
+    for i, (fltDups, fltEarlier) in enumerate(reflights.overlap_report(flights, dupOf)):
+        if fltDups > 0:
+            log("   - " + flights[i][1] + ": " + str(fltDups) + " of " + str(len(flights[i][0])) + " images (" +
+                ", ".join(flights[k][1] + ": " + str(n) for k, n in sorted(fltEarlier.items())) + ")")
+    if numDups > 0:
+        fnDupCsv = reflights.write_csv(os.path.join(fnInputDir, input_last_dir(fnInputDir) + opt.dup_file_suffix), imgs, flights, dupOf, dupDist, dupYaw)
+        log("Saved the list of re-flown images to " + fnDupCsv)
+    imgFns = np.array(imgs.fns(), dtype=object)
+    return np.where(dupOf >= 0, imgFns[dupOf], ""), numDups
+
+## The (source, destination) of each image, and the flight subdirectories that already exist
+def plan_placements(fnInputDir, imgs, flights):
+    placements = []
+    existing = []
+    for fnSubDir in set(flight_info[1] for flight_info in flights):
+        if os.path.exists(os.path.join(fnInputDir, fnSubDir)):
+            existing.append(fnSubDir)
+    for flight_info in flights:
+        fnSubDirFullPath = os.path.join(fnInputDir, flight_info[1])
+        for j in flight_info[0]:
+            placements.append((os.path.join(fnInputDir, imgs.fn(j)), os.path.join(fnSubDirFullPath, imgs.fn(j))))
+    return placements, sorted(existing)
+
+## Move or copy the images into their flight subdirectories. The subdirectories
+## are created and the files placed by a pool of threads (see place_files.py),
+## keeping a journal so the placements can be resumed if they're interrupted.
+## The header cache of the folder is updated (exifCache if it's already open).
+## Returns a list of (fnSrc, fnDest, error) for any files that failed.
+def place_images(fnInputDir, placements, opt, progressYN=True, exifCache=None):
+    closeCacheYN = opt.exif_cache_YN and exifCache is None
+    if closeCacheYN:
+        exifCache = exif_cache.ExifCache(fnInputDir)
+    if opt.exif_cache_YN:
+        placed = exifCache.moved if opt.m2s_MoveCopy == "move" else exifCache.copied
+    else:
+        placed = None
+    journal = place_files.Journal(os.path.join(fnInputDir, place_files.fnJournal))
+    if opt.m2s_MoveCopy == "copy" and opt.m2s_VerifyCopyYN:
+        manifests = place_files.Manifests(opt.m2s_HashType)
+    else:
+        manifests = None
+    try:
+        return place_files.place_files(placements, opt.m2s_MoveCopy, opt.m2s_NumWorkers, opt.m2s_FsyncPolicy, placed,
+                                       progressYN, journal=journal, manifests=manifests)
+    finally:
+        if closeCacheYN:
+            exifCache.close()
+        elif opt.exif_cache_YN:
+            exifCache.commit()
+
+## Summary of an unfinished move or copy (mode, number of files, number already
+## placed), or None if there isn't one in the folder
+def unfinished_placement(fnInputDir):
+    fnJournalFullPath = os.path.join(fnInputDir, place_files.fnJournal)
+    if not os.path.exists(fnJournalFullPath):
+        return None
+    jrnMode, jrnJobs, jrnSizes, jrnDone, jrnHashType = place_files.read_journal(fnJournalFullPath)
+    jrnCompleted, jrnRemaining = place_files.resume_jobs(jrnMode, jrnJobs, jrnSizes, jrnDone)
+    return jrnMode, len(jrnJobs), len(jrnCompleted)
+
+## Finish a move or copy that was interrupted, from its journal. Returns a list of
+## (fnSrc, fnDest, error) for any files that failed.
+def resume_placement(fnInputDir, opt, progressYN=True):
+    fnJournalFullPath = os.path.join(fnInputDir, place_files.fnJournal)
+    jrnMode, jrnJobs, jrnSizes, jrnDone, jrnHashType = place_files.read_journal(fnJournalFullPath)
+    jrnCompleted, jrnRemaining = place_files.resume_jobs(jrnMode, jrnJobs, jrnSizes, jrnDone)
+    if opt.exif_cache_YN:
+        exifCache = exif_cache.ExifCache(fnInputDir)
+        placed = exifCache.moved if jrnMode == "move" else exifCache.copied
+        for fnSrc, fnDest in jrnCompleted:
+            placed(fnSrc, fnDest)
+    else:
+        placed = None
+    if jrnHashType is not None:
+        manifests = place_files.Manifests(jrnHashType)
+        errors = place_files.verify_placed(jrnCompleted, manifests)
+    else:
+        manifests = None
+        errors = []
+    journal = place_files.Journal(fnJournalFullPath)
+    journal.reopen()
+    try:
+        errors.extend(place_files.place_files(jrnRemaining, jrnMode, opt.m2s_NumWorkers, opt.m2s_FsyncPolicy, placed,
+                                              progressYN, journal=journal, manifests=manifests))
+    finally:
+        if opt.exif_cache_YN:
+            exifCache.close()
+    return errors
+
+## PROJECT THE COORDINATES (all at once, see projection.py)
+## The coverage analysis is done in meters, so it needs projected coordinates
+def project_images(imgs, opt, log=print_log):
+    projEPSG = opt.projEPSG
+    if opt.coverageYN and not projEPSG:
+        log("The coverage analysis needs projected coordinates, projecting to the UTM zone of the images")
+        projEPSG = "utm"
+    if projEPSG:
+        try:
+            projEPSGCode = projection.utm_epsg(imgs.lon, imgs.lat) if str(projEPSG).lower() == "utm" else parse_epsg(projEPSG)
+            projX, projY, projMethod = projection.project(imgs.lon, imgs.lat, projEPSGCode)
+            imgs.set_xy(projX, projY, projEPSGCode)
+            log("Projected the image centroids to EPSG:" + str(projEPSGCode) + " (" + projMethod + ")")
+        except ValueError as e:
+            log("Can't project the image centroids: " + str(e) + ". Exporting WGS84 long/lat.", "r")
+
+## COVERAGE ANALYSIS (see footprints.py)
+## Returns the Coverage, or None if it couldn't be done
+def coverage_analysis(fnInputDir, imgs, flights, opt, log=print_log):
+    if not imgs.projected():
+        log("Skipping the coverage analysis (the images couldn't be projected)", "r")
+        return None
+    log("Estimating image footprints and coverage")
+    coverageHulls = [hull[0] for hull in (flight_geom.flight_hull(imgs.x, imgs.y, flight_info[0], True) for flight_info in flights) if hull is not None]
+    coverageResult = footprints.coverage_analysis(imgs, coverageHulls, opt.coverageMinImages, opt.coverageCellSize, opt.groundElevation, opt.cameraSensorWidth)
+    if coverageResult is None:
+        log("No footprints could be estimated. Images need RelativeAltitude (or GPSAltitude and groundElevation) "
+            "and FocalLengthIn35mmFormat (or FocalLength and cameraSensorWidth).", "r")
+        return None
+    fnAsc = os.path.join(fnInputDir, input_last_dir(fnInputDir) + opt.coverage_file_suffix)
+    footprints.write_asc(fnAsc, coverageResult.counts, coverageResult.grid, projection.srs_wkt(imgs.epsg, esri=True))
+    log("Created " + fnAsc + " (" + str(coverageResult.num_footprints) + " footprints, " + str(coverageResult.grid.cell) + " m cells)")
+    pctGaps = 100.0 * coverageResult.gap_cells / max(coverageResult.hull_cells, 1)
+    log("  " + "%.1f%%" % pctGaps + " of the flight area is covered by fewer than " + str(opt.coverageMinImages) +
+        " images (" + str(len(coverageResult.gaps)) + " gaps)")
+    return coverageResult
+
+## CREATE POINT SHAPEFILE OF IMAGE CENTROIDS (and the other layers)
+## changed is a list of the flights (indices) whose point shapefiles are written,
+## default all (the GeoPackage and the other layers always have all the flights).
+## Returns the list of files created.
+def export_layers(fnInputDir, imgs, flights, opt, dupOfFns=None, coverageResult=None, changed=None):
+    fnInputLastDir = input_last_dir(fnInputDir)
+    if opt.exportFormat == "gpkg":
+        ## All the flights go in one GeoPackage, with a flight_id column and a spatial index
+        fnGpkg = os.path.join(fnInputDir, fnInputLastDir + opt.gpkg_file_suffix)
+        gpkgLayers = [("images",) + shp_export.flights_point_layer(imgs, flights, opt.add_yaw, dupOfFns)]
+        if opt.flightLinesYN:
+            gpkgLayers.append(("flight_lines",) + shp_export.flight_lines_layer(imgs, flights, opt.flightLineTolerance) + ("line",))
+        if opt.flightHullsYN:
+            gpkgLayers.append(("flight_hulls",) + shp_export.flight_hulls_layer(imgs, flights) + ("polygon",))
+        if coverageResult is not None:
+            gpkgLayers.append(("coverage_gaps",) + shp_export.coverage_gaps_layer(coverageResult) + ("polygon",))
+        shp_export.write_gpkg(fnGpkg, gpkgLayers, imgs.epsg)
+        return [fnGpkg]
+
+    ## Construct the layer for each flight, then write them in parallel (see shp_export.py)
+    shpJobs = []
+    for k, flight_info in enumerate(flights):
+        if changed is not None and k not in changed:
+            continue
+        if opt.m2s_YN:
+            fnShp = flight_shp_path(fnInputDir, flight_info[1], opt)
+        else:
+            fnShp = os.path.join(fnInputDir, fnInputLastDir + opt.shape_file_suffix)
+        shpJobs.append((fnShp,) + shp_export.point_layer(imgs, flight_info[0], opt.add_yaw, dupOfFns))
+    if opt.flightLinesYN:
+        ## The flight lines of all the flights go in one shapefile in the input directory
+        shpJobs.append((os.path.join(fnInputDir, fnInputLastDir + opt.lines_file_suffix),) + shp_export.flight_lines_layer(imgs, flights, opt.flightLineTolerance) + ("line",))
+    if opt.flightHullsYN:
+        shpJobs.append((os.path.join(fnInputDir, fnInputLastDir + opt.hulls_file_suffix),) + shp_export.flight_hulls_layer(imgs, flights) + ("polygon",))
+    if coverageResult is not None:
+        shpJobs.append((os.path.join(fnInputDir, fnInputLastDir + opt.gaps_file_suffix),) + shp_export.coverage_gaps_layer(coverageResult) + ("polygon",))
+
+    return shp_export.write_layers(shpJobs, shp_writer(opt), opt.m2s_NumWorkers, imgs.epsg)
+
+## The point shapefile of a flight, in its subdirectory
+def flight_shp_path(fnInputDir, name, opt):
+    return os.path.join(fnInputDir, name, (name + opt.shape_file_suffix).replace(os.sep, "_"))
+
+## The shapefile writer to use (see shp_export.py)
+def shp_writer(opt):
+    if opt.shpWriter == "ogr" and shp_export.gdalYN:
+        return shp_export.write_layer_ogr
+    return shp_export.write_layer_shp
+
+## SORT A VERY LARGE FOLDER (out of core, see external_sort.py)
+## What happened to the folder
+class LargeFolderSummary(object):
+    def __init__(self):
+        self.num_images = 0
+        self.num_excluded = 0
+        self.tags_missing = []
+        self.num_flights = 0
+        self.flights = []    # names of the flight subdirectories (as in group_flights)
+        self.skipped = []    # flights whose subdirectory already existed
+        self.num_placed = 0
+        self.errors = []
+        self.outputs = []
+
+## The headers are read runSize images at a time into sorted runs on disk (in
+## tmpdir, default the system's temp folder), which are merged by time. If the
+## threshold is a multiple of the median sampling interval, a first pass over the
+## merged images finds the median; a second pass splits them into flights, and
+## each flight is placed and its point shapefile exported as soon as it ends, so
+## only one run or one flight is held in memory at a time. Streams, re-flown
+## images, coverage, flight lines and hulls and the GeoPackage need all the images
+## at once, so they aren't done. Flights whose subdirectory already exists are
+## skipped unless overwrite. Returns a LargeFolderSummary.
+def sort_large_folder(fnInputDir, opt, runSize=100000, tmpdir=None, overwrite=True, log=print_log):
+    summary = LargeFolderSummary()
+    tagsAll = tag_list(opt.add_yaw)
+    tagsFound = set()
+    runs = external_sort.RecordRuns(runSize, tmpdir)
+    exifCache = exif_cache.ExifCache(fnInputDir) if opt.exif_cache_YN else None
+    if opt.csvCreateYN:
+        fCSV = open(os.path.join(fnInputDir, opt.fnCSV), "w", newline="")
+        csvWriter = csv.DictWriter(fCSV, fieldnames=["SourceFile", "FileName"] + tagsAll, extrasaction="ignore", restval="")
+        csvWriter.writeheader()
+
+    ## Only one flight at a time is exported, so just the point shapefiles
+    flightOpt = Options(dict(opt.items()))
+    flightOpt.exportFormat = "shp"
+    flightOpt.flightLinesYN = False
+    flightOpt.flightHullsYN = False
+    flightOpt.coverageYN = False
+
+    try:
+        ## READ THE HEADERS into sorted runs
+        for fnsChunk in iter_chunks(exif_reader.iter_images(fnInputDir), runs.run_size):
+            for row, fn in iter_headers(fnsChunk, tagsAll, exifCache, opt.exiftool_workers, log):
+                if row is None:
+                    summary.num_excluded = summary.num_excluded + 1
+                    continue
+                tagsFound.update(tag for tag in tagsAll if row.get(tag, "") != "")
+                if opt.csvCreateYN:
+                    csvWriter.writerow(row)
+                try:
+                    runs.add(*parse_row(row, opt.add_yaw))
+                except ValueError as e:
+                    summary.num_excluded = summary.num_excluded + 1
+                    log(row['FileName'] + " will be excluded. Invalid EXIF tag(s): " + str(e), "r")
+            if exifCache is not None:
+                exifCache.commit()
+        runs.flush()
+        summary.num_images = len(runs)
+        summary.tags_missing = [fld for fld in required_flds if fld not in tagsFound]
+        log("Read " + str(len(runs)) + " images into " + str(len(runs.runs)) + " sorted run(s)")
+        if len(runs) == 0 or len(summary.tags_missing) > 0:
+            return summary
+
+        ## FIND THE MEDIAN SAMPLING INTERVAL (first pass over the merged runs)
+        if opt.m2s_ThreshUnits == "multiple of median sampling interval":
+            intervals = external_sort.IntervalCounts()
+            for img in runs.merged():
+                intervals.add(img[1])
+            medianInterval = intervals.median()
+            log("Median sampling interval: " + str(medianInterval) + " seconds")
+            thresh_abs = opt.m2s_ThreshVal * medianInterval if medianInterval is not None else float("inf")
+        else:
+            thresh_abs = opt.m2s_ThreshVal
+        if not opt.m2s_YN:
+            log("The images aren't being moved into flight subdirectories, so nothing will be placed or exported")
+
+        ## MAKE THE FLIGHTS (second pass), placing and exporting each one as it ends
+        log("Flights (a gap of at least " + str(thresh_abs) + " seconds starts a new flight):")
+        flightImgs = img_records.ImageRecords()
+        lastTs = None
+        for img in runs.merged():
+            if lastTs is not None and img[1] - lastTs >= thresh_abs:
+                finish_large_flight(fnInputDir, flightImgs, flightOpt, summary, overwrite, exifCache, log)
+                flightImgs = img_records.ImageRecords()
+            flightImgs.append(*img)
+            lastTs = img[1]
+        finish_large_flight(fnInputDir, flightImgs, flightOpt, summary, overwrite, exifCache, log)
+    finally:
+        runs.close()
+        if exifCache is not None:
+            exifCache.commit()
+            exifCache.close()
+        if opt.csvCreateYN:
+            fCSV.close()
+    return summary
+
+## Split an iterable into lists of up to size items
+def iter_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+## Place and export one flight of a large folder (see sort_large_folder)
+def finish_large_flight(fnInputDir, imgs, opt, summary, overwrite, exifCache, log=print_log):
+    imgs.finish()
+    firstNum = opt.m2s_FirstFlightNum + summary.num_flights
+    name = flight_groups.flight_names(imgs.ts, np.array([0]), np.array([len(imgs) - 1]), opt.m2s_SubdirTemplate, firstNum)[0]
+    summary.num_flights = summary.num_flights + 1
+    log("   - " + name + " (" + str(len(imgs)) + ")")
+    if not opt.m2s_YN:
+        summary.flights.append(name)
+        return
+
+    ## The whole flight (an infinite threshold), split into TIF and JPG subdirectories if needed
+    flights = flight_groups.make_flights(imgs.ts, imgs.fns(), float("inf"), opt.m2s_SubdirTemplate, firstNum,
+                                         opt.m2s_DivideTifJpgYN, opt.m2s_SubDirTIF, opt.m2s_SubDirJPG)
+    summary.flights.extend(flight_info[1] for flight_info in flights)
+    placements, existingSubDirs = plan_placements(fnInputDir, imgs, flights)
+    if len(existingSubDirs) > 0 and not overwrite:
+        log("     skipped, its subdirectory already exists", "r")
+        summary.skipped.append(name)
+        return
+    errors = place_images(fnInputDir, placements, opt, False, exifCache)
+    summary.num_placed = summary.num_placed + len(placements) - len(errors)
+    summary.errors.extend(errors)
+
+    if opt.shpCreateYN:
+        ## Every flight goes in the UTM zone of the first one
+        if str(opt.projEPSG).lower() == "utm":
+            opt.projEPSG = projection.utm_epsg(imgs.lon, imgs.lat)
+        project_images(imgs, opt, lambda msg, color=None: log(msg, color) if color is not None else None)
+        summary.outputs.extend(export_layers(fnInputDir, imgs, flights, opt))
@@ -0,0 +1,311 @@
+## Sort and Map UAV Images as they arrive
+## (c) Andy Lyons, 2017
+
+## Watches a landing folder (e.g. where cards are offloaded through the day) and
+## sorts the images into flights as they arrive. The header of each new image is
+## read once it has finished copying, and the images are kept in time order as
+## they come in. As soon as an image arrives from after a gap of at least the
+## flight threshold, the flight before the gap is closed: its images are moved (or
+## copied) into its subdirectory and its shapefile exported, so the day's flights
+## are already sorted and mapped by the time the last card has been copied. The
+## last flight is closed once no new images have arrived for a while. The
+## flights are saved in the folder, so the script can be stopped and started
+## again without numbering or copying anything twice.
+
+## Usage:
+## python watch-uav-imgs.py "D:\Drone Projects\Landing"
+## python watch-uav-imgs.py "D:\Drone Projects\Landing" settings.ini
+## Press Ctrl-C to stop.
+
+## The settings are read from a config file like the one used by
+## batch-uav-imgs.py (press 'w' in the menu of parse-uav-imgs.py to save one).
+## Images are always put into flight subdirectories; re-flown images, coverage,
+## and separating streams or JPGs and TIFs into subdirectories aren't done in
+## this mode (run parse-uav-imgs.py on the folder for those). An optional
+## [watch] section has:
+##   settleSecs = seconds a new file's size must stay the same before it's read
+##   idleSecs = close the last flight after this many seconds without new images
+##   pollSecs = how often the folder is scanned if it can't be watched with inotify
+##   polling = yes to always scan the folder (e.g. for network drives)
+##   exitWhenIdle = yes to stop once the last flight has been closed
+
+import os, sys, time, json
+import numpy as np
+import exif_cache, img_records, flight_groups, folder_watch, projection, shp_export, uav_pipeline
+
+## The [watch] settings and their defaults
+WATCH_DEFAULTS = [
+    ("settleSecs", 3.0),
+    ("idleSecs", 600),
+    ("pollSecs", 5.0),
+    ("polling", False),
+    ("exitWhenIdle", False),
+]
+WATCH_SECTION = "watch"
+
+def log(msg, color=None):
+    print(time.strftime("%H:%M:%S") + " " + msg)
+    sys.stdout.flush()
+
+## Read the watch settings from the config file
+def watch_settings(config):
+    settings = dict(WATCH_DEFAULTS)
+    if config is not None and config.has_section(WATCH_SECTION):
+        for name, text in config.items(WATCH_SECTION):
+            if name not in settings:
+                raise ValueError("unknown setting in [" + WATCH_SECTION + "]: " + name)
+            settings[name] = uav_pipeline.parse_option(text, settings[name])
+    return settings
+
+## File in the watched folder where the flights are saved (see WatchedFolder)
+fnWatchState = "watch_state.jsonl"
+
+## The images of a watched folder and the flights they've been sorted into. The
+## flights are saved in a state file in the folder, with a line appended each
+## time images are added to a flight (before they're placed), so after a restart
+## the flights keep their numbers, late images can still join them, and images
+## that were copied aren't copied again.
+class WatchedFolder(object):
+    def __init__(self, fnInputDir, opt):
+        self.fnInputDir = fnInputDir
+        self.opt = opt
+        self.tagsAll = uav_pipeline.tag_list(opt.add_yaw)
+        self.exifCache = exif_cache.ExifCache(fnInputDir) if opt.exif_cache_YN else None
+        self.collector = flight_groups.FlightCollector(opt.m2s_ThreshVal, opt.m2s_ThreshUnits)
+        self.flights = []    # name and list of images (tuples of values, see uav_pipeline.parse_row) of each closed flight
+        self.layers = []     # layers of each flight (see flight_layers), None until they're needed
+        self.placed = set()    # file names of the images in the flights
+        self.pending = set()    # file names of the images in the collector
+        self.fnState = os.path.join(fnInputDir, fnWatchState)
+        self.load_state()
+
+    ## Read the flights saved in the state file
+    def load_state(self):
+        if not os.path.exists(self.fnState):
+            return
+        with open(self.fnState) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break    # the last line was cut short
+                if "epsg" in entry:
+                    if str(self.opt.projEPSG).lower() == "utm":
+                        self.opt.projEPSG = entry["epsg"]
+                elif "failed" in entry:
+                    failed = set(entry["failed"])
+                    flightImgs = self.flights[entry["flight"]][1]
+                    flightImgs[:] = [img for img in flightImgs if img[0] not in failed]
+                else:
+                    k = entry["flight"]
+                    if k == len(self.flights):
+                        self.flights.append([entry["name"], []])
+                    self.flights[k][1].extend(tuple(img) for img in entry["imgs"])
+        for name, flightImgs in self.flights:
+            flightImgs.sort(key=lambda img: img[1])
+            self.placed.update(img[0] for img in flightImgs)
+            self.collector.add_closed([img[1] for img in flightImgs])
+        self.layers = [None] * len(self.flights)
+        if len(self.flights) > 0:
+            log("Found " + str(len(self.flights)) + " flight(s) from before (" + str(len(self.placed)) + " images)")
+
+    def save(self, entry):
+        with open(self.fnState, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    ## Read the headers of new images, and add them to the collector (or to a
+    ## flight that was already closed, see FlightCollector.add). Images that are
+    ## already in a flight (the originals of copied images) or waiting in the
+    ## collector (e.g. reported again before their flight was closed) are skipped.
+    def read(self, fns):
+        names = set()
+        new = []
+        for fn in fns:
+            name = os.path.basename(fn)
+            if name not in self.placed and name not in self.pending and name not in names:
+                names.add(name)
+                new.append(fn)
+        fns = new
+        if len(fns) == 0:
+            return
+        imgs = []
+        for row, fn in uav_pipeline.iter_headers(fns, self.tagsAll, self.exifCache, self.opt.exiftool_workers, log):
+            if row is None:
+                continue
+            try:
+                imgs.append(uav_pipeline.parse_row(row, self.opt.add_yaw))
+            except ValueError as e:
+                log(row['FileName'] + " will be excluded. Invalid EXIF tag(s): " + str(e))
+        if self.exifCache is not None:
+            self.exifCache.commit()
+        log("Read " + str(len(imgs)) + " new image(s)")
+        late = {}
+        for img, k in self.collector.add(imgs):
+            late.setdefault(k, []).append(img)
+        self.pending.update(img[0] for img in imgs)
+        for k in sorted(late):
+            log(str(len(late[k])) + " image(s) belong to " + self.flights[k][0] + ", which was already closed")
+            self.add_to_flight(k, late[k])
+
+    ## Close the flights that are complete (or all of them if final), and place
+    ## and export each one
+    def close(self, final=False):
+        for flightImgs in self.collector.close_flights(final):
+            k = len(self.flights)
+            ts = np.array([img[1] for img in flightImgs], dtype=np.int64)
+            name = flight_groups.flight_names(ts, np.array([0]), np.array([len(ts) - 1]), self.opt.m2s_SubdirTemplate, self.opt.m2s_FirstFlightNum + k)[0]
+            log("Closed flight " + name + " (" + str(len(flightImgs)) + " images)")
+            self.flights.append([name, []])
+            self.layers.append(None)
+            self.add_to_flight(k, flightImgs)
+
+    ## Move or copy images into the subdirectory of a closed flight, and export it
+    def add_to_flight(self, k, imgs):
+        name, flightImgs = self.flights[k]
+        self.save({"flight": k, "name": name, "imgs": imgs})
+        placements = [(os.path.join(self.fnInputDir, img[0]), os.path.join(self.fnInputDir, name, img[0])) for img in imgs]
+        errors = uav_pipeline.place_images(self.fnInputDir, placements, self.opt, False, self.exifCache)
+        for fnSrc, fnDest, e in errors:
+            log("Error placing " + fnSrc + ": " + str(e))
+        failed = set(fnSrc for fnSrc, fnDest, e in errors)
+        if len(failed) > 0:
+            self.save({"flight": k, "failed": sorted(os.path.basename(fn) for fn in failed)})
+        flightImgs.extend(img for img, (fnSrc, fnDest) in zip(imgs, placements) if fnSrc not in failed)
+        flightImgs.sort(key=lambda img: img[1])
+        self.placed.update(img[0] for img, (fnSrc, fnDest) in zip(imgs, placements) if fnSrc not in failed)
+        self.pending.difference_update(img[0] for img in imgs)
+        self.layers[k] = None
+        log(("Moved " if self.opt.m2s_MoveCopy == "move" else "Copied ") + str(len(placements) - len(errors)) + " image(s) into " + name)
+        if self.opt.shpCreateYN:
+            self.export([k])
+
+    ## Project the images of a flight. If they go to the UTM zone the images fall
+    ## in, the zone of the first flight is saved and used for all of them, so
+    ## every flight (and the files with all of them) has the same coordinates.
+    def project(self, imgs):
+        if str(self.opt.projEPSG).lower() == "utm" and len(imgs) > 0:
+            self.opt.projEPSG = int(projection.utm_epsg(imgs.lon, imgs.lat))
+            self.save({"epsg": self.opt.projEPSG})
+        if self.opt.projEPSG:
+            uav_pipeline.project_images(imgs, self.opt, log)
+
+    ## The layers of one flight: its EPSG code, point layer, and flight line and
+    ## hull layers (None if they aren't exported)
+    def flight_layers(self, k):
+        name, flightImgs = self.flights[k]
+        imgs = img_records.ImageRecords()
+        for img in flightImgs:
+            imgs.append(*img)
+        imgs.finish()
+        self.project(imgs)
+        idx = np.arange(len(imgs))
+        flight = [[idx, name]]
+        lines = shp_export.flight_lines_layer(imgs, flight, self.opt.flightLineTolerance) if self.opt.flightLinesYN else None
+        hulls = shp_export.flight_hulls_layer(imgs, flight) if self.opt.flightHullsYN else None
+        return imgs.epsg, shp_export.point_layer(imgs, idx, self.opt.add_yaw), lines, hulls
+
+    ## Join the flight lines (j = 2) or hulls (j = 3) of all the flights into one
+    ## layer, with the flights numbered 1, 2, ... as in shp_export
+    def join_flights(self, j):
+        records = []
+        shapes = []
+        for k, layers in enumerate(self.layers):
+            fields, flt_records, flt_shapes = layers[j]
+            records.extend(rec[:1] + (k + 1,) + rec[2:] for rec in flt_records)
+            shapes.extend(flt_shapes)
+        return fields, records, shapes
+
+    ## Export the flights that changed. The layers of each flight are kept, so
+    ## only the changed flights are built again; the files with all the flights
+    ## (the flight lines and hulls, or the GeoPackage) are written from the kept layers.
+    def export(self, changed):
+        for k in range(len(self.flights)):
+            if self.layers[k] is None:
+                self.layers[k] = self.flight_layers(k)
+        names = [name for name, flightImgs in self.flights]
+        epsg = self.layers[0][0]
+        fnInputLastDir = uav_pipeline.input_last_dir(self.fnInputDir)
+        if self.opt.exportFormat == "gpkg":
+            gpkgLayers = [("images",) + shp_export.join_point_layers(names, [layers[1] for layers in self.layers], self.layers[0][1][0])]
+            if self.opt.flightLinesYN:
+                gpkgLayers.append(("flight_lines",) + self.join_flights(2) + ("line",))
+            if self.opt.flightHullsYN:
+                gpkgLayers.append(("flight_hulls",) + self.join_flights(3) + ("polygon",))
+            outputs = [shp_export.write_gpkg(os.path.join(self.fnInputDir, fnInputLastDir + self.opt.gpkg_file_suffix), gpkgLayers, epsg)]
+        else:
+            jobs = [(uav_pipeline.flight_shp_path(self.fnInputDir, names[k], self.opt),) + self.layers[k][1] for k in changed]
+            if self.opt.flightLinesYN:
+                jobs.append((os.path.join(self.fnInputDir, fnInputLastDir + self.opt.lines_file_suffix),) + self.join_flights(2) + ("line",))
+            if self.opt.flightHullsYN:
+                jobs.append((os.path.join(self.fnInputDir, fnInputLastDir + self.opt.hulls_file_suffix),) + self.join_flights(3) + ("polygon",))
+            outputs = shp_export.write_layers(jobs, uav_pipeline.shp_writer(self.opt), self.opt.m2s_NumWorkers, epsg)
+        for fn in outputs:
+            log("Created " + fn)
+
+    def close_cache(self):
+        if self.exifCache is not None:
+            self.exifCache.close()
+
+def main(argv):
+    if len(argv) < 2:
+        print("Usage: python watch-uav-imgs.py folder [config.ini]")
+        return 1
+    fnInputDir = argv[1].strip('\'"')
+    if not os.path.isdir(fnInputDir):
+        print(fnInputDir + " is not a directory.")
+        return 1
+    opt = uav_pipeline.Options()
+    try:
+        config = uav_pipeline.read_config(argv[2], opt) if len(argv) > 2 else None
+        settings = watch_settings(config)
+    except ValueError as e:
+        print("Error reading the config file: " + str(e))
+        return 1
+    ## Flights always go into subdirectories, and the steps that need all the images at once are skipped
+    opt.m2s_YN = True
+    opt.m2s_DupDetectYN = False
+    opt.coverageYN = False
+
+    ## Finish a move or copy that was interrupted the last time
+    if uav_pipeline.unfinished_placement(fnInputDir) is not None:
+        log("Resuming an unfinished move or copy")
+        for fnSrc, fnDest, e in uav_pipeline.resume_placement(fnInputDir, opt, False):
+            log("Error placing " + fnSrc + ": " + str(e))
+
+    watcher, method = folder_watch.make_watcher(fnInputDir, settings["polling"], settings["pollSecs"])
+    debouncer = folder_watch.Debouncer(settings["settleSecs"])
+    folder = WatchedFolder(fnInputDir, opt)
+    log("Watching " + fnInputDir + " (" + method + "), press Ctrl-C to stop")
+
+    ## Images that are already in the folder
+    debouncer.add(folder_watch.folder_images(fnInputDir))
+    lastNew = time.time()
+    try:
+        while True:
+            fns = watcher.wait(1.0)
+            if len(fns) > 0:
+                debouncer.add(fns)
+                lastNew = time.time()
+            ready = debouncer.ready()
+            if len(ready) > 0:
+                folder.read(ready)
+                folder.close()
+                lastNew = time.time()
+            if len(debouncer) == 0 and time.time() - lastNew >= settings["idleSecs"]:
+                if folder.collector.pending() > 0:
+                    log("No new images for " + str(settings["idleSecs"]) + " seconds")
+                    folder.close(final=True)
+                if settings["exitWhenIdle"]:
+                    break
+    except KeyboardInterrupt:
+        if folder.collector.pending() > 0:
+            log("Stopped. " + str(folder.collector.pending()) + " image(s) whose flight wasn't closed were left in " + fnInputDir)
+        else:
+            log("Stopped")
+    finally:
+        watcher.close()
+        folder.close_cache()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))